@@ -0,0 +1,73 @@
+"""
+Record live search and detail pages of every supported portal as benchmark fixtures.
+With MERCADOLIBRE_API_URL set, MercadoLibre's API search and items responses are
+recorded too.
+
+Usage: python benchmarks/record.py [--urls urls_to_scrap.txt]
+"""
+import argparse
+import json
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from scraper import create_scraper, extract_ads  # noqa: E402
+from sites import get_adapter, set_mercadolibre_api  # noqa: E402
+from utils import load_environment, load_urls  # noqa: E402
+
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record benchmark fixtures from the live portals.")
+    parser.add_argument("--urls", default="urls_to_scrap.txt", help="search URLs, one per line")
+    args = parser.parse_args()
+
+    index_fp = os.path.join(FIXTURES_DIR, 'index.json')
+    index = json.load(open(index_fp)) if os.path.exists(index_fp) else {}
+    env = load_environment()
+    set_mercadolibre_api(env['mercadolibre_api_url'], env['mercadolibre_token'])
+    scraper = create_scraper()
+    for url in load_urls(args.urls):
+        adapter = get_adapter(url)
+        if not adapter:
+            continue
+        site = adapter.domain.split('.')[0]
+        print(f"Recording {site}: {url}")
+        search_html = scraper.get(adapter.page_url(url, 1)).text
+        ads = extract_ads(url, search_html)
+        if not ads:
+            print(f"No ads found on {url}, skipping")
+            continue
+        detail_url = ads[0]['url']
+        detail_html = scraper.get(detail_url).text
+        os.makedirs(os.path.join(FIXTURES_DIR, site), exist_ok=True)
+        for name, html in (('search', search_html), ('detail', detail_html)):
+            with open(os.path.join(FIXTURES_DIR, site, f'{name}.html'), 'w') as f:
+                f.write(html)
+        entry = {
+            'search_url': url, 'search': f'{site}/search.html',
+            'detail_url': detail_url, 'detail': f'{site}/detail.html',
+        }
+        # API responses recorded earlier are kept unless recorded again
+        entry.update({name: path for name, path in index.get(site, {}).items() if name.startswith('api_')})
+        api_url = adapter.api_search_url(url, 1)
+        if api_url:
+            headers = adapter.api_headers()
+            api_search = scraper.get(api_url, headers=headers).text
+            api_ads = adapter.extract_api_ads(url, api_search)[:adapter.api_batch_size]
+            api_items = scraper.get(adapter.api_items_url([ad['url'] for ad in api_ads]), headers=headers).text
+            for name, text in (('api_search', api_search), ('api_items', api_items)):
+                with open(os.path.join(FIXTURES_DIR, site, f'{name}.json'), 'w') as f:
+                    f.write(text)
+                entry[name] = f'{site}/{name}.json'
+        index[site] = entry
+    with open(index_fp, 'w') as f:
+        json.dump(index, f, indent=2)
+    print(f"Fixtures written to {FIXTURES_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""
+Offline benchmark suite: times the extractors on the fixture pages, runs the
+whole scraper against a local stand-in HTTP server serving those fixtures, and
+measures the start-up cost (wall time, peak RSS) of the scraper's processes.
+
+Usage: python benchmarks/run.py [--iterations 50] [--latency 0.05] [--baseline results/old.json]
+       python benchmarks/run.py --mercadolibre-api    # MercadoLibre through its fixture API responses
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import notifier  # noqa: E402
+from metrics import METRICS  # noqa: E402
+import scraper  # noqa: E402
+import scraprop  # noqa: E402
+from sites import set_parser_backend  # noqa: E402
+
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+EMPTY_PAGE = b"<html><body></body></html>"
+# What each kind of process runs at start-up: the bare interpreter, the imports
+# of the entry point, a parse worker and the pipeline, and a whole scraper run
+# (importing scraprop and running main() against the fixture server)
+STARTUP_STATEMENTS = {
+    'interpreter': 'pass',
+    'entry_point': 'import scraprop',
+    'parse_worker': 'import scraper',
+    'pipeline': 'import pipeline',
+    'scrape': 'sys.path.insert(0, {bench!r}); import run; run.run_end_to_end(run.load_fixtures(), 0, {rate_limits!r})',
+}
+# Peak RSS in KB: VmHWM where /proc has it, as ru_maxrss also counts the forking
+# parent's memory on Linux; ru_maxrss (in bytes on macOS) elsewhere
+STARTUP_PROBE = """
+import json, os, resource, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+if os.path.exists('/proc/self/status'):
+    rss = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmHWM:'))
+else:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == 'darwin' else 1)
+print(json.dumps([seconds, rss, 'pandas' in sys.modules]))
+"""
+# Where the MercadoLibre API is served by the stand-in server with --mercadolibre-api
+API_URL = 'https://api.mercadolibre.com'
+
+
+def load_fixtures():
+    """Fixture index with the HTML of every fixture page, and the fixture API responses, loaded."""
+    with open(os.path.join(FIXTURES_DIR, 'index.json')) as f:
+        index = json.load(f)
+    for entry in index.values():
+        for name in ('search', 'detail'):
+            with open(os.path.join(FIXTURES_DIR, entry[name]), encoding='utf-8') as f:
+                entry[name + '_html'] = f.read()
+        for name in ('api_search', 'api_items'):
+            if name in entry:
+                with open(os.path.join(FIXTURES_DIR, entry[name]), encoding='utf-8') as f:
+                    entry[name + '_json'] = json.load(f)
+    return index
+
+
+def summarize(durations):
+    """Throughput and latency percentiles of a list of call durations in seconds."""
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        'calls': len(ordered),
+        'per_second': round(len(ordered) / total, 2) if total else None,
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+    }
+
+
+def time_calls(func, args, iterations):
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(*args)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def run_extractors(fixtures, iterations):
+    results = {}
+    for site, entry in fixtures.items():
+        results[site] = {
+            'extract_ads': time_calls(scraper.extract_ads, (entry['search_url'], entry['search_html']), iterations),
+            'extract_property_details': time_calls(
+                scraper.extract_property_details, (entry['detail_url'], entry['detail_html']), iterations),
+            'parse_search_details': time_calls(scraper.parse_search_details, (entry['search_url'],), iterations * 20),
+        }
+    return results
+
+
+def fast_speedup(extractors):
+    """How many times faster the fast backend is than the full one, by site and function (p50)."""
+    return {
+        site: {function: round(stats['p50_ms'] / extractors['fast'][site][function]['p50_ms'], 2)
+               for function, stats in functions.items() if function != 'parse_search_details'}
+        for site, functions in extractors['full'].items()
+    }
+
+
+def run_startup(repeats, rate_limits):
+    """
+    Wall time and peak RSS of a fresh interpreter running each process's
+    start-up statement, as the median of `repeats` runs, and whether it loaded
+    pandas. The scrape uses `rate_limits` and serves the fixtures without latency.
+    """
+    results = {}
+    for name, statement in STARTUP_STATEMENTS.items():
+        statement = statement.format(bench=BENCH_DIR, rate_limits=rate_limits)
+        probe = STARTUP_PROBE.format(src=os.path.abspath(SRC_DIR), statement=statement)
+        samples = [json.loads(subprocess.check_output([sys.executable, '-c', probe]).splitlines()[-1])
+                   for _ in range(repeats)]
+        results[name] = {
+            'statement': statement,
+            'wall_ms': round(statistics.median(seconds for seconds, _, _ in samples) * 1000, 1),
+            'peak_rss_mb': round(statistics.median(rss for _, rss, _ in samples) / 1024, 1),
+            'loads_pandas': any(pandas for _, _, pandas in samples),
+        }
+    return results
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Serves the fixtures at http://host:port/<original host>/<original path>: the
+    first page of each search gets its fixture page, ads found on it get the
+    site's fixture detail page, and anything else an empty page. The API host
+    replays the fixture API responses: the first results page of any search,
+    and the fixture items of a multiget's ids.
+    """
+    daemon_threads = True
+
+    def __init__(self, fixtures, latency):
+        super().__init__(('127.0.0.1', 0), FixtureHandler)
+        self.latency = latency
+        self.pages = {}
+        self.api_search = None
+        self.api_items = {}
+        self.requests = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        for entry in fixtures.values():
+            search_html = entry['search_html'].encode('utf-8')
+            detail_html = entry['detail_html'].encode('utf-8')
+            self.pages[scraper.page_url(entry['search_url'], 1)] = search_html
+            self.pages[entry['detail_url']] = detail_html
+            for ad in scraper.extract_ads(entry['search_url'], entry['search_html']):
+                self.pages[ad['url']] = detail_html
+            if 'api_search_json' in entry:
+                self.api_search = entry['api_search_json']
+            for item in entry.get('api_items_json', []):
+                self.api_items[item['body']['id']] = item
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = 'https://' + self.path.lstrip('/')
+        content_type = 'text/html; charset=utf-8'
+        if url.startswith(API_URL + '/'):
+            body, content_type = json.dumps(self.api_response(url)).encode('utf-8'), 'application/json'
+        else:
+            body = self.server.pages.get(url, EMPTY_PAGE)
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes += len(body)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def api_response(self, url):
+        parts = urlsplit(url)
+        params = parse_qs(parts.query)
+        if parts.path == '/items':
+            ids = params.get('ids', [''])[0].split(',')
+            return [self.server.api_items.get(item_id, {'code': 404, 'body': {'message': f"Item {item_id} not found"}})
+                    for item_id in ids]
+        if params.get('offset', ['0'])[0] == '0' and self.server.api_search:
+            return self.server.api_search
+        return {'paging': {'total': 0}, 'results': []}
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalSession(requests.Session):
+    """Session that sends every request to the fixture server instead of the portal."""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        local = f"{self.base_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+        return super().request(method, local, *args, **kwargs)
+
+
+def run_end_to_end(fixtures, latency, rate_limits, mercadolibre_api=False):
+    """Run scraprop.main() from a scratch directory against the fixture server."""
+    server = FixtureServer(fixtures, latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    notifications = []
+    patches = {
+        (scraper, 'create_scraper'): lambda: LocalSession(server.base_url),
+        (notifier.TelegramNotifier, 'post'): lambda self, chat_id, text: notifications.append(text) or (200, None, None),
+        # Telegram pacing is not part of what is measured
+        (notifier, 'CHAT_RATE'): 1000.0,
+    }
+    originals = {target: getattr(*target) for target in patches}
+    cwd = os.getcwd()
+    env = {'TELEGRAM_BOT_ID': 'bench', 'TELEGRAM_ID': 'bench', 'RATE_LIMITS': rate_limits,
+           'MERCADOLIBRE_API_URL': API_URL if mercadolibre_api else ''}
+    saved_env = {key: os.environ.get(key) for key in env}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            os.environ.update(env)
+            with open('urls_to_scrap.txt', 'w') as f:
+                f.write('\n'.join(entry['search_url'] for entry in fixtures.values()) + '\n')
+            for (owner, name), value in patches.items():
+                setattr(owner, name, value)
+            log = io.StringIO()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(log):
+                scraprop.main()
+            wall = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        for (owner, name), value in originals.items():
+            setattr(owner, name, value)
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        server.shutdown()
+        server.server_close()
+    return {
+        'wall_seconds': round(wall, 3),
+        'requests': server.requests,
+        'bytes': server.bytes,
+        # Bytes the scraper actually read: less than served when detail pages are streamed
+        'bytes_read': int(sum(METRICS.counters.get('http_bytes_total', {}).values())),
+        'notifications': len(notifications),
+        'latency_seconds': latency,
+        'rate_limits': rate_limits,
+        'mercadolibre_api': mercadolibre_api,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline):
+    """Print the relative change of every timing against a previous results file."""
+    print(f"\nCompared to {baseline.get('revision')} ({baseline.get('timestamp')}):")
+    for backend, sites in results['extractors'].items():
+        for site, functions in sites.items():
+            for function, stats in functions.items():
+                old = baseline.get('extractors', {}).get(backend, {}).get(site, {}).get(function)
+                if old and old.get('p50_ms'):
+                    change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+                    print(f"  {backend:5} {site:13} {function:25} p50 {old['p50_ms']:9.3f} -> {stats['p50_ms']:9.3f} ms ({change:+.1f}%)")
+    for name, stats in results.get('startup', {}).items():
+        old = baseline.get('startup', {}).get(name)
+        if old and 'wall_ms' in old:
+            print(f"  startup {name:13} wall {old['wall_ms']} -> {stats['wall_ms']} ms, "
+                  f"peak RSS {old['peak_rss_mb']} -> {stats['peak_rss_mb']} MB")
+    old = baseline.get('end_to_end')
+    new = results.get('end_to_end')
+    if old and new:
+        change = (new['wall_seconds'] - old['wall_seconds']) / old['wall_seconds'] * 100
+        print(f"  end-to-end wall {old['wall_seconds']}s -> {new['wall_seconds']}s ({change:+.1f}%), "
+              f"requests {old['requests']} -> {new['requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scraper against the fixture pages.")
+    parser.add_argument("--iterations", type=int, default=50, help="calls per extractor and fixture")
+    parser.add_argument("--backends", default="fast,full", help="parser backends to time, comma separated")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stand-in server waits per response")
+    parser.add_argument("--rate-limits", default="zonaprop.com.ar=50:10:4,argenprop.com=50:10:4,mercadolibre.com.ar=50:10:4,"
+                                                  "api.mercadolibre.com=50:10:4",
+                        help="RATE_LIMITS used for the end-to-end run")
+    parser.add_argument("--mercadolibre-api", action="store_true",
+                        help="read MercadoLibre through its fixture API responses in the end-to-end run")
+    parser.add_argument("--skip-e2e", action="store_true", help="only time the extractors")
+    parser.add_argument("--startup-repeats", type=int, default=5,
+                        help="fresh interpreters started per start-up measurement (0 skips them)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'iterations': args.iterations,
+        'extractors': {},
+    }
+    for backend in args.backends.split(','):
+        set_parser_backend(backend)
+        results['extractors'][backend] = run_extractors(fixtures, args.iterations)
+        for site, functions in results['extractors'][backend].items():
+            for function, stats in functions.items():
+                print(f"{backend:5} {site:13} {function:25} {stats['per_second']:10.1f}/s "
+                      f"p50 {stats['p50_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms")
+    set_parser_backend('fast')
+    if {'fast', 'full'} <= set(results['extractors']):
+        results['fast_speedup'] = fast_speedup(results['extractors'])
+        for site, functions in results['fast_speedup'].items():
+            print(f"fast vs full {site:13} " + "  ".join(f"{function} x{ratio}" for function, ratio in functions.items()))
+    if args.startup_repeats > 0:
+        results['startup'] = run_startup(args.startup_repeats, args.rate_limits)
+        for name, stats in results['startup'].items():
+            print(f"startup {name:13} wall {stats['wall_ms']:8.1f} ms  peak RSS {stats['peak_rss_mb']:6.1f} MB"
+                  f"{'  (loads pandas)' if stats['loads_pandas'] else ''}")
+    if not args.skip_e2e:
+        results['end_to_end'] = run_end_to_end(fixtures, args.latency, args.rate_limits, args.mercadolibre_api)
+        e2e = results['end_to_end']
+        print(f"end-to-end: {e2e['wall_seconds']}s, {e2e['requests']} requests, "
+              f"{e2e['bytes']} bytes served ({e2e['bytes_read']} read), {e2e['notifications']} notifications")
+
+    output = args.output or os.path.join(RESULTS_DIR, results['timestamp'].replace(':', '') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
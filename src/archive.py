@@ -0,0 +1,219 @@
+"""
+Archive Module: Content-addressed store of the raw pages fetched by the scraper,
+and offline re-extraction of the archived pages through the current extractors.
+
+Pages are compressed with zstd when the optional `zstandard` package is
+installed, and with zlib otherwise. Identical pages are stored once; an SQLite
+index records which URL each page was fetched from and when.
+
+    python src/archive.py stats
+    python src/archive.py reextract [--kind detail] [--workers 8] [--dry-run]
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from scraper import extract_ads, extract_property_details, merge_details, needs_details, set_parser_backend
+from storage import DETAIL_FIELDS, ListingStore
+
+KINDS = ('search', 'detail')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (url, digest)
+);
+CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (url, fetched_at);
+"""
+
+
+def _compress(data: bytes) -> Tuple[bytes, str]:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), '.zst'
+    return zlib.compress(data, 6), '.zz'
+
+
+def _decompress(data: bytes, suffix: str) -> bytes:
+    if suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst archive entries")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class PageArchive:
+    """
+    Raw pages under `root`: objects/<2 hex>/<sha256> blobs and an index.sqlite
+    mapping (url, digest) to the last time that content was fetched. Safe to
+    share between threads.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite'), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def put(self, url: str, kind: str, html: str, fetched_at: str) -> str:
+        """Archive a fetched page. Returns its digest."""
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not any(os.path.exists(path + suffix) for suffix in ('.zst', '.zz')):
+            blob, suffix = _compress(data)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, path + suffix)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO pages (url, kind, digest, fetched_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(url, digest) DO UPDATE SET fetched_at = excluded.fetched_at",
+                (url, kind, digest, fetched_at),
+            )
+        return digest
+
+    def get(self, digest: str) -> str:
+        """The HTML of an archived page."""
+        path = self._path(digest)
+        for suffix in ('.zst', '.zz'):
+            if os.path.exists(path + suffix):
+                with open(path + suffix, 'rb') as f:
+                    return _decompress(f.read(), suffix).decode('utf-8')
+        raise KeyError(digest)
+
+    def latest(self, kind: Optional[str] = None) -> List[Tuple[str, str, str, str]]:
+        """The most recently fetched (url, kind, digest, fetched_at) of every archived URL."""
+        query = ("SELECT url, kind, digest, MAX(fetched_at) FROM pages "
+                 + ("WHERE kind = ? " if kind else "") + "GROUP BY url ORDER BY url")
+        with self.lock:
+            return self.conn.execute(query, (kind,) if kind else ()).fetchall()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            pages, urls, blobs = self.conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT url), COUNT(DISTINCT digest) FROM pages").fetchone()
+        size = 0
+        for directory, _, files in os.walk(os.path.join(self.root, 'objects')):
+            size += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+        return {'fetches': pages, 'urls': urls, 'blobs': blobs, 'bytes': size}
+
+
+# Archive opened by each re-extraction worker process
+_ARCHIVE = None
+
+
+def _init_worker(root: str, backend: str) -> None:
+    global _ARCHIVE
+    set_parser_backend(backend)
+    _ARCHIVE = PageArchive(root)
+
+
+def _reextract(entry: Tuple[str, str, str, str]) -> Tuple[str, str, List[Dict], Optional[str]]:
+    """Run one archived page through the current extractors, in a worker process."""
+    url, kind, digest, fetched_at = entry
+    try:
+        html = _ARCHIVE.get(digest)
+        if kind == 'search':
+            # Only complete cards carry every field; the rest came from detail pages
+            records = [ad for ad in extract_ads(url, html) if not needs_details(ad)]
+        else:
+            records = [extract_property_details(url, html)]
+    except Exception as e:
+        return url, kind, [], str(e)
+    for record in records:
+        record['scraped_at'] = fetched_at
+    return url, kind, records, None
+
+
+def reextract(root: str, db_filename: str, kind: Optional[str], workers: Optional[int],
+              backend: str, dry_run: bool) -> None:
+    """
+    Replay the latest archived page of every URL through the current extractors
+    on a process pool. Re-extracted fields replace the stored ones, and fields
+    they lack are kept, unless the listing has details scraped after the page
+    was fetched.
+    """
+    archive = PageArchive(root)
+    entries = archive.latest(kind)
+    archive.close()
+    print(f"Re-extracting {len(entries)} archived pages")
+    filled = dict.fromkeys(DETAIL_FIELDS, 0)
+    records: Dict[str, Dict] = {}
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(root, backend)) as pool:
+        for url, _, page_records, error in pool.map(_reextract, entries, chunksize=16):
+            if error:
+                errors += 1
+                print(f"Error re-extracting {url}: {error}")
+            for record in page_records:
+                current = records.get(record['url'])
+                if current is None or record['scraped_at'] >= current['scraped_at']:
+                    records[record['url']] = record
+
+    for record in records.values():
+        for field in DETAIL_FIELDS:
+            filled[field] += record.get(field) is not None
+    print(f"{len(records)} listings from {len(entries)} pages ({errors} errors)")
+    for field, count in filled.items():
+        print(f"  {field:<14} {count:>6} ({count / max(1, len(records)):.0%})")
+    if dry_run:
+        return
+
+    store = ListingStore(db_filename)
+    stored = store.details(list(records))
+    newer = [
+        merge_details(record, stored.get(url, {}))
+        for url, record in records.items()
+        if url not in stored or record['scraped_at'] >= (stored[url]['scraped_at'] or '')
+    ]
+    store.upsert_details(newer)
+    store.close()
+    print(f"Updated {len(newer)} listings in {db_filename} ({len(records) - len(newer)} have newer details)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the raw page archive or re-extract it offline.")
+    parser.add_argument("command", choices=["stats", "reextract"])
+    parser.add_argument("--archive", default=os.getenv("ARCHIVE_DIR") or "outputs/archive")
+    parser.add_argument("--db", default="outputs/scraprop.db")
+    parser.add_argument("--kind", choices=KINDS, help="only re-extract search or detail pages")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--backend", default=os.getenv("PARSER_BACKEND", "fast"), help="parsing backend")
+    parser.add_argument("--dry-run", action="store_true", help="report field coverage without writing")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        archive = PageArchive(args.archive)
+        stats = archive.stats()
+        archive.close()
+        print(f"{stats['fetches']} fetches of {stats['urls']} URLs, {stats['blobs']} distinct pages, "
+              f"{stats['bytes'] / 1e6:.1f} MB compressed ({'zstd' if zstandard else 'zlib'})")
+    else:
+        reextract(args.archive, args.db, args.kind, args.workers, args.backend, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
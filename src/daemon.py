@@ -0,0 +1,226 @@
+"""
+Daemon Module: Keep the scraper running, polling each search in urls_to_scrap.txt
+on its own schedule. The session, Cloudflare clearance and rate limits stay warm
+between polls, and each search's interval adapts to how often it finds new
+listings: busy searches are polled more often, quiet ones are backed off.
+"""
+import argparse
+import os
+import random
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from metrics import METRICS
+from scraprop import (
+    DB_FILENAME, LOCK_FILENAME, URLS_FP, open_archive, open_fetcher, open_notifier, open_parse_pool, open_store, scrape
+)
+from storage import DatabaseLock
+from utils import load_environment, load_urls
+
+# Interval multipliers after a poll that found new listings, and after one that did not
+SPEEDUP = 0.5
+BACKOFF = 1.5
+# Random spread of each interval, so searches added together drift apart
+JITTER = 0.1
+
+
+class SearchSchedule:
+    """Polling state of one search URL."""
+
+    def __init__(self, url: str, interval: float):
+        self.url = url
+        self.interval = interval
+        self.next_run = time.monotonic()
+        self.running = False
+        self.removed = False
+        self.polls = 0
+        self.new_listings = 0
+
+
+class Scheduler:
+    """
+    Adaptive per-search polling intervals, bounded by `min_interval` and
+    `max_interval` (seconds). New searches are due immediately.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, start_interval: float):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.start_interval = min(max(start_interval, min_interval), max_interval)
+        self.searches: Dict[str, SearchSchedule] = {}
+        self.lock = threading.Lock()
+
+    def sync(self, urls: List[str]) -> None:
+        """Schedule new URLs and drop those no longer listed."""
+        with self.lock:
+            for url in urls:
+                if url not in self.searches:
+                    self.searches[url] = SearchSchedule(url, self.start_interval)
+            for url in set(self.searches) - set(urls):
+                # Searches being polled are dropped once their poll completes
+                if self.searches[url].running:
+                    self.searches[url].removed = True
+                else:
+                    del self.searches[url]
+
+    def claim_due(self, max_in_flight: int) -> List[SearchSchedule]:
+        """Mark due searches as running, most overdue first, up to `max_in_flight` running at once."""
+        now = time.monotonic()
+        with self.lock:
+            running = sum(s.running for s in self.searches.values())
+            due = [s for s in self.searches.values() if not s.running and s.next_run <= now]
+            due.sort(key=lambda s: s.next_run)
+            claimed = due[:max(0, max_in_flight - running)]
+            for schedule in claimed:
+                schedule.running = True
+            return claimed
+
+    def seconds_until_due(self) -> Optional[float]:
+        """Time until the next idle search is due, or None if there is none."""
+        with self.lock:
+            waiting = [s.next_run for s in self.searches.values() if not s.running]
+        if not waiting:
+            return None
+        return max(0.0, min(waiting) - time.monotonic())
+
+    def complete(self, schedule: SearchSchedule, new_listings: int) -> None:
+        """Adapt a search's interval to the outcome of its poll and schedule the next one."""
+        factor = SPEEDUP if new_listings else BACKOFF
+        interval = min(max(schedule.interval * factor, self.min_interval), self.max_interval)
+        with self.lock:
+            schedule.interval = interval
+            schedule.next_run = time.monotonic() + interval * random.uniform(1 - JITTER, 1 + JITTER)
+            schedule.running = False
+            schedule.polls += 1
+            schedule.new_listings += new_listings
+            if schedule.removed:
+                self.searches.pop(schedule.url, None)
+
+
+class Daemon:
+    """Poll searches with at most `max_in_flight` of them running at once."""
+
+    def __init__(self, env: Dict, scheduler: Scheduler, max_in_flight: int):
+        self.env = env
+        self.scheduler = scheduler
+        self.max_in_flight = max(1, max_in_flight)
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        # Also shared with other processes using the database, such as workers
+        self.notify_lock = DatabaseLock(LOCK_FILENAME)
+        self.save_lock = threading.Lock()
+        self.urls_mtime = None
+
+    def stop(self, *_) -> None:
+        print("Stopping after the searches in flight...")
+        self.stopping.set()
+        self.wakeup.set()
+
+    def reload_urls(self) -> None:
+        """Pick up changes to the URLs file."""
+        try:
+            mtime = os.path.getmtime(URLS_FP)
+        except OSError:
+            return
+        if mtime != self.urls_mtime:
+            self.urls_mtime = mtime
+            urls = load_urls(URLS_FP)
+            self.scheduler.sync(urls)
+            print(f"Scheduling {len(urls)} searches from {URLS_FP}")
+
+    def run(self) -> None:
+        # The store is opened here for the legacy import and the outbox; each poll opens its own
+        with METRICS.stage('setup'):
+            store = open_store(DB_FILENAME, self.env['journal_mode'])
+            self.notifier = open_notifier(self.env, store)
+            store.close()
+            self.scraper, self.session_cache, self.fetcher = open_fetcher(self.env)
+            self.archive = open_archive(self.env)
+            self.parser = open_parse_pool(self.env['parse_workers'], self.env['parser_backend'])
+
+        pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="search")
+        try:
+            while not self.stopping.is_set():
+                self.wakeup.clear()
+                self.reload_urls()
+                claimed = self.scheduler.claim_due(self.max_in_flight)
+                if claimed:
+                    # A clearance accepted by earlier polls may have expired since: check each
+                    # domain's first response again, once per round of polls started
+                    self.session_cache.reset(self.scraper)
+                for schedule in claimed:
+                    pool.submit(self.poll, schedule)
+                wait = self.scheduler.seconds_until_due()
+                # Wake up for finished polls, due searches and edits to the URLs file
+                self.wakeup.wait(min(wait if wait is not None else 60, 60))
+        finally:
+            pool.shutdown(wait=True)
+            self.fetcher.close()
+            if self.parser:
+                self.parser.shutdown()
+            if self.archive:
+                self.archive.close()
+            undelivered = self.notifier.close(self.env['notify_timeout_seconds'])
+            if undelivered:
+                print(f"{undelivered} notifications not delivered yet, will retry on the next start")
+            self.save()
+
+    def poll(self, schedule: SearchSchedule) -> None:
+        new_listings = 0
+        store = open_store()
+        try:
+            new_listings = scrape(self.fetcher, store, self.notifier, self.env, [schedule.url],
+                                  self.notify_lock, self.archive, self.parser)[schedule.url]
+        except Exception as e:
+            METRICS.inc('failed_searches_total')
+            print(f"Error polling {schedule.url}: {e}")
+        finally:
+            store.close()
+        self.scheduler.complete(schedule, new_listings)
+        METRICS.inc('polls_total')
+        print(f"{new_listings} new listings for {schedule.url}, next poll in {schedule.interval / 60:.1f} min")
+        self.save()
+        self.wakeup.set()
+
+    def save(self) -> None:
+        """Persist the session and the metrics accumulated since the daemon started."""
+        with self.save_lock:
+            self.session_cache.save(self.scraper)
+            METRICS.write_json(self.env['metrics_json'])
+            METRICS.write_prometheus(self.env['metrics_prom'])
+
+
+def main():
+    """Run the scraper as a resident daemon."""
+    os.makedirs('outputs', exist_ok=True)
+    env = load_environment()
+    parser = argparse.ArgumentParser(description="Poll each search on its own adaptive schedule.")
+    parser.add_argument("--min-interval", type=float, default=env['poll_min_minutes'],
+                        help="shortest polling interval in minutes")
+    parser.add_argument("--max-interval", type=float, default=env['poll_max_minutes'],
+                        help="longest polling interval in minutes")
+    parser.add_argument("--start-interval", type=float, default=env['poll_start_minutes'],
+                        help="interval of a newly added search in minutes")
+    parser.add_argument("--max-in-flight", type=int, default=env['max_in_flight'],
+                        help="maximum number of searches polled at once")
+    args = parser.parse_args()
+
+    if not env['telegram_bot_id'] or not (env['telegram_id'] or os.path.exists(env['subscribers'])):
+        print("Error: Telegram bot credentials not found in .env file")
+        return
+    if not os.path.exists(URLS_FP):
+        print(f"Error: {URLS_FP} not found")
+        return
+
+    scheduler = Scheduler(args.min_interval * 60, args.max_interval * 60, args.start_interval * 60)
+    daemon = Daemon(env, scheduler, args.max_in_flight)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Dedupe Module: Group listings of the same property across portals into clusters.
+
+Each listing with enough details gets a MinHash signature over shingles of its
+normalized features: the words of its neighbourhood/address and its price,
+surface and rooms bucketed on a coarse scale. Signatures are split into LSH
+bands stored in the database, so finding the candidates for a new listing only
+reads the listings in its price range sharing a band instead of the whole
+history. Candidates are then confirmed on the actual numbers and address words.
+"""
+import hashlib
+import math
+import random
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+import records
+from storage import ListingStore
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+NUM_PERM = 30
+BANDS = 10
+ROWS = NUM_PERM // BANDS
+PRIME = (1 << 61) - 1
+_rng = random.Random(1729)
+PERMUTATIONS = [(_rng.randrange(1, PRIME), _rng.randrange(0, PRIME)) for _ in range(NUM_PERM)]
+
+# Minimum share of the shorter address's words found in the other one, and the
+# largest relative differences in price and surface, for two listings to be the
+# same property
+MIN_OVERLAP = 0.75
+PRICE_TOLERANCE = 0.05
+SURFACE_TOLERANCE = 0.1
+# Width of the price and surface buckets used as shingles (log scale)
+PRICE_STEP = math.log(1.05)
+SURFACE_STEP = math.log(1.1)
+
+# Words too common in addresses to tell two listings apart
+STOPWORDS = {'de', 'del', 'la', 'el', 'los', 'las', 'y', 'al', 'capital', 'federal', 'caba', 'buenos', 'aires',
+             'calle', 'av', 'avenida', 'entre', 'esquina', 'piso', 'depto'}
+
+
+def address_words(neighbourhood) -> Set[str]:
+    """The distinctive words of a neighbourhood/address text."""
+    return {word for word in records.words(neighbourhood) if word not in STOPWORDS}
+
+
+def shingles(price: float, currency: str, surface: Optional[float], rooms: Optional[int],
+             words: Set[str]) -> Set[str]:
+    """Feature tokens; numbers fall in two overlapping buckets so close values share one."""
+    tokens = {f"w:{word}" for word in words}
+    price_bucket = math.log(price) / PRICE_STEP
+    tokens.add(f"p:{currency}:{math.floor(price_bucket)}")
+    tokens.add(f"p:{currency}:{math.floor(price_bucket + 0.5)}h")
+    if surface:
+        surface_bucket = math.log(surface) / SURFACE_STEP
+        tokens.add(f"s:{math.floor(surface_bucket)}")
+        tokens.add(f"s:{math.floor(surface_bucket + 0.5)}h")
+    if rooms is not None:
+        tokens.add(f"r:{rooms}")
+    return tokens
+
+
+def minhash(tokens: Set[str]) -> List[int]:
+    hashes = [int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'big') for token in tokens]
+    return [min((a * h + b) % PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+
+def band_buckets(signature: List[int]) -> List[str]:
+    """One LSH bucket key per band of the signature."""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(repr(rows).encode(), digest_size=8).hexdigest()
+        keys.append(f"{band}:{digest}")
+    return keys
+
+
+def same_place(a: Set[str], b: Set[str]) -> bool:
+    """
+    Whether two sets of address words can describe the same place: most words of
+    the shorter one appear in the other, and street numbers, if both have one, agree.
+    """
+    if not a or not b:
+        return False
+    numbers_a = {word for word in a if word.isdigit()}
+    numbers_b = {word for word in b if word.isdigit()}
+    if numbers_a and numbers_b and not numbers_a & numbers_b:
+        return False
+    return len(a & b) / min(len(a), len(b)) >= MIN_OVERLAP
+
+
+def _close(a: Optional[float], b: Optional[float], tolerance: float) -> bool:
+    if a is None or b is None:
+        return True
+    return abs(a - b) <= tolerance * max(a, b)
+
+
+class DuplicateIndex:
+    """Assign listings to property clusters, persisted in the listings database."""
+
+    def __init__(self, store: ListingStore):
+        self.store = store
+
+    def match(self, url: str, keys: List[str], price: float, currency: str, surface: Optional[float],
+              rooms: Optional[int], words: Set[str], indexed: Dict[str, Tuple]) -> str:
+        """The cluster of the first listing matching these features, or the listing's own."""
+        candidates = [
+            (other, cluster, ' '.join(w), p, s, r) for other, (cluster, w, c, p, s, r, k) in indexed.items()
+            if c == currency and set(k) & set(keys)
+        ] + self.store.cluster_candidates(keys, currency, price * (1 - PRICE_TOLERANCE),
+                                          price / (1 - PRICE_TOLERANCE))
+        for other, cluster, other_words, p, s, r in candidates:
+            if other == url or not (r is None or rooms is None or r == rooms):
+                continue
+            if not (_close(price, p, PRICE_TOLERANCE) and _close(surface, s, SURFACE_TOLERANCE)):
+                continue
+            if same_place(words, set(other_words.split())):
+                return cluster
+        return url
+
+    def assign(self, frame: 'pd.DataFrame') -> Dict[str, str]:
+        """
+        Add normalized records to the index and return the cluster of each one
+        with a price and an address. A cluster is named after its first listing.
+        """
+        clusters: Dict[str, str] = {}
+        # Listings indexed earlier keep their cluster, even if their details changed
+        existing = self.store.clusters_of(frame['url'].tolist())
+        indexed: Dict[str, Tuple] = {}
+        rows = []
+        buckets = []
+        for record in frame.itertuples(index=False):
+            words = address_words(record.neighbourhood)
+            if records.missing(record.price) or record.price <= 0 or not words:
+                continue
+            price, currency = float(record.price), str(record.currency)
+            surface = None if records.missing(record.surface) else float(record.surface)
+            rooms = None if records.missing(record.rooms) else int(record.rooms)
+            keys = band_buckets(minhash(shingles(price, currency, surface, rooms, words)))
+            cluster = existing.get(record.url) or self.match(record.url, keys, price, currency,
+                                                                surface, rooms, words, indexed)
+            clusters[record.url] = cluster
+            indexed[record.url] = (cluster, words, currency, price, surface, rooms, keys)
+            rows.append((record.url, cluster, ' '.join(sorted(words)), currency, price, surface, rooms))
+            buckets.extend((key, record.url) for key in keys)
+        if rows:
+            self.store.add_to_clusters(rows, buckets)
+        return clusters
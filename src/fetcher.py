@@ -0,0 +1,320 @@
+"""
+Fetcher Module: Concurrent page fetching with per-domain rate limiting, per-request
+retries and per-domain circuit breakers.
+"""
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+from metrics import METRICS
+from sites import ADAPTERS
+
+# Requests per second, burst size and concurrent connections allowed per portal
+DEFAULT_RATE_LIMITS = {domain: adapter.rate_limit for domain, adapter in ADAPTERS.items()}
+FALLBACK_RATE_LIMIT = (0.5, 1, 1)
+
+# Responses worth retrying: rate limited, or the server is temporarily failing
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to a domain whose circuit breaker is open."""
+
+    def __init__(self, domain: str, seconds: float):
+        super().__init__(f"circuit open for {domain}, retrying in {seconds:.0f}s")
+        self.domain = domain
+        self.seconds = seconds
+
+
+class CircuitBreaker:
+    """
+    Stop requesting a domain for `cooldown` seconds after `threshold` consecutive
+    failures. Once the cool-down is over a single probe request is let through:
+    success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self, domain: str) -> None:
+        """Raise CircuitOpenError unless a request may be sent now."""
+        with self.lock:
+            now = time.monotonic()
+            if self.opened_until > now:
+                raise CircuitOpenError(domain, self.opened_until - now)
+            if self.failures >= self.threshold:
+                if self.probing:
+                    raise CircuitOpenError(domain, 0)
+                self.probing = True
+
+    def success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+
+    def failure(self, open_for: Optional[float] = None) -> bool:
+        """Record a failure, opening the circuit for `open_for` seconds if given. Returns True if it opened."""
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if open_for is None and self.failures < self.threshold:
+                return False
+            self.failures = max(self.failures, self.threshold)
+            self.opened_until = time.monotonic() + (open_for if open_for is not None else self.cooldown)
+            return True
+
+
+def retry_after(response) -> Optional[float]:
+    """Seconds to wait according to a response's Retry-After header, if any."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available and consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[float, int, int]]:
+    """
+    Parse a rate limit spec such as "zonaprop.com.ar=2:4:2,argenprop.com=0.5"
+    (rate[:burst[:concurrency]] per domain) on top of the defaults.
+    """
+    limits = dict(DEFAULT_RATE_LIMITS)
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        domain, values = item.split('=', 1)
+        parts = values.split(':')
+        rate = float(parts[0])
+        burst = int(parts[1]) if len(parts) > 1 else 1
+        concurrency = int(parts[2]) if len(parts) > 2 else burst
+        limits[domain.strip().lower()] = (rate, burst, concurrency)
+    return limits
+
+
+def is_challenge(response) -> bool:
+    """Whether a response is a Cloudflare challenge the scraper could not get past."""
+    headers = response.headers
+    if headers.get('cf-mitigated') == 'challenge':
+        return True
+    return response.status_code in (403, 429, 503) and 'cloudflare' in headers.get('server', '').lower()
+
+
+def get_domain(url: str, known_domains: Iterable[str] = ()) -> str:
+    """Return the configured domain matching the URL's hostname, or the hostname itself."""
+    host = (urlparse(url).hostname or '').lower()
+    for domain in known_domains:
+        if host == domain or host.endswith('.' + domain):
+            return domain
+    return host
+
+
+class Fetcher:
+    """
+    Fetch pages concurrently through a shared scraper session. Each domain gets
+    its own token bucket, worker pool and circuit breaker, so a slow, tightly
+    limited or failing portal never holds up requests to the others.
+
+    Failed requests (connection errors and RETRY_STATUSES) are retried up to
+    `retries` times, waiting as long as the response's Retry-After header asks,
+    or with jittered exponential backoff from `backoff` up to `max_backoff`
+    seconds. A Retry-After longer than `max_backoff` opens the domain's circuit
+    for that long instead of blocking a worker.
+    """
+
+    def __init__(self, scraper, rate_limits: Optional[Dict[str, Tuple[float, int, int]]] = None,
+                 session_cache=None, retries: int = 3, backoff: float = 1.0, max_backoff: float = 60.0,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 300.0):
+        self.scraper = scraper
+        self.session_cache = session_cache
+        self.rate_limits = rate_limits if rate_limits is not None else dict(DEFAULT_RATE_LIMITS)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.pools: Dict[str, ThreadPoolExecutor] = {}
+        self.lock = threading.Lock()
+
+    def _limit(self, domain: str) -> Tuple[float, int, int]:
+        return self.rate_limits.get(domain, FALLBACK_RATE_LIMIT)
+
+    def _bucket(self, domain: str) -> TokenBucket:
+        with self.lock:
+            if domain not in self.buckets:
+                rate, burst, _ = self._limit(domain)
+                self.buckets[domain] = TokenBucket(rate, burst)
+            return self.buckets[domain]
+
+    def _breaker(self, domain: str) -> CircuitBreaker:
+        with self.lock:
+            if domain not in self.breakers:
+                self.breakers[domain] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return self.breakers[domain]
+
+    def _pool(self, domain: str) -> ThreadPoolExecutor:
+        with self.lock:
+            if domain not in self.pools:
+                _, _, concurrency = self._limit(domain)
+                self.pools[domain] = ThreadPoolExecutor(
+                    max_workers=max(1, concurrency), thread_name_prefix=f"fetch-{domain}"
+                )
+            return self.pools[domain]
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, stream: bool = False):
+        """
+        Fetch a single URL once its domain's rate limit allows it, with extra
+        request `headers` if given. When a cached Cloudflare clearance is
+        rejected, the domain's cookies are dropped and the request is repeated
+        once so the scraper solves a fresh challenge. With `stream`, the body is
+        left to be read from the returned response.
+        """
+        domain = get_domain(url, self.rate_limits)
+        response = self._request(domain, url, headers, stream)
+        if self.session_cache and self.session_cache.check(domain, is_challenge(response)):
+            if stream:
+                response.close()
+            self.session_cache.invalidate(self.scraper, domain)
+            response = self._request(domain, url, headers, stream)
+        return response
+
+    def _request(self, domain: str, url: str, headers: Optional[Dict[str, str]] = None, stream: bool = False):
+        """
+        Send a request with retries. Returns the response, or raises the last
+        error (an HTTPError for a retryable status) once retries are exhausted.
+        """
+        breaker = self._breaker(domain)
+        attempt = 0
+        while True:
+            breaker.allow(domain)
+            wait = None
+            try:
+                response = self._send(domain, url, headers, stream)
+            except Exception as e:
+                error, response = e, None
+            else:
+                # Challenges are not transient: the session cache handles those
+                if response.status_code not in RETRY_STATUSES or is_challenge(response):
+                    breaker.success()
+                    return response
+                error, wait = None, retry_after(response)
+
+            if wait is not None and wait > self.max_backoff:
+                breaker.failure(open_for=wait)
+                METRICS.inc('circuit_opened_total', domain=domain)
+            elif breaker.failure():
+                METRICS.inc('circuit_opened_total', domain=domain)
+            if attempt >= self.retries or breaker.opened_until > time.monotonic():
+                if response is not None:
+                    response.raise_for_status()
+                raise error
+            attempt += 1
+            if wait is None:
+                # Full jitter: a random wait up to the exponential backoff
+                wait = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            reason = 'error' if response is None else response.status_code
+            if stream and response is not None:
+                response.close()
+            print(f"Retrying {url} in {wait:.1f}s (attempt {attempt}/{self.retries}, {reason})")
+            METRICS.inc('retries_total', domain=domain, reason=reason)
+            METRICS.observe('retry_wait_seconds', wait, domain=domain)
+            time.sleep(wait)
+
+    def _send(self, domain: str, url: str, headers: Optional[Dict[str, str]] = None, stream: bool = False):
+        with METRICS.timer('rate_limit_wait_seconds', domain=domain):
+            self._bucket(domain).acquire()
+        start = time.perf_counter()
+        options = {}
+        if headers:
+            options['headers'] = headers
+        if stream:
+            options['stream'] = True
+        try:
+            response = self.scraper.get(url, **options)
+        except Exception:
+            METRICS.inc('http_errors_total', domain=domain)
+            raise
+        # The bytes of a streamed body are counted by whoever reads it
+        size = None if stream else len(response.content)
+        METRICS.record_response(domain, response.status_code, size, time.perf_counter() - start)
+        if is_challenge(response):
+            METRICS.inc('cloudflare_challenges_total', domain=domain)
+        return response
+
+    def submit(self, url: str, headers: Optional[Dict[str, str]] = None,
+               reader: Optional[Callable] = None) -> Future:
+        """
+        Queue a fetch on its domain's worker pool. The future resolves to the
+        response or, with a `reader`, to what it returns for the response, whose
+        body it reads as a stream on the worker thread.
+        """
+        return self._pool(get_domain(url, self.rate_limits)).submit(self._fetch, url, headers, reader)
+
+    def _fetch(self, url: str, headers: Optional[Dict[str, str]], reader: Optional[Callable]):
+        if reader is None:
+            return self.get(url, headers)
+        response = self.get(url, headers, stream=True)
+        try:
+            return reader(response)
+        finally:
+            response.close()
+
+    def fetch_all(self, urls: Iterable[str]) -> Iterator[Tuple[str, object, Optional[Exception]]]:
+        """
+        Fetch all URLs concurrently and yield (url, response, error) tuples in
+        completion order. Exactly one of response and error is None.
+        """
+        futures = {self.submit(url): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                yield url, future.result(), None
+            except Exception as e:
+                yield url, None, e
+
+    def close(self) -> None:
+        """Shut down all per-domain worker pools."""
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=True)
@@ -0,0 +1,160 @@
+"""
+Metrics Module: Per-stage timings and counters of a scraper run, exported as a
+JSON run summary and a Prometheus textfile-collector file.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _write_atomic(path: str, content: str) -> None:
+    """Write a file through a temporary one, so readers never see it half written."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+class Metrics:
+    """Thread-safe collection of stage wall times, counters and timing summaries."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.started = time.time()
+            self.stages: Dict[str, float] = {}
+            self.counters: Dict[str, Dict[Labels, float]] = {}
+            self.summaries: Dict[str, Dict[Labels, list]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage of the run; repeated stages accumulate."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Increment a counter."""
+        key = _labels(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Record a duration in a summary (count, sum and max)."""
+        key = _labels(labels)
+        with self.lock:
+            summary = self.summaries.setdefault(name, {}).setdefault(key, [0, 0.0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+            summary[2] = max(summary[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Time a block into a summary."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_response(self, domain: str, status: int, size: Optional[int], seconds: float) -> None:
+        """Record an HTTP response: status histogram, bytes (unless None) and latency per domain."""
+        self.inc('http_responses_total', domain=domain, status=status)
+        if size is not None:
+            self.inc('http_bytes_total', size, domain=domain)
+        self.observe('http_request_seconds', seconds, domain=domain)
+
+    def snapshot(self) -> Dict:
+        """Counters and summaries recorded so far, to be merged into another process's metrics."""
+        with self.lock:
+            return {
+                'counters': {name: dict(values) for name, values in self.counters.items()},
+                'summaries': {name: {k: list(v) for k, v in values.items()} for name, values in self.summaries.items()},
+            }
+
+    def merge(self, snapshot: Dict) -> None:
+        """Add the counters and summaries of a snapshot, e.g. from a worker process."""
+        with self.lock:
+            for name, values in snapshot['counters'].items():
+                series = self.counters.setdefault(name, {})
+                for key, value in values.items():
+                    series[key] = series.get(key, 0) + value
+            for name, values in snapshot['summaries'].items():
+                series = self.summaries.setdefault(name, {})
+                for key, (count, total, longest) in values.items():
+                    summary = series.setdefault(key, [0, 0.0, 0.0])
+                    summary[0] += count
+                    summary[1] += total
+                    summary[2] = max(summary[2], longest)
+
+    def summary(self) -> Dict:
+        """The run summary as a JSON-serializable dict."""
+        with self.lock:
+            def series(values, render):
+                return [dict(labels, **render(value)) for labels, value in values.items()]
+            return {
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'duration_seconds': round(time.time() - self.started, 3),
+                'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                'counters': {
+                    name: series(values, lambda v: {'value': v}) for name, values in self.counters.items()
+                },
+                'summaries': {
+                    name: series(values, lambda v: {'count': v[0], 'sum': round(v[1], 6), 'max': round(v[2], 6)})
+                    for name, values in self.summaries.items()
+                },
+            }
+
+    def write_json(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.summary(), indent=2) + '\n')
+
+    def write_prometheus(self, path: str, prefix: str = 'scraprop') -> None:
+        """Write all metrics in the Prometheus text exposition format."""
+        def render(labels: Labels) -> str:
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+        with self.lock:
+            lines = [
+                f'# TYPE {prefix}_run_timestamp_seconds gauge',
+                f'{prefix}_run_timestamp_seconds {self.started:.0f}',
+                f'# TYPE {prefix}_run_duration_seconds gauge',
+                f'{prefix}_run_duration_seconds {time.time() - self.started:.3f}',
+                f'# TYPE {prefix}_stage_seconds gauge',
+            ]
+            for name, seconds in self.stages.items():
+                lines.append(f'{prefix}_stage_seconds{{stage="{name}"}} {seconds:.6f}')
+            for name, values in self.counters.items():
+                lines.append(f'# TYPE {prefix}_{name} counter')
+                for labels, value in values.items():
+                    lines.append(f'{prefix}_{name}{render(labels)} {value:g}')
+            for name, values in self.summaries.items():
+                lines.append(f'# TYPE {prefix}_{name} summary')
+                for labels, (count, total, _) in values.items():
+                    lines.append(f'{prefix}_{name}_count{render(labels)} {count}')
+                    lines.append(f'{prefix}_{name}_sum{render(labels)} {total:.6f}')
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+
+# Process-wide metrics of the current run
+METRICS = Metrics()
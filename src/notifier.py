@@ -0,0 +1,194 @@
+"""
+Notifier Module: Telegram delivery through a background queue. Messages are
+written to the database outbox before they are queued, so those not delivered by
+the end of a run (network errors, long rate limits) are retried on the next one.
+"""
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fetcher import TokenBucket
+from metrics import METRICS
+from storage import ListingStore
+
+API_URL = "https://api.telegram.org/bot{}/sendMessage"
+MAX_MESSAGE_LENGTH = 4096
+# Delivery attempts (across runs) before a message is left in the outbox for good
+MAX_ATTEMPTS = 5
+# How long queued messages are reserved for this process, so that other runs and
+# workers sharing the outbox do not send them too; after a crash, the next run
+# resends them once this has passed
+CLAIM_SECONDS = 3600
+# Telegram's limits: about one message per second per chat, 20 per minute per
+# group and 30 per second overall
+CHAT_RATE = 1.0
+GROUP_RATE = 20 / 60
+GLOBAL_RATE = 30.0
+# Seconds a message may wait on 429s before it is left in the outbox for the next
+# run, so a chat that keeps being rate limited does not hold back the others
+MAX_RETRY_AFTER_SECONDS = 120
+
+
+class TelegramNotifier:
+    """
+    Send messages from a background thread over a pooled HTTP session, paced by
+    per-chat and global token buckets. A 429 response is retried after the
+    `retry_after` Telegram asks for, as long as the waits stay within
+    MAX_RETRY_AFTER_SECONDS; other failures up to `retries` times with
+    exponential backoff. With `digest_size` > 1, listings are packed into
+    messages of up to that many listings each.
+    """
+
+    def __init__(self, bot_id: str, db_path: str, digest_size: int = 1, retries: int = 3):
+        self.url = API_URL.format(bot_id)
+        self.db_path = db_path
+        self.digest_size = max(1, digest_size)
+        self.retries = retries
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.queue: queue.Queue = queue.Queue()
+        self.global_bucket = TokenBucket(GLOBAL_RATE, int(GLOBAL_RATE))
+        self.chat_buckets = {}
+        self.abort = threading.Event()
+        self.thread = None
+        # Ids of the messages this notifier has claimed and not delivered yet
+        self.claimed = set()
+
+    def start(self, store: ListingStore) -> int:
+        """
+        Queue the messages left in the outbox by earlier runs, unless another
+        process is sending them, and start sending. Returns their number.
+        """
+        pending = store.claim_pending_messages(MAX_ATTEMPTS, time.time() + CLAIM_SECONDS)
+        for message in pending:
+            self.claimed.add(message[0])
+            self.queue.put(message)
+        self.thread = threading.Thread(target=self._run, name="telegram", daemon=True)
+        self.thread.start()
+        return len(pending)
+
+    def notify(self, store: ListingStore, routes: Dict[str, List[Tuple[str, str]]], urls: List[str]) -> int:
+        """
+        Queue the messages announcing (url, text) listings to each chat in
+        `routes`, marking `urls` as notified in the same transaction. Returns the
+        number of messages queued.
+        """
+        messages = [(chat_id, text) for chat_id, listings in routes.items()
+                    for text in self.pack([text for _, text in listings])]
+        ids = store.enqueue_messages(messages, urls, time.time() + CLAIM_SECONDS)
+        for message_id, (chat_id, text) in zip(ids, messages):
+            self.claimed.add(message_id)
+            self.queue.put((message_id, chat_id, text))
+        METRICS.inc('notifications_queued_total', sum(len(listings) for listings in routes.values()))
+        return len(messages)
+
+    def pack(self, texts: List[str]) -> List[str]:
+        """Join listing texts into digests of up to `digest_size` listings within Telegram's length limit."""
+        messages: List[str] = []
+        count = 0
+        for text in texts:
+            if messages and count < self.digest_size and \
+                    len(messages[-1]) + 2 + len(text) <= MAX_MESSAGE_LENGTH:
+                messages[-1] += "\n\n" + text
+                count += 1
+            else:
+                messages.append(text[:MAX_MESSAGE_LENGTH])
+                count = 1
+        return messages
+
+    def close(self, timeout: Optional[float] = None) -> int:
+        """
+        Wait up to `timeout` seconds (None waits indefinitely) for the queued
+        messages to be sent, then stop. Returns the number of messages left for
+        the next run, whose claim is released.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                self.abort.set()
+                self.thread.join()
+            self.thread = None
+        self.session.close()
+        undelivered = list(self.claimed)
+        if undelivered:
+            store = ListingStore(self.db_path)
+            try:
+                store.release_messages(undelivered)
+            finally:
+                store.close()
+        return len(undelivered)
+
+    def _bucket(self, chat_id: str) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            rate = GROUP_RATE if str(chat_id).startswith('-') else CHAT_RATE
+            self.chat_buckets[chat_id] = TokenBucket(rate, 1)
+        return self.chat_buckets[chat_id]
+
+    def _run(self) -> None:
+        store = ListingStore(self.db_path)
+        try:
+            while not self.abort.is_set():
+                item = self.queue.get()
+                if item is None:
+                    break
+                self._deliver(store, *item)
+        finally:
+            store.close()
+
+    def _deliver(self, store: ListingStore, message_id: int, chat_id: str, text: str) -> None:
+        attempt = 0
+        waited = 0.0
+        error = None
+        while not self.abort.is_set():
+            self._bucket(chat_id).acquire()
+            self.global_bucket.acquire()
+            status, retry_after, error = self.post(chat_id, text)
+            if status == 200:
+                store.message_delivered(message_id)
+                self.claimed.discard(message_id)
+                return
+            if retry_after is not None:
+                METRICS.observe('telegram_retry_after_seconds', retry_after)
+                waited += retry_after
+                if waited > MAX_RETRY_AFTER_SECONDS:
+                    break
+                self.abort.wait(retry_after)
+                continue
+            attempt += 1
+            # Other client errors (bad request, bot blocked) will not go away by retrying now
+            if attempt > self.retries or (status is not None and 400 <= status < 500):
+                break
+            self.abort.wait(2 ** attempt)
+        if error is not None and not self.abort.is_set():
+            store.message_failed(message_id, error)
+            print(f"Notification {message_id} not delivered, kept in the outbox: {error}")
+
+    def post(self, chat_id: str, text: str) -> Tuple[Optional[int], Optional[float], Optional[str]]:
+        """Send one message. Returns the HTTP status (None on network errors), retry_after and error."""
+        data = {
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML"
+        }
+        try:
+            with METRICS.timer('telegram_request_seconds'):
+                response = self.session.post(self.url, data=data, timeout=30)
+        except Exception as e:
+            METRICS.inc('telegram_messages_total', status='error')
+            return None, None, str(e)
+        METRICS.inc('telegram_messages_total', status=response.status_code)
+        if response.status_code == 200:
+            return 200, None, None
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        retry_after = None
+        if response.status_code == 429:
+            retry_after = float((body.get('parameters') or {}).get('retry_after', 1))
+        return response.status_code, retry_after, body.get('description') or f"HTTP {response.status_code}"
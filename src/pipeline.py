@@ -0,0 +1,580 @@
+"""
+Pipeline Module: A scraper run as a stream. Search pages, detail pages and
+parsing overlap; records are persisted and notified in small batches as they
+are ready, and each search keeps a checkpoint in the database so an interrupted
+run resumes where it stopped instead of starting over.
+"""
+import hashlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from functools import partial
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional, Tuple
+
+from archive import PageArchive
+from dedupe import DuplicateIndex
+from fetcher import Fetcher, get_domain
+from metrics import METRICS
+from notifier import TelegramNotifier
+from records import Rules, normalize, price_changes, price_drops
+from scraper import (
+    api_search_url, extract_api_ads, extract_api_items, get_adapter, merge_details, needs_details, page_url, parse,
+    parse_page, parse_search_details
+)
+from storage import ListingStore, now
+from planner import PlannedSearch
+from streaming import read_details
+from subscriptions import load_subscriptions
+from utils import format_price_drop, format_telegram_message, select_stale_ads
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Detail pages fetched or parsed at once; search pages wait while the backlog is longer than this
+MAX_PENDING = 50
+# Pages waiting for or in a parse worker, per worker, before fetching is held back
+PARSE_QUEUE_PER_WORKER = 2
+
+
+def page_fingerprint(ads: List[Dict]) -> str:
+    """A digest of the ads on a search page and their card prices, in any order."""
+    listed = sorted(f"{ad['url']} {ad.get('price')}" for ad in ads)
+    return hashlib.sha1('\n'.join(listed).encode()).hexdigest()
+
+
+def read_archived(archive: PageArchive, url: str, kind: str, domain: str, response):
+    """
+    Read a whole page and archive it, unless it is a 304. Runs on the fetcher's
+    worker thread, so compression and the index write stay off the pipeline's.
+    """
+    METRICS.inc('http_bytes_total', len(response.content), domain=domain)
+    if response.status_code != 304:
+        with METRICS.timer('archive_seconds', kind=kind):
+            archive.put(url, kind, response.text, now())
+    return response
+
+
+def api_text(response) -> str:
+    """The body of a successful API response; API errors are JSON documents, not results."""
+    if response.status_code != 200:
+        raise ValueError(f"API request failed with status {response.status_code}")
+    return response.text
+
+
+class Pipeline:
+    """
+    Crawl searches page by page (newest first), each stopping at the first page
+    with no new ads or at a page that fails. As each page arrives, the ads whose
+    card lacks details are queued for their detail page: unseen ads, plus seen
+    ads whose stored details are older than the TTL, within a per-site refresh
+    budget. Every `batch_size` records are committed, unseen ones notified, and
+    the checkpoints of their searches updated. Fetched pages are also saved to
+    `archive`, if given, by the fetcher's worker threads.
+
+    Pages are parsed on the `parser` process pool when given, so parsing uses
+    every core while this thread keeps the fetchers busy. When more pages are
+    waiting for a parse worker than the pool can keep up with, no further pages
+    are fetched until it catches up.
+
+    With the HTTP cache on, pages are requested with the validators (ETag,
+    Last-Modified) of their last processed copy. A 304 search page ends its
+    crawl like a page of seen ads, and a 304 detail page reuses the stored
+    details. Search pages also keep a fingerprint of their ads and card prices,
+    so a page served again in full but unchanged is not processed either.
+    Validators are only stored once the records of their page are committed.
+
+    Detail pages of sites that support it are read as they download (see
+    streaming.py), and their connection closed once the details are complete.
+    Without an archive only: it needs whole pages.
+
+    Sites with a JSON API in use (see MERCADOLIBRE_API_URL) are searched
+    through it, and the listings needing details are fetched from its items
+    endpoint in batches of the site's `api_batch_size`. API responses are
+    parsed in this thread, as they are small, and are not archived.
+    """
+
+    def __init__(self, fetcher: Fetcher, store: ListingStore, notifier: TelegramNotifier, env: Dict,
+                 notify_lock=None, archive: Optional[PageArchive] = None,
+                 parser: Optional[ProcessPoolExecutor] = None, max_pending: int = MAX_PENDING):
+        self.fetcher = fetcher
+        self.store = store
+        self.notifier = notifier
+        self.archive = archive
+        self.parser = parser
+        self.dedupe = DuplicateIndex(store) if env['dedupe'] else None
+        self.rules = Rules.from_env(env)
+        self.subscriptions = load_subscriptions(env)
+        self.env = env
+        self.notify_lock = notify_lock
+        self.batch_size = max(1, env['batch_size'])
+        self.max_pending = max_pending
+        self.max_parsing = PARSE_QUEUE_PER_WORKER * max(1, env['parse_workers'])
+        self.futures: Dict = {}
+        self.in_flight = 0
+        self.parsing = 0
+        # Next page of each search (0 once its crawl is over), and the ads of each
+        # search awaiting their details: url -> (ad, unseen)
+        self.next_page: Dict[str, int] = {}
+        self.pending: Dict[str, Dict[str, Tuple[Dict, bool]]] = {}
+        self.backlog: Deque[Tuple[str, str]] = deque()
+        self.waiting: List[str] = []
+        # Listings requested by each API items request in flight: url -> [(search, ad url)]
+        self.item_batches: Dict[str, List[Tuple[str, str]]] = {}
+        # Records ready to be committed: (search, ad url, record or None, unseen)
+        self.records: List[Tuple[str, str, Optional[Dict], bool]] = []
+        self.found = set()
+        self.claimed = set()
+        self.refreshed: Dict[str, int] = {}
+        # Validators (etag, last_modified, size) of fetched pages being parsed, and
+        # the pages to remember once their records are committed:
+        # (url, etag, last_modified, size, fingerprint)
+        self.http_cache = env['http_cache']
+        self.stream_details = env['stream_details'] and archive is None
+        self.validators: Dict[str, Tuple[Optional[str], Optional[str], int]] = {}
+        self.processed_pages: List[Tuple[str, Optional[str], Optional[str], int, Optional[str]]] = []
+        # Planned searches by URL, and the new listings attributed to each original search
+        self.searches: Dict[str, PlannedSearch] = {}
+        self.new_listings: Dict[str, int] = {}
+        self.scraped = 0
+
+    def run(self, searches: List[PlannedSearch]) -> Dict[str, int]:
+        """Scrape the planned searches. Returns the number of new listings found for each original search."""
+        self.searches = {search.url: search for search in searches}
+        self.new_listings = {original: 0 for search in searches for original in search.originals}
+        urls = list(self.searches)
+        self.resume(urls)
+        for url in urls:
+            self.submit_search(url)
+        self.submit_details()
+        while self.futures or self.waiting:
+            if self.can_crawl():
+                waiting, self.waiting = self.waiting, []
+                for url in waiting:
+                    self.submit_search(url)
+            done, _ = wait(self.futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, kind, search_url, url = self.futures.pop(future)
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                if stage == 'fetch':
+                    self.on_fetched(kind, search_url, url, result, error)
+                else:
+                    self.parsing -= 1
+                    records = None
+                    if error is None:
+                        records, snapshot = result
+                        METRICS.merge(snapshot)
+                    self.on_parsed(kind, search_url, url, records, error)
+            self.submit_details()
+            if len(self.records) >= self.batch_size:
+                self.flush()
+        self.flush()
+        return self.new_listings
+
+    def resume(self, urls: List[str]) -> None:
+        """Start each search from its checkpoint, if an earlier run was interrupted."""
+        checkpoints = self.store.load_checkpoints(urls, self.env['checkpoint_max_age_hours'])
+        for url in urls:
+            next_page, ads = checkpoints.get(url, (1, []))
+            # A search whose crawl was over only has details left: crawl it afresh
+            self.next_page[url] = next_page or 1
+            self.pending[url] = {}
+            for ad in ads:
+                unseen = ad.pop('unseen')
+                self.pending[url][ad['url']] = (ad, unseen)
+                self.backlog.append((url, ad['url']))
+                self.found.add(ad['url'])
+                if unseen:
+                    self.claimed.add(ad['url'])
+        if checkpoints:
+            print(f"Resuming {len(checkpoints)} interrupted searches "
+                  f"({len(self.backlog)} ads awaiting details)")
+
+    def submit_search(self, url: str) -> None:
+        api_target = api_search_url(url, self.next_page[url])
+        target = api_target or page_url(url, self.next_page[url])
+        if target is None:
+            self.next_page[url] = 0
+            self.save_checkpoint(url)
+            return
+        headers = self.conditional_headers(target)
+        if api_target:
+            headers = self.api_headers(url, headers)
+        kind = 'api-search' if api_target else 'search'
+        reader = None if api_target else self.archive_reader(target, kind)
+        self.futures[self.fetcher.submit(target, headers, reader)] = ('fetch', kind, url, target)
+
+    def api_headers(self, url: str, headers: Optional[Dict[str, str]] = None) -> Optional[Dict[str, str]]:
+        """`headers` with those of the API requests of `url`'s site added."""
+        extra = get_adapter(url).api_headers()
+        return dict(headers or {}, **extra) if extra else headers
+
+    def conditional_headers(self, url: str) -> Optional[Dict[str, str]]:
+        """The If-None-Match/If-Modified-Since headers for the last processed copy of a page, if any."""
+        cached = self.store.cached_page(url) if self.http_cache else None
+        if cached is None:
+            return None
+        etag, last_modified, _, _ = cached
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers or None
+
+    def parse_backlogged(self) -> bool:
+        return self.parser is not None and self.parsing >= self.max_parsing
+
+    def can_crawl(self) -> bool:
+        return len(self.backlog) < self.max_pending and not self.parse_backlogged()
+
+    def submit_details(self) -> None:
+        batches: Dict[str, List[Tuple[str, str]]] = {}
+        while self.backlog and self.in_flight < self.max_pending and not self.parse_backlogged():
+            search_url, ad_url = self.backlog.popleft()
+            self.in_flight += 1
+            adapter = get_adapter(ad_url)
+            if adapter and adapter.api_batch_size:
+                batch = batches.setdefault(adapter.domain, [])
+                batch.append((search_url, ad_url))
+                if len(batch) == adapter.api_batch_size:
+                    self.submit_items(batches.pop(adapter.domain))
+                continue
+            future = self.fetcher.submit(ad_url, self.conditional_headers(ad_url), self.detail_reader(ad_url))
+            self.futures[future] = ('fetch', 'detail', search_url, ad_url)
+        for batch in batches.values():
+            self.submit_items(batch)
+
+    def submit_items(self, batch: List[Tuple[str, str]]) -> None:
+        """Request the details of a batch of (search, ad url) listings of one site from its API."""
+        urls = [ad_url for _, ad_url in batch]
+        target = get_adapter(urls[0]).api_items_url(urls)
+        self.item_batches[target] = batch
+        self.futures[self.fetcher.submit(target, self.api_headers(urls[0]))] = ('fetch', 'items', None, target)
+
+    def detail_reader(self, url: str):
+        """The reader streaming or archiving a detail page, or None to fetch it whole."""
+        adapter = get_adapter(url)
+        if not (self.stream_details and adapter and adapter.streams_details):
+            return self.archive_reader(url, 'detail')
+        return partial(read_details, url, get_domain(url, self.fetcher.rate_limits))
+
+    def archive_reader(self, url: str, kind: str):
+        """The reader archiving a page as it is fetched, or None without an archive."""
+        if self.archive is None:
+            return None
+        return partial(read_archived, self.archive, url, kind, get_domain(url, self.fetcher.rate_limits))
+
+    def on_fetched(self, kind: str, search_url: str, url: str, response, error: Optional[Exception]) -> None:
+        """Hand a fetched page to the parse pool, or parse it right away without one."""
+        if kind == 'items':
+            self.on_items(url, response, error)
+            return
+        records = None
+        if error is None and response.status_code == 304:
+            self.on_not_modified(kind, search_url, url)
+            return
+        if error is None:
+            if kind != 'detail':
+                print(f"Scraping: {url}")
+            if self.http_cache:
+                self.validators[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                                        len(response.content))
+            if kind == 'api-search':
+                try:
+                    records = extract_api_ads(search_url, api_text(response))
+                except Exception as e:
+                    error = e
+                self.on_parsed('search', search_url, url, records, error)
+                return
+            if getattr(response, 'record', None) is not None:
+                # A streamed page whose details were complete: nothing left to parse
+                self.on_parsed(kind, search_url, url, [response.record], None)
+                return
+            if self.parser is not None:
+                future = self.parser.submit(parse_page, kind, url, response.text)
+                self.futures[future] = ('parse', kind, search_url, url)
+                self.parsing += 1
+                return
+            try:
+                records = parse(kind, url, response.text)
+            except Exception as e:
+                error = e
+        self.on_parsed('search' if kind == 'api-search' else kind, search_url, url, records, error)
+
+    def on_items(self, url: str, response, error: Optional[Exception]) -> None:
+        """Hand each listing of an API items response to `on_details`, failing those it lacks."""
+        batch = self.item_batches.pop(url)
+        records = {}
+        if error is None:
+            try:
+                records = extract_api_items([ad_url for _, ad_url in batch], api_text(response))
+            except Exception as e:
+                error = e
+        for search_url, ad_url in batch:
+            details = records.get(ad_url)
+            missing = None if details is not None else error or LookupError("not in the API response")
+            self.on_details(search_url, ad_url, details, missing)
+
+    def on_not_modified(self, kind: str, search_url: str, url: str) -> None:
+        """Handle a 304: the page is the copy processed last time."""
+        domain = get_domain(url, self.fetcher.rate_limits)
+        cached = self.store.cached_page(url)
+        if kind == 'detail':
+            stored = self.store.details([url]).get(url)
+            if stored is None:
+                # Details lost since, e.g. a new database: fetch the page in full
+                self.futures[self.fetcher.submit(url, reader=self.detail_reader(url))] = \
+                    ('fetch', 'detail', search_url, url)
+                return
+            self.count_cache_hit(domain, kind, cached)
+            self.on_details(search_url, url, stored, None)
+            return
+        self.count_cache_hit(domain, kind, cached)
+        print(f"Search page unchanged since last run: {url}")
+        self.next_page[search_url] = 0
+        self.save_checkpoint(search_url)
+
+    def count_cache_hit(self, domain: str, kind: str, cached) -> None:
+        METRICS.inc('http_cache_hits_total', domain=domain, kind=kind)
+        if cached is not None:
+            METRICS.inc('http_cache_bytes_saved_total', cached[2], domain=domain)
+
+    def on_parsed(self, kind: str, search_url: str, url: str, records: Optional[List[Dict]],
+                  error: Optional[Exception]) -> None:
+        validators = self.validators.pop(url, None)
+        if error is None and validators is not None and (kind == 'search' or records):
+            fingerprint = page_fingerprint(records) if kind == 'search' else None
+            self.processed_pages.append((url,) + validators + (fingerprint,))
+        if kind == 'search':
+            self.on_search_page(search_url, url, records, error)
+        else:
+            self.on_details(search_url, url, records[0] if records else None, error)
+
+    def on_search_page(self, url: str, target: str, ads: Optional[List[Dict]], error: Optional[Exception]) -> None:
+        page = self.next_page[url]
+        if error is None and self.unchanged(target):
+            METRICS.inc('unchanged_search_pages_total', domain=get_domain(target, self.fetcher.rate_limits))
+            print(f"Search page unchanged since last run: {target}")
+            self.next_page[url] = 0
+            self.save_checkpoint(url)
+            return
+        if error is None:
+            try:
+                # Remove duplicates against earlier pages of this run
+                ads = [ad for ad in ads if ad['url'] not in self.found]
+                self.found.update(ad['url'] for ad in ads)
+                seen, unseen = self.store.split_seen_and_unseen(ads)
+                # An ad listed by several searches is only notified once
+                unseen = [ad for ad in unseen if ad['url'] not in self.claimed]
+                self.claimed.update(ad['url'] for ad in unseen)
+                print(f"Page {page}: {len(seen)} seen, {len(unseen)} unseen")
+            except Exception as e:
+                error = e
+        if error is not None:
+            print(f"Failed to scrape {target}: {error}")
+            METRICS.inc('failed_searches_total', domain=get_domain(target, self.fetcher.rate_limits))
+            self.next_page[url] = 0
+        else:
+            self.queue_ads(url, seen, unseen)
+            self.next_page[url] = page + 1 if unseen and page < self.env['max_pages'] else 0
+        self.save_checkpoint(url)
+        if self.next_page[url]:
+            # Back-pressure: crawl further only once the detail and parse backlogs have drained
+            if self.can_crawl():
+                self.submit_search(url)
+            else:
+                self.waiting.append(url)
+
+    def unchanged(self, target: str) -> bool:
+        """Whether a search page just parsed lists the same ads and prices as when it was last processed."""
+        if not self.processed_pages or self.processed_pages[-1][0] != target:
+            return False
+        cached = self.store.cached_page(target)
+        return cached is not None and cached[3] == self.processed_pages[-1][4]
+
+    def queue_ads(self, url: str, seen: List[Dict], unseen: List[Dict]) -> None:
+        """Record the ads whose card is complete and queue the others for their detail page."""
+        scraped_at = now()
+        complete = 0
+        for ads, is_unseen in ((seen, False), (unseen, True)):
+            for ad in ads:
+                if not needs_details(ad):
+                    self.records.append((url, ad['url'], dict(ad, scraped_at=scraped_at), is_unseen))
+                    complete += 1
+        incomplete_seen = [ad for ad in seen if needs_details(ad)]
+        stale = select_stale_ads(
+            incomplete_seen, self.store.detail_timestamps([ad['url'] for ad in incomplete_seen]),
+            self.env['details_ttl_hours'], self.env['refresh_budget'], self.refreshed,
+        )
+        incomplete_unseen = [ad for ad in unseen if needs_details(ad)]
+        print(f"{complete} ads complete from search results; fetching details for "
+              f"{len(incomplete_unseen)} unseen and {len(stale)} stale ads "
+              f"({len(incomplete_seen) - len(stale)} up to date)")
+        METRICS.inc('ads_complete_from_search_total', complete)
+        for ads, is_unseen in ((incomplete_unseen, True), (stale, False)):
+            for ad in ads:
+                self.pending[url][ad['url']] = (ad, is_unseen)
+                self.backlog.append((url, ad['url']))
+
+    def on_details(self, url: str, ad_url: str, details: Optional[Dict], error: Optional[Exception]) -> None:
+        self.in_flight -= 1
+        ad, unseen = self.pending[url][ad_url]
+        record = None
+        if error is None:
+            record = merge_details(ad, details)
+            record['scraped_at'] = now()
+        else:
+            print(f"Error extracting details from {ad_url}: {error}")
+            METRICS.inc('detail_errors_total', domain=get_domain(ad_url, self.fetcher.rate_limits))
+        # Unseen ads are still notified, with the details of their search
+        self.records.append((url, ad_url, record, unseen))
+
+    def flush(self) -> None:
+        """
+        Commit the records ready so far and their price changes (appending new
+        listings to CSV_FILE, if set), notify the unseen ones that pass the rules
+        and the price drops, and update the checkpoints.
+        """
+        if not self.records:
+            self.remember_pages()
+            return
+        # The first use of pandas in a run
+        import pandas as pd
+
+        records, self.records = self.records, []
+        properties = [record for _, _, record, _ in records if record is not None]
+        frame = normalize(properties)
+        with METRICS.stage('persist'):
+            if properties:
+                self.store.upsert_details(properties)
+                self.scraped += len(properties)
+                previous = pd.DataFrame(self.store.last_prices(frame['url'].tolist()),
+                                        columns=['url', 'price', 'currency'])
+                changes = price_changes(frame, previous)
+                self.store.add_prices(list(changes.fillna({'scraped_at': now()}).itertuples(index=False, name=None)))
+                if self.env['csv_file']:
+                    # Runs and workers may append to the same file
+                    with self.notify_lock or nullcontext():
+                        self.store.append_csv(self.env['csv_file'], properties)
+
+        with METRICS.stage('notify'):
+            rejected = set(frame.loc[~self.rules.evaluate(frame), 'url']) if self.rules else set()
+            origins = self.attribute(records, frame)
+            listings: Dict[str, List[Tuple[str, Optional[Dict]]]] = {}
+            filtered = []
+            for url, ad_url, record, unseen in records:
+                if unseen and ad_url in rejected:
+                    filtered.append(ad_url)
+                elif unseen:
+                    listings.setdefault(url, []).append((ad_url, record))
+            if filtered:
+                # Counted as handled, so they are only announced again if their price drops
+                self.store.mark_notified(filtered)
+                METRICS.inc('listings_filtered_total', len(filtered))
+                print(f"Skipped {len(filtered)} new listings that do not pass the rules")
+            with self.notify_lock or nullcontext():
+                clusters = self.dedupe.assign(frame) if self.dedupe else {}
+                routes = self.subscriptions.route(frame)
+                for url, ads in listings.items():
+                    self.notify(url, ads, clusters, routes, origins)
+                if properties and self.env['min_price_drop'] is not None:
+                    drops = price_drops(frame, previous, self.env['min_price_drop'])
+                    new = {ad_url for _, ad_url, _, unseen in records if unseen}
+                    self.notify_price_drops(drops[~drops['url'].isin(rejected | new)], properties, routes)
+
+        for url, ad_url, _, _ in records:
+            self.pending[url].pop(ad_url, None)
+        for url in {url for url, _, _, _ in records}:
+            self.save_checkpoint(url)
+        self.remember_pages()
+
+    def remember_pages(self) -> None:
+        """
+        Store the validators of the pages processed so far. Their records are
+        committed, and the ads still awaiting details are in the checkpoints, so
+        a 304 next time cannot skip anything left undone.
+        """
+        if self.processed_pages:
+            self.store.remember_pages(self.processed_pages)
+            self.processed_pages = []
+
+    def attribute(self, records: List[Tuple[str, str, Optional[Dict], bool]],
+                  frame: 'pd.DataFrame') -> Dict[str, str]:
+        """Count the unseen records for the original searches they match. Returns the first of each."""
+        rows = {row.url: row for row in frame.itertuples(index=False)}
+        origins = {}
+        for url, ad_url, record, unseen in records:
+            if unseen:
+                originals = self.searches[url].originals_for(rows.get(ad_url) if record is not None else None)
+                for original in originals:
+                    self.new_listings[original] += 1
+                origins[ad_url] = originals[0]
+        return origins
+
+    def notify(self, url: str, ads: List[Tuple[str, Optional[Dict]]], clusters: Dict[str, str],
+               routes: Dict[str, List[str]], origins: Dict[str, str]) -> None:
+        # Another search, or an earlier attempt of this one, may have notified some already
+        notified = self.store.notified([ad_url for ad_url, _ in ads])
+        ads = [(ad_url, record) for ad_url, record in ads if ad_url not in notified]
+        # Only the first sighting of a property is notified, on whichever portal
+        known = self.store.notified_clusters([clusters[ad_url] for ad_url, _ in ads if ad_url in clusters])
+        fresh, duplicates = [], []
+        for ad_url, record in ads:
+            cluster = clusters.get(ad_url)
+            if cluster in known:
+                duplicates.append(ad_url)
+            else:
+                fresh.append((ad_url, record))
+                if cluster:
+                    known.add(cluster)
+        if duplicates:
+            self.store.mark_notified(duplicates)
+            METRICS.inc('duplicates_suppressed_total', len(duplicates))
+            print(f"Skipped {len(duplicates)} listings already notified on another portal")
+        ads = fresh
+        if not ads:
+            return
+        # Messages show the filters of the original search each listing was found for
+        search_details = {original: parse_search_details(original) for original in self.searches[url].originals}
+        listings = [(ad_url, format_telegram_message(ad_url, search_details[origins.get(ad_url, url)], record))
+                    for ad_url, record in ads]
+        by_chat = self.by_chat(listings, routes)
+        messages = self.notifier.notify(self.store, by_chat, [ad_url for ad_url, _ in ads])
+        print(f"Queued {len(listings)} listings in {messages} messages to {len(by_chat)} chats for: {url}")
+
+    def notify_price_drops(self, drops: 'pd.DataFrame', properties: List[Dict], routes: Dict[str, List[str]]) -> None:
+        if drops.empty:
+            return
+        records = {record['url']: record for record in properties}
+        listings = [
+            (drop.url, format_price_drop(drop.url, drop.previous_price, drop.price, drop.currency, records[drop.url]))
+            for drop in drops.itertuples()
+        ]
+        self.notifier.notify(self.store, self.by_chat(listings, routes), [])
+        METRICS.inc('price_drops_total', len(listings))
+        print(f"Queued {len(listings)} price drop notifications")
+
+    def by_chat(self, listings: List[Tuple[str, str]],
+                routes: Dict[str, List[str]]) -> Dict[str, List[Tuple[str, str]]]:
+        """Group (url, text) listings by the chats of the subscribers they match."""
+        by_chat: Dict[str, List[Tuple[str, str]]] = {}
+        unrouted = 0
+        for ad_url, text in listings:
+            # Listings without details match every subscriber
+            chats = routes[ad_url] if ad_url in routes else self.subscriptions.chats()
+            unrouted += not chats
+            for chat_id in chats:
+                by_chat.setdefault(chat_id, []).append((ad_url, text))
+        if unrouted:
+            METRICS.inc('listings_unrouted_total', unrouted)
+        return by_chat
+
+    def save_checkpoint(self, url: str) -> None:
+        pending = [dict(ad, unseen=unseen) for ad, unseen in self.pending[url].values()]
+        if self.next_page[url] or pending:
+            self.store.save_checkpoint(url, self.next_page[url], pending)
+        else:
+            self.store.clear_checkpoint(url)
@@ -0,0 +1,104 @@
+"""
+Planner Module: Turn the search URLs of a run into fewer search crawls.
+
+Each URL is parsed by its site adapter into a canonical query (site, operation,
+property kinds, zones, price range, minimum surface), which drops fragments and
+parameters that do not change the results. Identical queries are crawled once,
+a query contained in a wider one is served by the wider one's results, and
+queries that only differ in their zones are merged into one search where the
+portal can express it. The listings of a planned search are then attributed
+locally to the original searches they match.
+"""
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from records import missing, words
+from scraper import get_adapter
+from sites import SearchQuery
+
+
+class PlannedSearch:
+    """One search to crawl and the original searches (url -> query) it serves."""
+
+    def __init__(self, url: str, query: Optional[SearchQuery], originals: Dict[str, Optional[SearchQuery]]):
+        self.url = url
+        self.query = query
+        self.originals = originals
+
+    def originals_for(self, record) -> List[str]:
+        """
+        The original searches a normalized record (a frame row, or None for a
+        listing without details) belongs to. Details it lacks do not rule any out,
+        and a record matching none is attributed to all of them.
+        """
+        if len(self.originals) == 1 or record is None:
+            return list(self.originals)
+        price = None if missing(record.price) else float(record.price)
+        surface = None if missing(record.surface) else float(record.surface)
+        matched = [url for url, query in self.originals.items()
+                   if query is None or matches(query, price, str(record.currency), surface, record.neighbourhood)]
+        return matched or list(self.originals)
+
+
+def matches(query: SearchQuery, price: Optional[float], currency: Optional[str], surface: Optional[float],
+            neighbourhood: Optional[str]) -> bool:
+    """Whether a listing passes a query's filters; missing details pass the filters on them."""
+    if price is not None and query.currency == currency:
+        if query.min_price is not None and price < query.min_price:
+            return False
+        if query.max_price is not None and price > query.max_price:
+            return False
+    if surface is not None and query.min_surface is not None and surface < query.min_surface:
+        return False
+    text = ' ' + ' '.join(words(neighbourhood)) + ' '
+    if query.zones and text.strip():
+        # The innermost location of each zone, e.g. "vicente lopez" for bsas-gba-norte/vicente-lopez
+        names = [' '.join(words(zone.rsplit('/', 1)[-1].replace('-', ' '))) for zone in query.zones]
+        return any(f" {name} " in text for name in names)
+    return True
+
+
+def _strip_fragment(url: str) -> str:
+    return urlparse(url)._replace(fragment='').geturl()
+
+
+def plan_searches(urls: List[str]) -> List[PlannedSearch]:
+    """Plan the crawls covering `urls`, in the order the URLs are given."""
+    queries: Dict[str, Optional[SearchQuery]] = {}
+    for url in urls:
+        adapter = get_adapter(url)
+        queries[url] = adapter.search_query(url) if adapter else None
+
+    # Identical queries collapse into the first one; URLs without a query only by their text
+    groups: Dict[object, Dict[str, Optional[SearchQuery]]] = {}
+    for url, query in queries.items():
+        groups.setdefault(query if query is not None else _strip_fragment(url), {})[url] = query
+
+    # Queries contained in a wider one are served by it
+    distinct = [key for key in groups if isinstance(key, SearchQuery)]
+    for key in distinct:
+        container = next((other for other in distinct
+                          if other != key and other in groups and other.contains(key)), None)
+        if container is not None and key in groups:
+            groups[container].update(groups.pop(key))
+
+    # Queries differing only in their zones become one search where the portal allows it
+    planned: List[PlannedSearch] = []
+    merged: Dict[tuple, PlannedSearch] = {}
+    for key, originals in groups.items():
+        if not isinstance(key, SearchQuery):
+            planned.append(PlannedSearch(key, None, originals))
+            continue
+        search = merged.get(key.key())
+        if search is not None and key.zones and search.query.zones:
+            wider = SearchQuery(key.host, key.operation, key.kinds, key.zones | search.query.zones,
+                                key.min_price, key.max_price, key.currency, key.min_surface, key.extra)
+            url = get_adapter(search.url).search_url(wider)
+            if url:
+                search.url, search.query = url, wider
+                search.originals.update(originals)
+                continue
+        search = PlannedSearch(_strip_fragment(next(iter(originals))), key, originals)
+        merged.setdefault(key.key(), search)
+        planned.append(search)
+    return planned
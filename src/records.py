@@ -0,0 +1,156 @@
+"""
+Records Module: Typed, normalized property records.
+
+The scrapers return loosely typed dicts, where a price may be 850000, "$850.000"
+or "USD 900" and a surface "60 m²". `normalize` turns a batch of them into a
+columnar pandas frame with numeric columns, so filtering rules and price changes
+are evaluated on whole batches at once instead of dict by dict. pandas is only
+imported once a batch is normalized, so runs with nothing new never load it.
+"""
+import math
+import re
+import unicodedata
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+FIELDS = ['url', 'price', 'expenses', 'surface', 'rooms', 'neighbourhood', 'scraped_at']
+CURRENCIES = ['ARS', 'USD']
+# More rooms than this is a misread value (e.g. a surface), left missing
+MAX_ROOMS = 50
+
+NUMBER_PATTERN = r"(\d+(?:[.,]\d+)*)"
+USD_PATTERN = r"(?i)\b(?:usd|us\$|u\$s|u\$d)"
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def missing(value) -> bool:
+    """Whether a frame value is missing (None, NaN or pandas' NA), without importing pandas."""
+    try:
+        return value is None or bool(value != value)
+    except TypeError:
+        # pandas' NA compares to NA, which has no truth value
+        return True
+
+
+def words(text) -> List[str]:
+    """The lowercase, accent-stripped words of a text such as a neighbourhood or address."""
+    if missing(text):
+        return []
+    ascii_text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    return WORD_RE.findall(ascii_text.lower())
+
+
+def to_numbers(values: 'pd.Series') -> 'pd.Series':
+    """
+    The first number in each value, e.g. 850000, "$ 850.000", "1.234,5" or "60 m²".
+    Dots group thousands and a comma is the decimal separator, as on Argentine
+    portals, unless the comma itself groups thousands ("1,200").
+    """
+    import pandas as pd
+
+    text = values.astype('string').str.extract(NUMBER_PATTERN, expand=False)
+    comma_thousands = text.str.fullmatch(r"\d{1,3}(?:,\d{3})+", na=False)
+    decimal_comma = text.str.contains(',', regex=False, na=False) & ~comma_thousands
+    dot_thousands = ~decimal_comma & (text.str.count(r"\.").gt(1) | text.str.contains(r"\.\d{3}$", na=False))
+    text = text.mask(comma_thousands, text.str.replace(',', '', regex=False))
+    text = text.mask(decimal_comma, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    text = text.mask(dot_thousands, text.str.replace('.', '', regex=False))
+    return pd.to_numeric(text, errors='coerce')
+
+
+def normalize(records: List[Dict]) -> 'pd.DataFrame':
+    """A frame of typed records: float prices with their currency, m² surfaces and integer rooms."""
+    import numpy as np
+    import pandas as pd
+
+    raw = pd.DataFrame.from_records(records, columns=FIELDS)
+    price = raw['price'].astype('string')
+    rooms = to_numbers(raw['rooms']).round()
+    return pd.DataFrame({
+        'url': raw['url'].astype(str),
+        'price': to_numbers(raw['price']).astype('float64'),
+        'currency': pd.Categorical(
+            np.where(price.str.contains(USD_PATTERN, na=False), 'USD', 'ARS'), categories=CURRENCIES),
+        'expenses': to_numbers(raw['expenses']).astype('float64'),
+        'surface': to_numbers(raw['surface']).astype('float32'),
+        'rooms': rooms.where(rooms.between(0, MAX_ROOMS)).astype('Int8'),
+        'neighbourhood': raw['neighbourhood'].astype('string'),
+        'scraped_at': raw['scraped_at'].astype('string'),
+    })
+
+
+class Rules:
+    """
+    Filters on normalized records. Amounts are in `currency`; prices in the other
+    currency are converted at `usd_rate` pesos per dollar, and when no rate is
+    set they only face the surface rule. Records missing a value pass the rules
+    that need it.
+    """
+
+    def __init__(self, max_total_cost: Optional[float] = None, min_surface: Optional[float] = None,
+                 max_price_per_m2: Optional[float] = None, currency: str = 'ARS',
+                 usd_rate: Optional[float] = None):
+        self.max_total_cost = max_total_cost
+        self.min_surface = min_surface
+        self.max_price_per_m2 = max_price_per_m2
+        self.currency = currency
+        self.usd_rate = usd_rate
+
+    @classmethod
+    def from_env(cls, env: Dict) -> 'Rules':
+        return cls(env['max_total_cost'], env['min_surface'], env['max_price_per_m2'],
+                   env['rules_currency'], env['usd_rate'])
+
+    def __bool__(self) -> bool:
+        return any(limit is not None for limit in (self.max_total_cost, self.min_surface, self.max_price_per_m2))
+
+    def price_in_currency(self, frame: 'pd.DataFrame') -> 'pd.Series':
+        """Each record's price in the rules' currency, NaN when it cannot be converted."""
+        import numpy as np
+
+        rate = self.usd_rate or np.nan
+        factor = np.where(frame['currency'] == self.currency, 1.0,
+                          rate if self.currency == 'ARS' else 1 / rate)
+        return frame['price'] * factor
+
+    def evaluate(self, frame: 'pd.DataFrame') -> 'pd.Series':
+        """A boolean mask of the records that pass every rule."""
+        import pandas as pd
+
+        passed = pd.Series(True, index=frame.index)
+        price = self.price_in_currency(frame)
+        if self.max_total_cost is not None:
+            # Expenses are always quoted in pesos
+            expenses = frame['expenses'].fillna(0)
+            if self.currency != 'ARS':
+                expenses = expenses / (self.usd_rate or math.nan)
+            total = price + expenses
+            passed &= total.isna() | (total <= self.max_total_cost)
+        if self.min_surface is not None:
+            passed &= frame['surface'].isna() | (frame['surface'] >= self.min_surface)
+        if self.max_price_per_m2 is not None:
+            per_m2 = price / frame['surface'].where(frame['surface'] > 0)
+            passed &= per_m2.isna() | (per_m2 <= self.max_price_per_m2)
+        return passed
+
+
+def price_drops(frame: 'pd.DataFrame', previous: 'pd.DataFrame', min_drop: float) -> 'pd.DataFrame':
+    """
+    The records whose price fell by at least `min_drop` (a fraction) from their
+    previous (url, price, currency), with that price as `previous_price`.
+    """
+    joined = frame.merge(previous.rename(columns={'price': 'previous_price', 'currency': 'previous_currency'}),
+                         on='url', how='inner')
+    same_currency = joined['currency'].astype(str) == joined['previous_currency'].astype(str)
+    dropped = joined['price'] <= joined['previous_price'] * (1 - min_drop)
+    return joined[same_currency & dropped & (joined['price'] < joined['previous_price'])]
+
+
+def price_changes(frame: 'pd.DataFrame', previous: 'pd.DataFrame') -> 'pd.DataFrame':
+    """(url, scraped_at, price, currency) of the records whose price differs from their previous one, if any."""
+    joined = frame[frame['price'].notna()].merge(previous, on='url', how='left', suffixes=('', '_previous'))
+    changed = (joined['price'] != joined['price_previous']) | \
+        (joined['currency'].astype(str) != joined['currency_previous'].astype(str))
+    return joined.loc[changed, ['url', 'scraped_at', 'price', 'currency']]
@@ -1,338 +1,121 @@
 """
 Property Scraper Module: Contains all scraping-related functionality.
+
+Site-specific logic lives in the adapters of the `sites` package; the functions
+here look up the adapter for a URL once and delegate to it.
+
+Parse workers import this module to unpickle their tasks, so it must not import
+the pipeline's modules (pandas); cloudscraper is only imported once a scraper is
+created.
 """
-import re
-from urllib.parse import urlparse
-import cloudscraper
-from bs4 import BeautifulSoup
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from metrics import METRICS
+from sites import Page, empty_record, get_adapter, merge_details, needs_details, set_parser_backend
 
 
 def create_scraper():
     """Create and return a cloudscraper instance."""
+    import cloudscraper
     return cloudscraper.create_scraper()
 
 
 def parse_search_details(url):
     """Extract zone, price, and minimum surface from a search URL."""
-    parsed = urlparse(url)
-    path = parsed.path.lower()
-    zone = price = min_surface = None
-    
-    # Zonaprop
-    if 'zonaprop.com.ar' in parsed.netloc:
-        # Example: /departamentos-alquiler-capital-federal-mas-50-m2-35000-1000000-pesos-orden-antiguedad-ascendente-q-terraza.html
-        # Try to extract zone
-        zone_match = re.search(r'alquiler-([a-z\-]+)-mas', path)
-        if zone_match:
-            zone = zone_match.group(1).replace('-', ' ').title()
-        # Try to extract price range
-        price_match = re.search(r'(\d+)-(\d+)-pesos', path)
-        if price_match:
-            price = f"${price_match.group(1)} - ${price_match.group(2)}"
-        # Try to extract minimum surface
-        surface_match = re.search(r'mas-(\d+)-m2', path)
-        if surface_match:
-            min_surface = surface_match.group(1)
-            
-    # Argenprop
-    elif 'argenprop.com' in parsed.netloc:
-        # Example: /casas-o-departamentos-o-locales-o-ph/alquiler/belgrano-o-br-norte-o-colegiales-o-florida-vicente-lopez-o-palermo-o-parque-centenario-o-saavedra-o-vicente-lopez/pesos-300000-1700000
-        # Try to extract zones
-        zone_match = re.search(r'alquiler/([^/]+)', path)
-        if zone_match:
-            zone = zone_match.group(1).replace('-o-', ', ').replace('-', ' ').title()
-        # Try to extract price range
-        price_match = re.search(r'pesos-(\d+)-(\d+)', path)
-        if price_match:
-            price = f"${price_match.group(1)} - ${price_match.group(2)}"
-            
-    # MercadoLibre
-    elif 'mercadolibre.com.ar' in parsed.netloc:
-        # Extract from query parameters
-        query = parsed.query
-        fragment = parsed.fragment
-        
-        # Try to extract price range from fragment or query
-        price_match = re.search(r'(\d+)ARS-(\d+)ARS', query + fragment)
-        if price_match:
-            price = f"${price_match.group(1)} - ${price_match.group(2)}"
-        
-        # Try to extract minimum surface
-        surface_match = re.search(r'AREA_(\d+)-', query + fragment)
-        if surface_match:
-            min_surface = surface_match.group(1)
-            
-        # Try to extract zone from path
-        zone_match = re.search(r'/([^/]+)/_', path)
-        if zone_match:
-            zone = zone_match.group(1).replace('-', ' ').title()
-    
-    return zone, price, min_surface
+    adapter = get_adapter(url)
+    return adapter.parse_search(url) if adapter else (None, None, None)
+
+
+def page_url(url, page):
+    """
+    Return the URL of the given results page (1-based) of a search, sorted
+    newest first where the portal supports it, or None when the source has no
+    such page. URL fragments are dropped since they never reach the server.
+    """
+    adapter = get_adapter(url)
+    if adapter:
+        return adapter.page_url(url, page)
+    return url.split('#')[0] if page == 1 else None
 
 
 def extract_ads(url, html):
-    """Extract ad URLs from a search result page for all supported sources."""
-    soup = BeautifulSoup(html, "lxml")
-    ads = []
-    
-    if 'zonaprop.com.ar' in url:
-        # Zonaprop ad extraction
-        for ad in soup.select('.posting-card, .aviso-row'):
-            link_tag = ad.select_one('a[href*="/propiedades/"]')
-            if link_tag and link_tag.get('href'):
-                full_url = link_tag['href']
-                if not full_url.startswith('http'):
-                    full_url = 'https://www.zonaprop.com.ar' + full_url
-                ads.append({'url': full_url})
-                
-    elif 'mercadolibre.com.ar' in url:
-        # MercadoLibre ad extraction
-        for ad in soup.select('.ui-search-result, .andes-card'):
-            link_tag = ad.select_one('a[href*="/MLA-"]')
-            if link_tag and link_tag.get('href'):
-                full_url = link_tag['href']
-                if not full_url.startswith('http'):
-                    full_url = 'https://departamento.mercadolibre.com.ar' + full_url
-                ads.append({'url': full_url})
-                
-    elif 'argenprop.com' in url:
-        # Look for property cards with links
-        for a in soup.select('a.card__title-link, a.property-title, a.go-to-posting'):  # try common selectors
-            href = a.get('href')
-            if href and ('/propiedad-' in href or '/departamento-' in href or '/casa-' in href or '/ph-' in href or '/local-' in href):
-                if not href.startswith('http'):
-                    href = 'https://www.argenprop.com' + href
-                ads.append({'url': href})
-        # Fallback: look for all links to property pages
-        if not ads:
-            for a in soup.find_all('a', href=True):
-                href = a['href']
-                if ('/propiedad-' in href or '/departamento-' in href or '/casa-' in href or '/ph-' in href or '/local-' in href):
-                    if not href.startswith('http'):
-                        href = 'https://www.argenprop.com' + href
-                    ads.append({'url': href})
-        # Remove duplicates
-        ads = [dict(t) for t in {tuple(d.items()) for d in ads}]
-        return ads
-
-    elif 'facebook.com' in url:
-        # Facebook Marketplace extraction (limited)
-        for ad in soup.select('[data-testid="marketplace-item"]'):
-            link_tag = ad.select_one('a')
-            if link_tag and link_tag.get('href'):
-                full_url = link_tag['href']
-                if not full_url.startswith('http'):
-                    full_url = 'https://www.facebook.com' + full_url
-                ads.append({'url': full_url})
-    
-    return ads
+    """
+    Extract ads from a search result page for all supported sources. Each ad is a
+    property record with its URL and whatever details the result card shows
+    (fields the card lacks are None).
+    """
+    adapter = get_adapter(url)
+    if not adapter:
+        return []
+    with METRICS.timer('parse_seconds', site=adapter.domain, page='search'):
+        ads = adapter.extract_ads(url, Page(html, adapter.search_strainer))
+    METRICS.inc('ads_extracted_total', len(ads), site=adapter.domain)
+    # Remove duplicates, keeping the most complete record of each URL
+    unique = {}
+    for ad in ads:
+        unique[ad['url']] = merge_details(unique[ad['url']], ad) if ad['url'] in unique else ad
+    return list(unique.values())
 
 
 def extract_property_details(url, html):
     """Extract price, expenses, neighbourhood, surface, and other details from a property page."""
-    soup = BeautifulSoup(html, "lxml")
-    details = {"url": url}
-
-    # --- Zonaprop ---
-    if 'zonaprop.com.ar' in url:
-        price = neighbourhood = surface = rooms = expenses = None
-        # Try to extract from JSON-LD
-        for script in soup.find_all('script', type='application/ld+json'):
-            try:
-                import json
-                data = json.loads(script.string)
-                if isinstance(data, dict):
-                    if 'offers' in data and 'price' in data['offers']:
-                        price = data['offers']['price']
-                    if 'address' in data and 'streetAddress' in data['address']:
-                        neighbourhood = data['address']['streetAddress']
-                    if 'numberOfRooms' in data:
-                        rooms = data['numberOfRooms']
-                    if 'floorSize' in data and 'value' in data['floorSize']:
-                        surface = f"{data['floorSize']['value']} m²"
-                    # Try to extract expenses from JSON-LD (custom fields)
-                    if 'additionalProperty' in data:
-                        for prop in data['additionalProperty']:
-                            if isinstance(prop, dict) and 'name' in prop and 'expensa' in prop['name'].lower():
-                                expenses = prop.get('value')
-            except Exception:
-                pass
-        # Fallbacks
-        if not price:
-            price_tag = soup.select_one('.price-value, .price__fraction, .posting-price, .price, [data-qa="POSTING_CARD_PRICE"]')
-            price = price_tag.get_text(strip=True) if price_tag else None
-        if not neighbourhood:
-            zone_tag = soup.select_one('.title-location, .posting-location, .location, [data-qa="POSTING_CARD_LOCATION"]')
-            neighbourhood = zone_tag.get_text(strip=True) if zone_tag else None
-        if not surface:
-            surface_tag = soup.find(string=re.compile(r"(\d+\s?m²|\d+\s?m2)"))
-            surface = surface_tag.strip() if surface_tag else None
-        if not rooms:
-            rooms_tag = soup.find(string=re.compile(r"(\d+)\s*(amb|ambiente)"))
-            if rooms_tag:
-                match = re.search(r"(\d+)", rooms_tag)
-                rooms = match.group(1) if match else None
-        # Expenses fallback: look for 'expensas' in text
-        if not expenses:
-            expensas_tag = soup.find(string=re.compile(r"expensas", re.IGNORECASE))
-            if expensas_tag:
-                match = re.search(r"\$\s?([\d\.]+)", expensas_tag)
-                if match:
-                    expenses = match.group(1)
-        details['price'] = price
-        details['expenses'] = expenses
-        details['neighbourhood'] = neighbourhood
-        details['surface'] = surface
-        details['rooms'] = rooms
-
-    # --- MercadoLibre ---
-    elif 'mercadolibre.com.ar' in url:
-        price = neighbourhood = surface = rooms = expenses = None
-        # Try to extract from JSON-LD
-        for script in soup.find_all('script', type='application/ld+json'):
-            try:
-                import json
-                data = json.loads(script.string)
-                if isinstance(data, dict):
-                    # Price
-                    if 'offers' in data and 'price' in data['offers']:
-                        price = data['offers']['price']
-                    # Neighbourhood/address
-                    if 'address' in data and 'streetAddress' in data['address']:
-                        neighbourhood = data['address']['streetAddress']
-                    # Surface
-                    if 'floorSize' in data and 'value' in data['floorSize']:
-                        surface = f"{data['floorSize']['value']} m²"
-                    # Rooms
-                    if 'numberOfRooms' in data:
-                        rooms = data['numberOfRooms']
-            except Exception:
-                pass
-        # Fallbacks
-        if not price:
-            price_json = re.search(r'"price":\s*(\d+)', html)
-            if price_json:
-                price = f"${price_json.group(1)}"
-            else:
-                price_tag = soup.select_one('.price-tag-fraction, .ui-pdp-price__second-line, .price-tag-symbol, .price-tag, span[class*="price"]')
-                price = price_tag.get_text(strip=True) if price_tag else None
-        if not neighbourhood:
-            neighbourhood_json = re.search(r'"addressLine"\s*:\s*"([^"]+)"', html)
-            if neighbourhood_json:
-                neighbourhood = neighbourhood_json.group(1)
-            else:
-                zone_tag = soup.select_one('.ui-vip-location__subtitle, .ui-pdp-media__title, .breadcrumb, [data-testid="address"]')
-                neighbourhood = zone_tag.get_text(strip=True) if zone_tag else None
-        if not surface:
-            # Try JSON
-            surface_json = re.search(r'"Superficie total"\s*[:,]\s*"?(\d+\s?m²)"?', html)
-            if surface_json:
-                surface = surface_json.group(1)
-            else:
-                # Try table/definition list
-                for label in soup.find_all(['th', 'dt'], string=re.compile(r"Superficie", re.IGNORECASE)):
-                    value = label.find_next(['td', 'dd'])
-                    if value:
-                        surface = value.get_text(strip=True)
-                        break
-                if not surface:
-                    surface_tag = soup.find(string=re.compile(r"(\d+\s?m²|\d+\s?m2)"))
-                    surface = surface_tag.strip() if surface_tag else None
-        if not rooms:
-            # Try JSON
-            rooms_json = re.search(r'"Ambientes"\s*[:,]\s*"?(\d+)"?', html)
-            if rooms_json:
-                rooms = rooms_json.group(1)
-            else:
-                # Try table/definition list
-                for label in soup.find_all(['th', 'dt'], string=re.compile(r"Ambientes", re.IGNORECASE)):
-                    value = label.find_next(['td', 'dd'])
-                    if value:
-                        rooms = value.get_text(strip=True)
-                        break
-                if not rooms:
-                    rooms_cell = soup.find('td', string=re.compile(r"Ambientes", re.IGNORECASE))
-                    if rooms_cell and rooms_cell.find_next_sibling('td'):
-                        rooms = rooms_cell.find_next_sibling('td').get_text(strip=True)
-        # Expenses: look for 'expensas' in text
-        expensas_tag = soup.find(string=re.compile(r"expensas", re.IGNORECASE))
-        if expensas_tag:
-            match = re.search(r"\$\s?([\d\.]+)", expensas_tag)
-            if match:
-                expenses = match.group(1)
-        details['price'] = price
-        details['expenses'] = expenses
-        details['neighbourhood'] = neighbourhood
-        details['surface'] = surface
-        details['rooms'] = rooms
-
-    # --- Argenprop ---
-    elif 'argenprop.com' in url:
-        price = neighbourhood = surface = rooms = expenses = None
-        # Try to extract from JSON-LD
-        for script in soup.find_all('script', type='application/ld+json'):
-            try:
-                import json
-                data = json.loads(script.string)
-                if isinstance(data, dict):
-                    if 'offers' in data and 'price' in data['offers']:
-                        price = data['offers']['price']
-                    if 'address' in data and 'streetAddress' in data['address']:
-                        neighbourhood = data['address']['streetAddress']
-                    if 'numberOfRooms' in data:
-                        rooms = data['numberOfRooms']
-                    if 'floorSize' in data and 'value' in data['floorSize']:
-                        surface = f"{data['floorSize']['value']} m²"
-                    # Try to extract expenses from JSON-LD (custom fields)
-                    if 'additionalProperty' in data:
-                        for prop in data['additionalProperty']:
-                            if isinstance(prop, dict) and 'name' in prop and 'expensa' in prop['name'].lower():
-                                expenses = prop.get('value')
-            except Exception:
-                pass
-        # Fallbacks
-        if not price:
-            price_tag = soup.select_one('.listing__price, .price, .property-price, [data-qa="price"]')
-            price = price_tag.get_text(strip=True) if price_tag else None
-        if not neighbourhood:
-            zone_tag = soup.select_one('.listing__location, .location, .property-location, [data-qa="location"]')
-            neighbourhood = zone_tag.get_text(strip=True) if zone_tag else None
-        if not surface:
-            surface_tag = soup.find(string=re.compile(r"(\d+\s?m²|\d+\s?m2)"))
-            surface = surface_tag.strip() if surface_tag else None
-        if not rooms:
-            rooms_tag = soup.find(string=re.compile(r"(\d+)\s*(amb|ambiente)"))
-            if rooms_tag:
-                match = re.search(r"(\d+)", rooms_tag)
-                rooms = match.group(1) if match else None
-        # Expenses fallback: look for 'expensas' in text
-        if not expenses:
-            expensas_tag = soup.find(string=re.compile(r"expensas", re.IGNORECASE))
-            if expensas_tag:
-                match = re.search(r"\$\s?([\d\.]+)", expensas_tag)
-                if match:
-                    expenses = match.group(1)
-        details['price'] = price
-        details['expenses'] = expenses
-        details['neighbourhood'] = neighbourhood
-        details['surface'] = surface
-        details['rooms'] = rooms
-
-    # --- Facebook Marketplace (limited) ---
-    elif 'facebook.com' in url:
-        details['price'] = None
-        details['expenses'] = None
-        details['neighbourhood'] = None
-        details['surface'] = None
-        details['rooms'] = None
-    else:
-        details['price'] = None
-        details['expenses'] = None
-        details['neighbourhood'] = None
-        details['surface'] = None
-        details['rooms'] = None
-
-    return details
+    adapter = get_adapter(url)
+    if not adapter:
+        return empty_record(url)
+    with METRICS.timer('parse_seconds', site=adapter.domain, page='detail'):
+        return adapter.extract_details(url, Page(html))
+
+
+def api_search_url(url, page):
+    """
+    Return the URL of the given results page (1-based) of a search on its
+    site's JSON API, or None when the search is crawled through HTML pages.
+    """
+    adapter = get_adapter(url)
+    return adapter.api_search_url(url, page) if adapter else None
+
+
+def extract_api_ads(url, text):
+    """Extract ads from a search's API results page, in the same records as extract_ads."""
+    adapter = get_adapter(url)
+    with METRICS.timer('parse_seconds', site=adapter.domain, page='api-search'):
+        ads = adapter.extract_api_ads(url, text)
+    METRICS.inc('ads_extracted_total', len(ads), site=adapter.domain)
+    return ads
+
+
+def extract_api_items(urls, text):
+    """Extract the details of a batch of listings of one site from its API items response, by URL."""
+    adapter = get_adapter(urls[0])
+    with METRICS.timer('parse_seconds', site=adapter.domain, page='api-items'):
+        return adapter.extract_api_items(urls, text)
+
+
+def parse(kind: str, url: str, html: str) -> List[Dict]:
+    """The records of a fetched search page, or the single record of a detail page."""
+    if kind == 'search':
+        return extract_ads(url, html)
+    return [extract_property_details(url, html)]
+
+
+def parse_page(kind: str, url: str, html: str) -> Tuple[List[Dict], Dict]:
+    """Parse a page in a worker process. Returns its records and the metrics recorded meanwhile."""
+    METRICS.reset()
+    records = parse(kind, url, html)
+    return records, METRICS.snapshot()
+
+
+def create_parse_pool(workers: int, backend: str) -> Optional[ProcessPoolExecutor]:
+    """A pool of `workers` parse processes, or None to parse in the pipeline's thread."""
+    if workers <= 0:
+        return None
+    # Forking a process with fetcher threads running could copy their held locks
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                               initializer=set_parser_backend, initargs=(backend,))
 
 
 def test_zonaprop_scraper():
@@ -3,39 +3,136 @@
 
 """
 Property Scraper: Scrapes property links from various real estate sites and sends new ones via Telegram.
+
+Heavy modules (cloudscraper, the HTML parsers, pandas) are imported by the
+stage that needs them, so a run that stops early, or a parse worker re-importing
+this module, does not pay for them.
 """
-from time import sleep
-from typing import List, Dict
+import argparse
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple
 import os
 
 # Import from our modules
-from scraper import create_scraper, extract_ads, extract_property_details, parse_search_details, test_all_scrapers
-from utils import (
-    load_environment, load_urls, split_seen_and_unseen, update_history,
-    notify_telegram, save_properties_to_csv, format_telegram_message
-)
+from metrics import METRICS
+from storage import DatabaseLock, ListingStore
+from utils import load_environment, load_urls
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    from archive import PageArchive
+    from fetcher import Fetcher
+    from notifier import TelegramNotifier
+    from session import SessionCache
+
+
+# Configuration
+URLS_FP = "urls_to_scrap.txt"
+HISTORY_FP = "outputs/seen.txt"
+CSV_FILENAME = "outputs/scraped_properties.csv"
+DB_FILENAME = "outputs/scraprop.db"
+# Held while notifying, by every run, daemon and worker using the database
+LOCK_FILENAME = "outputs/scraprop.db.lock"
+
+
+def scrape(fetcher: 'Fetcher', store: ListingStore, notifier: 'TelegramNotifier', env: Dict, urls: List[str],
+           notify_lock=None, archive: Optional['PageArchive'] = None,
+           parser: Optional['ProcessPoolExecutor'] = None) -> Dict[str, int]:
+    """
+    Plan and run the streaming pipeline for the given searches. `notify_lock`
+    serializes notifications between concurrent calls, and `parser` is the
+    process pool pages are parsed on (None parses them in this thread). Returns
+    the number of new listings found by each search.
+    """
+    from pipeline import Pipeline
+    from planner import plan_searches
+
+    searches = plan_searches(urls)
+    if len(searches) < len(urls):
+        print(f"Planned {len(searches)} searches covering {len(urls)} URLs")
+    METRICS.inc('searches_planned_total', len(searches))
+    pipeline = Pipeline(fetcher, store, notifier, env, notify_lock, archive, parser)
+    with METRICS.stage('pipeline'):
+        new_listings = pipeline.run(searches)
+    print(f"Scraped {pipeline.scraped} total properties")
+    return new_listings
+
+
+def open_store(db_filename: str = DB_FILENAME, journal_mode: Optional[str] = None) -> ListingStore:
+    """Open the listings database, importing seen.txt and the CSV on first use."""
+    store = ListingStore(db_filename, journal_mode)
+    if store.is_empty():
+        notified, imported = store.import_legacy(HISTORY_FP, CSV_FILENAME)
+        if notified or imported:
+            print(f"Imported {notified} seen URLs and {imported} properties into {db_filename}")
+    return store
+
+
+def open_fetcher(env: Dict) -> Tuple[object, 'SessionCache', 'Fetcher']:
+    """
+    Create the scraper, reusing the cookies and user agent of previous runs,
+    and the rate-limited concurrent fetcher on top of it.
+    """
+    from fetcher import Fetcher, parse_rate_limits
+    from scraper import create_scraper, set_parser_backend
+    from session import SessionCache
+    from sites import set_mercadolibre_api
+
+    set_parser_backend(env['parser_backend'])
+    set_mercadolibre_api(env['mercadolibre_api_url'], env['mercadolibre_token'])
+    scraper = create_scraper()
+    session_cache = SessionCache(env['session_cache'], env['session_max_age_hours'])
+    restored = session_cache.load(scraper)
+    if restored:
+        print(f"Restored {restored} cookies from {env['session_cache']}")
+    fetcher = Fetcher(
+        scraper, parse_rate_limits(env['rate_limits']), session_cache, retries=env['retries'],
+        breaker_threshold=env['breaker_threshold'], breaker_cooldown=env['breaker_cooldown_seconds'],
+    )
+    return scraper, session_cache, fetcher
+
+
+def open_notifier(env: Dict, store: ListingStore, db_filename: str = DB_FILENAME) -> 'TelegramNotifier':
+    """Start the Telegram notifier, resending what earlier runs could not deliver."""
+    from notifier import TelegramNotifier
+
+    notifier = TelegramNotifier(env['telegram_bot_id'], db_filename, env['digest_size'])
+    pending = notifier.start(store)
+    if pending:
+        print(f"Resending {pending} undelivered notifications")
+    return notifier
+
+
+def open_archive(env: Dict) -> Optional['PageArchive']:
+    """The raw page archive, if ARCHIVE_DIR is set."""
+    if not env['archive_dir']:
+        return None
+    from archive import PageArchive
+    return PageArchive(env['archive_dir'])
+
+
+def open_parse_pool(workers: int, backend: str) -> Optional['ProcessPoolExecutor']:
+    """The pool of processes pages are parsed on, or None to parse them in the pipeline's thread."""
+    from scraper import create_parse_pool
+    return create_parse_pool(workers, backend)
 
 
 def main():
     """Main function to run the property scraper."""
-    # Configuration
     # Ensure outputs directory exists
     os.makedirs('outputs', exist_ok=True)
-    urls_fp = "urls_to_scrap.txt"
-    history_fp = "outputs/seen.txt"
-    csv_filename = "outputs/scraped_properties.csv"
+    METRICS.reset()
     
     # Load environment variables
     env = load_environment()
-    if not env['telegram_bot_id'] or not env['telegram_id']:
+    if not env['telegram_bot_id'] or not (env['telegram_id'] or os.path.exists(env['subscribers'])):
         print("Error: Telegram bot credentials not found in .env file")
         return
     
     # Load URLs to scrape
     try:
-        urls = load_urls(urls_fp)
+        urls = load_urls(URLS_FP)
     except FileNotFoundError:
-        print(f"Error: {urls_fp} not found")
+        print(f"Error: {URLS_FP} not found")
         return
     
     if not urls:
@@ -44,77 +141,50 @@ def main():
     
     print(f"Found {len(urls)} URLs to scrape")
     
-    # Create scraper instance
-    scraper = create_scraper()
-    
-    # Store all scraped properties for CSV
-    all_properties: List[Dict] = []
-    
-    # Process each URL
-    for url in urls:
-        retry_count = 0
-        max_retries = 3
-        
-        while retry_count < max_retries:
-            try:
-                print(f"Scraping: {url}")
-                response = scraper.get(url)
-                ads = list(extract_ads(url, response.text))
-                
-                # Remove duplicates
-                ads = [dict(t) for t in {tuple(d.items()) for d in ads}]
-                seen, unseen = split_seen_and_unseen(ads, history_fp)
-                
-                print(f"{len(seen)} seen, {len(unseen)} unseen")
-                
-                # Process all ads for CSV (both seen and unseen)
-                for ad in ads:
-                    try:
-                        ad_response = scraper.get(ad['url'])
-                        property_details = extract_property_details(ad['url'], ad_response.text)
-                        all_properties.append(property_details)
-                        sleep(1)  # Be respectful to the servers
-                    except Exception as e:
-                        print(f"Error extracting details from {ad['url']}: {e}")
-                
-                # Send notifications only for unseen ads
-                if unseen:
-                    search_details = parse_search_details(url)
-                    
-                    for ad in unseen:
-                        message = format_telegram_message(ad['url'], search_details)
-                        success = notify_telegram(env['telegram_bot_id'], env['telegram_id'], message)
-                        if success:
-                            print(f"Notification sent for: {ad['url']}")
-                        else:
-                            print(f"Failed to send notification for: {ad['url']}")
-                        sleep(1)  # Rate limiting
-                    
-                    # Update history with new URLs
-                    new_urls = [ad['url'] for ad in unseen]
-                    update_history(history_fp, new_urls)
-                
-                break  # Success, exit retry loop
-                
-            except Exception as e:
-                retry_count += 1
-                print(f"Error scraping {url} (attempt {retry_count}/{max_retries}): {e}")
-                if retry_count < max_retries:
-                    sleep(5)  # Wait before retry
-                else:
-                    print(f"Failed to scrape {url} after {max_retries} attempts")
+    with METRICS.stage('setup'):
+        store = open_store(DB_FILENAME, env['journal_mode'])
+        scraper, session_cache, fetcher = open_fetcher(env)
+        notifier = open_notifier(env, store)
+        archive = open_archive(env)
+        parser = open_parse_pool(env['parse_workers'], env['parser_backend'])
     
-    # Save all properties to CSV
-    if all_properties:
-        save_properties_to_csv(all_properties, csv_filename)
-        print(f"Scraped {len(all_properties)} total properties")
+    # Serializes notifications with overlapping runs, the daemon and workers
+    notify_lock = DatabaseLock(LOCK_FILENAME)
+    scrape(fetcher, store, notifier, env, urls, notify_lock, archive, parser)
+    fetcher.close()
+    if parser:
+        parser.shutdown()
+    if archive:
+        archive.close()
+    store.close()
+    with METRICS.stage('deliver'):
+        undelivered = notifier.close(env['notify_timeout_seconds'])
+    if undelivered:
+        print(f"{undelivered} notifications not delivered yet, will retry on the next run")
+    session_cache.save(scraper)
+    if session_cache.results:
+        print("Session cache: " + ", ".join(f"{d} {r}" for d, r in sorted(session_cache.results.items())))
     
+    METRICS.write_json(env['metrics_json'])
+    METRICS.write_prometheus(env['metrics_prom'])
     print("Scraping completed!")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape property listings and notify new ones via Telegram.")
+    parser.add_argument("--profile", nargs="?", const="outputs/scraprop.prof", metavar="PATH",
+                        help="dump a cProfile of the run (default: outputs/scraprop.prof)")
+    args = parser.parse_args()
+    
     # Test scrapers (comment out when running main workflow)
-    # test_all_scrapers()
+    # from scraper import test_all_scrapers; test_all_scrapers()
     
     # Run main workflow
-    main()
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(main)
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}")
+    else:
+        main()
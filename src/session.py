@@ -0,0 +1,122 @@
+"""
+Session Module: Persist the scraper's session (cookies such as cf_clearance and
+the user agent they were issued for) across runs, so Cloudflare challenges are
+only solved again when a cached clearance expires or is rejected.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Set
+
+from fetcher import get_domain
+from metrics import METRICS
+from sites import ADAPTERS
+
+CLEARANCE_COOKIE = 'cf_clearance'
+
+
+class SessionCache:
+    """
+    On-disk cache of a scraper session. Cookies are kept until they expire;
+    cookies without an expiry date are kept for `max_age_hours` after the run
+    that saved them.
+    """
+
+    def __init__(self, path: str, max_age_hours: float = 12):
+        self.path = path
+        self.max_age = max_age_hours * 3600
+        self.lock = threading.Lock()
+        # Domains whose clearance was restored from the cache, and the cache
+        # outcome (hit, miss or rejected) of each domain requested so far
+        self.cleared: Set[str] = set()
+        self.results: Dict[str, str] = {}
+        self.challenges: Dict[str, Dict] = {}
+
+    def _domain(self, cookie_domain: str) -> str:
+        return get_domain('https://' + cookie_domain.lstrip('.'), ADAPTERS)
+
+    def load(self, scraper) -> int:
+        """Restore the cached session into a scraper. Returns the number of cookies restored."""
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return 0
+        now = time.time()
+        restored = 0
+        if cached.get('user_agent'):
+            # Clearance cookies are only valid for the user agent that obtained them
+            scraper.headers['User-Agent'] = cached['user_agent']
+        for cookie in cached.get('cookies', []):
+            expires = cookie.get('expires') or cached.get('saved_at', 0) + self.max_age
+            if expires <= now:
+                continue
+            scraper.cookies.set(
+                cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie.get('path', '/'),
+                expires=cookie.get('expires'), secure=cookie.get('secure', False),
+            )
+            restored += 1
+            if cookie['name'] == CLEARANCE_COOKIE:
+                self.cleared.add(self._domain(cookie['domain']))
+        self.challenges = cached.get('challenges', {})
+        return restored
+
+    def save(self, scraper) -> None:
+        """Write the scraper's current session to disk."""
+        cookies = [
+            {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+             'expires': c.expires, 'secure': c.secure}
+            for c in scraper.cookies
+        ]
+        cached = {
+            'saved_at': time.time(),
+            'user_agent': scraper.headers.get('User-Agent'),
+            'cookies': cookies,
+            'challenges': self.challenges,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cached, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def reset(self, scraper) -> None:
+        """
+        Start another run with a long-lived scraper, as the daemon does for the
+        polls it starts together: the clearances it holds now count as cached, and
+        the first response from each domain is checked again.
+        """
+        with self.lock:
+            self.cleared = {self._domain(c.domain) for c in scraper.cookies if c.name == CLEARANCE_COOKIE}
+            self.results = {}
+
+    def check(self, domain: str, challenged: bool) -> bool:
+        """
+        Record the outcome of the first response from a domain: a hit when a cached
+        clearance was accepted, a miss when there was none. Returns True when the
+        cached clearance was rejected, so the caller retries with a fresh challenge.
+        """
+        with self.lock:
+            if challenged:
+                self._record_challenge(domain)
+            if domain in self.results:
+                return False
+            if domain not in self.cleared:
+                result = 'miss'
+            else:
+                result = 'rejected' if challenged else 'hit'
+            self.results[domain] = result
+            METRICS.inc('session_cache_total', domain=domain, result=result)
+            return result == 'rejected'
+
+    def _record_challenge(self, domain: str) -> None:
+        entry = self.challenges.setdefault(domain, {'count': 0})
+        entry['count'] += 1
+        entry['last'] = time.time()
+
+    def invalidate(self, scraper, domain: str) -> None:
+        """Drop every cookie of a domain so the next request solves a fresh challenge."""
+        for cookie in list(scraper.cookies):
+            if self._domain(cookie.domain) == domain:
+                scraper.cookies.clear(cookie.domain, cookie.path, cookie.name)
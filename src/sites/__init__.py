@@ -0,0 +1,39 @@
+"""
+Site adapters: one per supported source, looked up by the URL's hostname.
+"""
+from urllib.parse import urlparse
+
+from .base import (
+    PARSER_BACKENDS, PROPERTY_FIELDS, REQUIRED_FIELDS, ExpensesReader, Page, SearchQuery, SiteAdapter,
+    empty_record, expenses_in_text, is_json_ld_script, json_ld_fields, mentions_expenses, merge_details,
+    needs_details, set_parser_backend
+)
+from .argenprop import ArgenpropAdapter
+from .facebook import FacebookAdapter
+from .mercadolibre import MercadoLibreAdapter, set_api as set_mercadolibre_api
+from .zonaprop import ZonapropAdapter
+
+ADAPTERS = {}
+
+
+def register(adapter):
+    """Register a site adapter for its domain and return it."""
+    ADAPTERS[adapter.domain] = adapter
+    return adapter
+
+
+def get_adapter(url):
+    """
+    The adapter for a URL, found by looking up its hostname and then each parent
+    domain (departamento.mercadolibre.com.ar, mercadolibre.com.ar, com.ar).
+    """
+    labels = (urlparse(url).hostname or '').lower().split('.')
+    for i in range(len(labels) - 1):
+        adapter = ADAPTERS.get('.'.join(labels[i:]))
+        if adapter:
+            return adapter
+    return None
+
+
+for _adapter in (ZonapropAdapter(), ArgenpropAdapter(), MercadoLibreAdapter(), FacebookAdapter()):
+    register(_adapter)
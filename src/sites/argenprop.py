@@ -0,0 +1,118 @@
+"""
+Argenprop adapter.
+"""
+import re
+from urllib.parse import urlparse, urlunparse
+
+from .base import SearchQuery, SiteAdapter, card_record, card_strainer, empty_record, json_ld_details, text_fallbacks
+
+# Classes of the element wrapping each listing on search pages
+CARD_CLASSES = ('listing__item', 'card')
+LINK_SELECTOR = 'a.card__title-link, a.property-title, a.go-to-posting'
+PROPERTY_PATHS = ('/propiedad-', '/departamento-', '/casa-', '/ph-', '/local-')
+OPERATIONS = ('alquiler', 'venta', 'alquiler-temporal')
+PRICE_SEGMENT_RE = re.compile(r'(pesos|dolares)-(\d+)-(\d+)')
+# Order page_url crawls every search in
+DEFAULT_ORDER = 'orden-masnuevos'
+
+
+class ArgenpropAdapter(SiteAdapter):
+    domain = 'argenprop.com'
+    base_url = 'https://www.argenprop.com'
+    rate_limit = (1.0, 2, 2)
+    streams_details = True
+    search_strainer = card_strainer(*CARD_CLASSES)
+
+    def parse_search(self, url):
+        path = urlparse(url).path.lower()
+        zone = price = None
+        # Example: /casas-o-departamentos-o-locales-o-ph/alquiler/belgrano-o-br-norte-o-colegiales-o-florida-vicente-lopez-o-palermo-o-parque-centenario-o-saavedra-o-vicente-lopez/pesos-300000-1700000
+        # Try to extract zones
+        zone_match = re.search(r'alquiler/([^/]+)', path)
+        if zone_match:
+            zone = zone_match.group(1).replace('-o-', ', ').replace('-', ' ').title()
+        # Try to extract price range
+        price_match = re.search(r'pesos-(\d+)-(\d+)', path)
+        if price_match:
+            price = f"${price_match.group(1)} - ${price_match.group(2)}"
+        return zone, price, None
+
+    def search_query(self, url):
+        # Example: /departamentos-o-ph/alquiler/belgrano-o-palermo/pesos-300000-1700000?orden-masnuevos
+        parsed = urlparse(url)
+        segments = [segment for segment in parsed.path.lower().split('/') if segment]
+        if len(segments) < 2 or segments[1] not in OPERATIONS:
+            return None
+        zones, extra = [], []
+        min_price = max_price = currency = None
+        for segment in segments[2:]:
+            match = PRICE_SEGMENT_RE.fullmatch(segment)
+            if match:
+                currency = 'ARS' if match.group(1) == 'pesos' else 'USD'
+                min_price, max_price = int(match.group(2)), int(match.group(3))
+            elif not zones and not extra:
+                zones = segment.split('-o-')
+            else:
+                extra.append(segment)
+        extra += ['?' + param for param in parsed.query.split('&')
+                  if param and not param.startswith('pagina-') and param != DEFAULT_ORDER]
+        return SearchQuery(parsed.hostname, segments[1], segments[0], zones, min_price, max_price, currency,
+                           None, extra)
+
+    def search_url(self, query):
+        # Argenprop searches any number of zones joined by "-o-"
+        segments = [query.kinds, query.operation]
+        if query.zones:
+            segments.append('-o-'.join(sorted(query.zones)))
+        if query.min_price is not None or query.max_price is not None:
+            if query.min_price is None or query.max_price is None:
+                return None
+            segments.append(f"{'pesos' if query.currency == 'ARS' else 'dolares'}-{query.min_price}-{query.max_price}")
+        segments += [item for item in query.extra if not item.startswith('?')]
+        params = [item[1:] for item in query.extra if item.startswith('?')]
+        return f"https://{query.host}/{'/'.join(segments)}" + (f"?{'&'.join(params)}" if params else '')
+
+    def page_url(self, url, page):
+        # Example: /departamentos/alquiler/palermo?orden-masnuevos&pagina-2
+        parsed = urlparse(url)._replace(fragment='')
+        # Pages are crawled newest first, so the order replaces any other the search had
+        params = [p for p in parsed.query.split('&') if p and not p.startswith(('pagina-', 'orden-'))]
+        params.insert(0, DEFAULT_ORDER)
+        if page > 1:
+            params.append(f'pagina-{page}')
+        return urlunparse(parsed._replace(query='&'.join(params)))
+
+    def extract_ads(self, url, page):
+        ads = []
+        # Look for property cards with links
+        links = page.soup.select(LINK_SELECTOR)  # try common selectors
+        if not links:
+            # Links outside the usual card containers
+            links = page.full_soup().select(LINK_SELECTOR)
+        for a in links:
+            href = a.get('href')
+            if href and any(path in href for path in PROPERTY_PATHS):
+                card = a.find_parent(class_=CARD_CLASSES) or a
+                ads.append(card_record(
+                    self.absolute_url(href), card,
+                    price='.card__price',
+                    expenses='.card__expenses',
+                    location='.card__address, .card__title--primary',
+                    features='.card__main-features li, .card__main-features span',
+                ))
+        # Fallback: look for all links to property pages
+        if not ads:
+            for a in page.full_soup().find_all('a', href=True):
+                href = a['href']
+                if any(path in href for path in PROPERTY_PATHS):
+                    ads.append(card_record(self.absolute_url(href), None))
+        return ads
+
+    def extract_details(self, url, page):
+        details = empty_record(url)
+        details.update(json_ld_details(page))
+        return text_fallbacks(
+            page, details,
+            price_selector='.listing__price, .price, .property-price, [data-qa="price"]',
+            location_selector='.listing__location, .location, .property-location, [data-qa="location"]',
+        )
@@ -0,0 +1,514 @@
+"""
+Site adapter interface and the parsing helpers shared by all adapters.
+"""
+import json
+import re
+from urllib.parse import urlparse
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer
+from lxml import etree
+
+# Parsing backend: "fast" reads JSON-LD straight from the raw HTML, reads the text
+# fallbacks of detail pages from an lxml tree and restricts search pages to the
+# result cards; "full" always parses the whole document into a BeautifulSoup tree.
+PARSER_BACKENDS = ('fast', 'full')
+PARSER_BACKEND = 'fast'
+
+# Fields of a property record, and those that make a search result card complete
+# enough to skip fetching the ad's detail page
+PROPERTY_FIELDS = ['price', 'expenses', 'neighbourhood', 'surface', 'rooms']
+REQUIRED_FIELDS = ['price', 'neighbourhood', 'surface', 'rooms']
+
+JSON_LD_RE = re.compile(
+    r'<script\b[^>]*\btype=["\']?application/ld\+json["\']?[^>]*>(.*?)</script>',
+    re.DOTALL | re.IGNORECASE,
+)
+SURFACE_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s?m(?:²|2)")
+ROOMS_RE = re.compile(r"(\d+)\s*(?:amb|ambiente)", re.IGNORECASE)
+EXPENSES_RE = re.compile(r"\$\s?([\d\.]+)")
+SURFACE_TEXT_RE = re.compile(r"(\d+\s?m²|\d+\s?m2)")
+ROOMS_TEXT_RE = re.compile(r"(\d+)\s*(amb|ambiente)")
+DIGITS_RE = re.compile(r"(\d+)")
+EXPENSAS_TEXT_RE = re.compile(r"expensas", re.IGNORECASE)
+# The CSS selectors the fast backend evaluates as XPath: tag names, classes and
+# [attr], [attr="value"] or [attr*="value"] conditions, joined by descendant spaces
+SIMPLE_SELECTOR_RE = re.compile(r'([a-z][a-z0-9-]*|\*)?((?:\.[\w-]+|\[[\w-]+(?:\*?=(?:"[^"]*"|\'[^\']*\'))?\])*)$')
+SELECTOR_PART_RE = re.compile(r'\.([\w-]+)|\[([\w-]+)(?:(\*?=)(?:"([^"]*)"|\'([^\']*)\'))?\]')
+# Elements whose text BeautifulSoup's get_text() leaves out
+NON_TEXT_TAGS = ('script', 'style', 'template')
+
+
+def set_parser_backend(backend):
+    """Select the parsing backend used by all site adapters."""
+    global PARSER_BACKEND
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend: {backend} (expected one of {', '.join(PARSER_BACKENDS)})")
+    PARSER_BACKEND = backend
+
+
+class Page:
+    """A fetched page whose BeautifulSoup tree is only built when first needed."""
+
+    def __init__(self, html, parse_only=None):
+        self.html = html
+        self.parse_only = parse_only if PARSER_BACKEND == 'fast' else None
+        self._soup = None if PARSER_BACKEND == 'fast' else BeautifulSoup(html, "lxml")
+        self._tree = None
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.html, "lxml", parse_only=self.parse_only)
+        return self._soup
+
+    def full_soup(self):
+        """The tree of the whole document, even if the page was restricted to some regions."""
+        if self.parse_only is not None:
+            self.parse_only = None
+            self._soup = None
+        return self.soup
+
+    def _whole_soup(self):
+        """The BeautifulSoup tree of the whole document if it was built, else None."""
+        return self._soup if self._soup is not None and self.parse_only is None else None
+
+    @property
+    def tree(self):
+        """The document's lxml tree, an order of magnitude cheaper to build than the soup."""
+        if self._tree is None:
+            try:
+                self._tree = etree.fromstring(self.html, etree.HTMLParser())
+            except ValueError:
+                # Text declaring its encoding must be given as bytes
+                self._tree = etree.fromstring(self.html.encode('utf-8'), etree.HTMLParser(encoding='utf-8'))
+        return self._tree
+
+    def find_string(self, pattern):
+        """The first string of the document, comments and scripts included, in which `pattern` is found."""
+        soup = self._whole_soup()
+        if soup is not None:
+            return soup.find(string=pattern)
+        if self.tree is None:
+            return None
+        for text, _ in self.strings():
+            if text and pattern.search(text):
+                return text
+        return None
+
+    def select_text(self, selector):
+        """
+        The stripped text of the first element matching a CSS selector, or None
+        if there is none. Without the soup, the simple selectors the adapters use
+        are matched on the lxml tree.
+        """
+        soup = self._whole_soup()
+        if soup is None and self.tree is None:
+            return None
+        if soup is None:
+            found = self.tree.xpath(css_to_xpath(selector))
+            return ''.join(text.strip() for text in element_strings(found[0]) if text and text.strip()) \
+                if found else None
+        tag = soup.select_one(selector)
+        return tag.get_text(strip=True) if tag else None
+
+    def strings(self):
+        """
+        Yield (string, whether it is a JSON-LD block) for every string of the
+        document in order, comments and scripts included.
+        """
+        soup = self._whole_soup()
+        if soup is not None:
+            for string in soup.descendants:
+                if isinstance(string, NavigableString):
+                    parent = string.parent
+                    yield str(string), parent is not None and is_json_ld_script(parent.name, parent.get('type'))
+            return
+        if self.tree is None:
+            return
+        top_level = [*reversed(list(self.tree.itersiblings(preceding=True))), self.tree, *self.tree.itersiblings()]
+        for node in top_level:
+            yield from document_strings(node, with_json_ld=True)
+
+    def json_ld(self):
+        """Yield the parsed content of every JSON-LD block, skipping invalid ones."""
+        if self._soup is not None and self.parse_only is None:
+            blocks = (script.string for script in self._soup.find_all('script', type='application/ld+json'))
+        else:
+            blocks = (match.group(1) for match in JSON_LD_RE.finditer(self.html))
+        for block in blocks:
+            try:
+                yield json.loads(block)
+            except Exception:
+                pass
+
+
+def document_strings(element, with_json_ld=False):
+    """
+    Every string under an lxml element, with comment and script text, in
+    document order; with `with_json_ld`, as (string, whether it is a JSON-LD block).
+    """
+    if with_json_ld:
+        yield element.text, isinstance(element.tag, str) and is_json_ld_script(element.tag, element.get('type'))
+    else:
+        yield element.text
+    for child in element:
+        yield from document_strings(child, with_json_ld)
+        yield (child.tail, False) if with_json_ld else child.tail
+
+
+def is_json_ld_script(name, type_attr):
+    return name == 'script' and 'ld+json' in (type_attr or '').lower()
+
+
+def element_strings(element):
+    """The strings BeautifulSoup's get_text() joins for an lxml element: no comments, scripts or styles."""
+    if isinstance(element.tag, str) and element.tag not in NON_TEXT_TAGS:
+        yield element.text
+        for child in element:
+            yield from element_strings(child)
+            yield child.tail
+
+
+def css_to_xpath(selector):
+    """The XPath of a group of simple CSS selectors (see SIMPLE_SELECTOR_RE), in document order."""
+    paths = []
+    for alternative in selector.split(','):
+        steps = []
+        for compound in alternative.split():
+            match = SIMPLE_SELECTOR_RE.match(compound)
+            if not match or not (match.group(1) or match.group(2)):
+                raise ValueError(f"Unsupported CSS selector: {compound}")
+            conditions = []
+            for cls, attr, operator, double, single in SELECTOR_PART_RE.findall(match.group(2)):
+                value = double or single
+                if cls:
+                    conditions.append(f"contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')")
+                elif not operator:
+                    conditions.append(f"@{attr}")
+                elif operator == '=':
+                    conditions.append(f"@{attr}={xpath_literal(value)}")
+                else:
+                    conditions.append(f"contains(@{attr}, {xpath_literal(value)})")
+            steps.append((match.group(1) or '*') + ''.join(f'[{condition}]' for condition in conditions))
+        paths.append('//' + '//'.join(steps))
+    return ' | '.join(paths)
+
+
+def xpath_literal(value):
+    return f'"{value}"' if '"' not in value else f"'{value}'"
+
+
+def card_strainer(*classes):
+    """
+    A SoupStrainer keeping the elements with any of `classes` among their
+    classes. While parsing, the strainer is given the raw class attribute
+    (e.g. "posting-card is-featured"), so it is split into its names.
+    """
+    names = frozenset(classes)
+
+    def has_card_class(value):
+        if not value:
+            return False
+        return not names.isdisjoint(value.split() if isinstance(value, str) else value)
+
+    return SoupStrainer(class_=has_card_class)
+
+
+def empty_record(url):
+    """A property record with all detail fields unknown."""
+    record = {'url': url}
+    for field in PROPERTY_FIELDS:
+        record[field] = None
+    return record
+
+
+def needs_details(ad):
+    """Whether an ad's record lacks fields that only its detail page can provide."""
+    return any(ad.get(field) is None for field in REQUIRED_FIELDS)
+
+
+def merge_details(ad, details):
+    """Fill the fields an ad's search result card lacks with those from its detail page."""
+    merged = dict(details)
+    merged.update({key: value for key, value in ad.items() if value is not None})
+    return merged
+
+
+def card_record(url, card, price=None, expenses=None, location=None, features=None):
+    """Build a property record from the CSS selectors of a search result card."""
+    record = empty_record(url)
+    if card is None:
+        return record
+
+    def text(selector):
+        tag = card.select_one(selector) if selector else None
+        return (tag.get_text(" ", strip=True) or None) if tag else None
+
+    record['price'] = text(price)
+    record['neighbourhood'] = text(location)
+    expenses_text = text(expenses)
+    if expenses_text:
+        match = EXPENSES_RE.search(expenses_text)
+        record['expenses'] = match.group(1) if match else None
+    for tag in card.select(features) if features else []:
+        add_feature(record, tag.get_text(" ", strip=True))
+    return record
+
+
+def add_feature(record, feature):
+    """Fill surface or rooms from a feature text such as "60 m² tot." or "3 amb.", if still unknown."""
+    surface_match = SURFACE_RE.search(feature)
+    if surface_match and not record['surface']:
+        record['surface'] = f"{surface_match.group(1)} m²"
+    rooms_match = ROOMS_RE.search(feature)
+    if rooms_match and not record['rooms']:
+        record['rooms'] = rooms_match.group(1)
+
+
+def json_ld_details(page, with_expenses=True):
+    """
+    Collect price, neighbourhood, rooms, surface and (optionally) expenses from
+    the page's JSON-LD blocks. The first block with a value for a field wins, so
+    a page streamed up to a block has its final value (see streaming.py).
+    """
+    found = {}
+    for data in page.json_ld():
+        json_ld_fields(data, found, with_expenses)
+    return found
+
+
+def json_ld_fields(data, found, with_expenses=True):
+    """Fill the fields `found` has no value for yet with those of one parsed JSON-LD block."""
+    try:
+        if isinstance(data, dict):
+            if not found.get('price') and 'offers' in data and 'price' in data['offers']:
+                found['price'] = data['offers']['price']
+            if not found.get('neighbourhood') and 'address' in data and 'streetAddress' in data['address']:
+                found['neighbourhood'] = data['address']['streetAddress']
+            if not found.get('rooms') and 'numberOfRooms' in data:
+                found['rooms'] = data['numberOfRooms']
+            if not found.get('surface') and 'floorSize' in data and 'value' in data['floorSize']:
+                found['surface'] = f"{data['floorSize']['value']} m²"
+            # Try to extract expenses from JSON-LD (custom fields)
+            if with_expenses and 'additionalProperty' in data:
+                for prop in data['additionalProperty']:
+                    if found.get('expenses'):
+                        break
+                    if isinstance(prop, dict) and 'name' in prop and 'expensa' in prop['name'].lower():
+                        found['expenses'] = prop.get('value')
+    except Exception:
+        pass
+    return found
+
+
+def text_fallbacks(page, details, price_selector, location_selector):
+    """
+    Fill missing details from the page's text: price and location through CSS
+    selectors, surface and rooms through the first matching string. Expenses
+    are those of `page_expenses`.
+    """
+    if not details.get('price'):
+        details['price'] = page.select_text(price_selector)
+    if not details.get('neighbourhood'):
+        details['neighbourhood'] = page.select_text(location_selector)
+    if not details.get('surface'):
+        surface_tag = page.find_string(SURFACE_TEXT_RE)
+        details['surface'] = surface_tag.strip() if surface_tag else None
+    if not details.get('rooms'):
+        rooms_tag = page.find_string(ROOMS_TEXT_RE)
+        if rooms_tag:
+            match = DIGITS_RE.search(rooms_tag)
+            details['rooms'] = match.group(1) if match else None
+    details['expenses'] = page_expenses(page)
+    return details
+
+
+def find_expenses(page):
+    """The amount following the first 'expensas' mention in the page's text."""
+    expensas_tag = page.find_string(EXPENSAS_TEXT_RE)
+    return expenses_in_text(expensas_tag) if expensas_tag else None
+
+
+class ExpensesReader:
+    """
+    The expenses of a detail page read in document order: those of the JSON-LD
+    blocks before the first other string mentioning 'expensas', else the amount
+    in that string, else those of the JSON-LD blocks after it. Once `value` is
+    set, the rest of the page cannot change it.
+    """
+
+    def __init__(self):
+        self.mentioned = False
+        self.before = None
+        self.text = None
+        self.after = None
+
+    def json_ld(self, expenses):
+        if not self.mentioned:
+            self.before = self.before or expenses
+        else:
+            self.after = self.after or expenses
+
+    def string(self, text):
+        if not self.mentioned and not self.before and mentions_expenses(text):
+            self.mentioned = True
+            self.text = expenses_in_text(text)
+
+    @property
+    def value(self):
+        return self.before or self.text or self.after
+
+
+def page_expenses(page):
+    """A detail page's expenses, read as `ExpensesReader` describes."""
+    reader = ExpensesReader()
+    for text, json_ld in page.strings():
+        if json_ld:
+            try:
+                reader.json_ld(json_ld_fields(json.loads(text or ''), {}).get('expenses'))
+            except ValueError:
+                pass
+        else:
+            reader.string(text)
+        if reader.value:
+            break
+    return reader.value
+
+
+def mentions_expenses(text):
+    return bool(text) and EXPENSAS_TEXT_RE.search(text) is not None
+
+
+def expenses_in_text(text):
+    """The amount in a text mentioning 'expensas', if it has one."""
+    match = EXPENSES_RE.search(text)
+    return match.group(1) if match else None
+
+
+class SearchQuery:
+    """
+    A search URL reduced to what decides its results: the portal's host, the
+    operation (alquiler, venta...), the property kinds, the zones, the price range
+    and the minimum surface. `extra` holds any other filter, which two queries
+    must share to be compared. Zones are slugs; a zone containing "/" is inside
+    the zone before it ("bsas-gba-norte/vicente-lopez").
+    """
+
+    def __init__(self, host, operation, kinds, zones=(), min_price=None, max_price=None, currency=None,
+                 min_surface=None, extra=()):
+        self.host = host
+        self.operation = operation
+        self.kinds = kinds
+        self.zones = frozenset(zones)
+        self.min_price = min_price
+        self.max_price = max_price
+        self.currency = currency
+        self.min_surface = min_surface
+        self.extra = tuple(extra)
+
+    def key(self):
+        """Everything but the zones: queries with the same key differ only in where they search."""
+        return (self.host, self.operation, self.kinds, self.min_price, self.max_price, self.currency,
+                self.min_surface, self.extra)
+
+    def __eq__(self, other):
+        return isinstance(other, SearchQuery) and self.key() == other.key() and self.zones == other.zones
+
+    def __hash__(self):
+        return hash((self.key(), self.zones))
+
+    def _covers_zone(self, zone):
+        return any(zone == mine or zone.startswith(mine + '/') for mine in self.zones)
+
+    def contains(self, other):
+        """Whether every result of `other` is also a result of this query."""
+        if (self.host, self.operation, self.kinds, self.extra) != (other.host, other.operation, other.kinds,
+                                                                     other.extra):
+            return False
+        if self.zones and not (other.zones and all(self._covers_zone(zone) for zone in other.zones)):
+            return False
+        if self.min_price is not None or self.max_price is not None:
+            if self.currency != other.currency:
+                return False
+            if self.min_price is not None and (other.min_price is None or other.min_price < self.min_price):
+                return False
+            if self.max_price is not None and (other.max_price is None or other.max_price > self.max_price):
+                return False
+        if self.min_surface is not None and (other.min_surface is None or other.min_surface < self.min_surface):
+            return False
+        return True
+
+
+class SiteAdapter:
+    """
+    Everything specific to one source: which URLs it handles, how its search
+    URLs and pages are read, how its results are paginated and how fast it may
+    be fetched. Subclasses override the methods their site supports.
+    """
+
+    # Registrable domain handled by the adapter, e.g. "zonaprop.com.ar"
+    domain = None
+    # Prefix for relative links found on the site's pages
+    base_url = None
+    # Requests per second, burst size and concurrent connections allowed
+    rate_limit = (0.5, 1, 1)
+    # SoupStrainer limiting search pages to their result cards in the fast backend
+    search_strainer = None
+    # Whether detail pages can be read while streaming (see streaming.py): their
+    # details come from JSON-LD, with the text fallbacks of `text_fallbacks`
+    streams_details = False
+    # Listings whose details are fetched per request from the site's JSON API, 0 without one
+    api_batch_size = 0
+
+    def matches(self, url):
+        host = (urlparse(url).hostname or '').lower()
+        return host == self.domain or host.endswith('.' + self.domain)
+
+    def absolute_url(self, href):
+        return href if href.startswith('http') else self.base_url + href
+
+    def parse_search(self, url):
+        """Extract zone, price range and minimum surface from a search URL."""
+        return None, None, None
+
+    def search_query(self, url):
+        """The SearchQuery of a search URL, or None if the site's URLs are not understood."""
+        return None
+
+    def search_url(self, query):
+        """A search URL for a query, or None if the site cannot express it in one URL."""
+        return None
+
+    def page_url(self, url, page):
+        """URL of the given results page (1-based) of a search, or None if unsupported."""
+        return urlparse(url)._replace(fragment='').geturl() if page == 1 else None
+
+    def extract_ads(self, url, page):
+        """Property records for every ad on a search result page."""
+        return []
+
+    def extract_details(self, url, page):
+        """Price, expenses, neighbourhood, surface and rooms from a property page."""
+        return empty_record(url)
+
+    def api_search_url(self, url, page):
+        """
+        URL of the given results page (1-based) of a search on the site's JSON
+        API, or None to crawl its HTML pages.
+        """
+        return None
+
+    def api_headers(self):
+        """Headers of API requests, e.g. their credentials."""
+        return None
+
+    def extract_api_ads(self, url, text):
+        """Property records for every listing of a search's API results page."""
+        return []
+
+    def api_items_url(self, urls):
+        """URL of an API request for the details of up to `api_batch_size` listings, or None."""
+        return None
+
+    def extract_api_items(self, urls, text):
+        """The records of the listings at `urls` in an API items response, by URL; missing ones are left out."""
+        return {}
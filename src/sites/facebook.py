@@ -0,0 +1,20 @@
+"""
+Facebook Marketplace adapter (limited: links only, no details).
+"""
+from bs4 import SoupStrainer
+
+from .base import SiteAdapter, card_record
+
+
+class FacebookAdapter(SiteAdapter):
+    domain = 'facebook.com'
+    base_url = 'https://www.facebook.com'
+    search_strainer = SoupStrainer(attrs={'data-testid': 'marketplace-item'})
+
+    def extract_ads(self, url, page):
+        ads = []
+        for ad in page.soup.select('[data-testid="marketplace-item"]'):
+            link_tag = ad.select_one('a')
+            if link_tag and link_tag.get('href'):
+                ads.append(card_record(self.absolute_url(link_tag['href']), None))
+        return ads
@@ -0,0 +1,379 @@
+"""
+MercadoLibre adapter.
+"""
+import json
+import re
+import unicodedata
+from urllib.parse import unquote, urlencode, urlparse, urlunparse
+
+from .base import (
+    SURFACE_RE, SURFACE_TEXT_RE, SearchQuery, SiteAdapter, add_feature, card_record, card_strainer, empty_record,
+    find_expenses, json_ld_details, merge_details
+)
+
+# Results per page on search listings, used to compute _Desde_N offsets
+PAGE_SIZE = 48
+
+ITEM_ID_RE = re.compile(r"MLA-?(\d+)")
+PRELOADED_STATE_RE = re.compile(
+    r'(?:__PRELOADED_STATE__\s*=\s*|<script[^>]*id="__PRELOADED_STATE__"[^>]*>)\s*(\{.*?\})\s*;?\s*</script>',
+    re.DOTALL,
+)
+PRICE_JSON_RE = re.compile(r'"price":\s*(\d+)')
+ADDRESS_LINE_JSON_RE = re.compile(r'"addressLine"\s*:\s*"([^"]+)"')
+SURFACE_JSON_RE = re.compile(r'"Superficie total"\s*[:,]\s*"?(\d+\s?m²)"?')
+ROOMS_JSON_RE = re.compile(r'"Ambientes"\s*[:,]\s*"?(\d+)"?')
+OPERATIONS = ('alquiler', 'venta', 'alquiler-temporal')
+# Filters in the last path segment of a search, e.g. _PriceRange_40000ARS-1500000ARS_NoIndex_True_TOTAL*AREA_60-*
+PRICE_FILTER_RE = re.compile(r'_PriceRange_(\d+)(ARS|USD)-(\d+)(ARS|USD)')
+SURFACE_FILTER_RE = re.compile(r'_TOTAL\*AREA_(\d+)-\*?')
+# Filters that do not change the results: pagination and search engine hints
+NOISE_FILTER_RE = re.compile(r'_Desde_\d+|_NoIndex_True')
+SUPERFICIE_LABEL_RE = re.compile(r"Superficie", re.IGNORECASE)
+AMBIENTES_LABEL_RE = re.compile(r"Ambientes", re.IGNORECASE)
+
+# Structured API backend, off unless an API URL is set (see set_api)
+API_URL = None
+API_TOKEN = None
+API_SITE = 'MLA'
+# The Inmuebles category, which all the portal's property searches are in
+API_CATEGORY = 'MLA1459'
+API_PAGE_SIZE = 50
+# Items per multiget request, the most the endpoint accepts
+API_BATCH_SIZE = 20
+API_ITEM_ATTRIBUTES = 'id,permalink,price,currency_id,location,attributes'
+
+
+def set_api(url, token=None):
+    """Read MercadoLibre through its JSON API at `url` (e.g. https://api.mercadolibre.com), or off for None."""
+    global API_URL, API_TOKEN
+    API_URL = url.rstrip('/') if url else None
+    API_TOKEN = token or None
+
+
+def item_id(url):
+    """The numeric item id in a listing URL, or None."""
+    match = ITEM_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def state_records(html):
+    """
+    Extract property records from the JSON state MercadoLibre preloads into its
+    search pages, keyed by item id. Both the API-like item shape (permalink,
+    price, location, attributes) and the newer "polycard" shape are supported.
+    """
+    match = PRELOADED_STATE_RE.search(html)
+    if not match:
+        return {}
+    try:
+        state = json.loads(match.group(1))
+    except ValueError:
+        return {}
+
+    records = {}
+    stack = [state]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        stack.extend(node.values())
+        record = None
+        if isinstance(node.get('permalink'), str):
+            record = _item_record(node)
+        elif isinstance(node.get('metadata'), dict) and isinstance(node.get('components'), list):
+            record = _polycard_record(node)
+        if record:
+            records[item_id(record['url']) or record['url']] = record
+    return records
+
+
+def _item_record(item):
+    record = empty_record(item['permalink'].split('#')[0])
+    price = item.get('price')
+    currency = item.get('currency_id')
+    if isinstance(price, dict):
+        currency = price.get('currency_id', currency)
+        price = price.get('amount')
+    if price is not None:
+        record['price'] = f"USD {price}" if currency == 'USD' else f"${price}"
+    location = item.get('location') or item.get('address') or {}
+    if isinstance(location, dict):
+        record['neighbourhood'] = location.get('address_line') or location.get('city_name')
+    for attribute in item.get('attributes') or []:
+        if not isinstance(attribute, dict):
+            continue
+        if attribute.get('id') == 'TOTAL_AREA' and attribute.get('value_name'):
+            surface_match = SURFACE_RE.search(attribute['value_name'])
+            record['surface'] = f"{surface_match.group(1)} m²" if surface_match else attribute['value_name']
+        elif attribute.get('id') == 'ROOMS' and attribute.get('value_name'):
+            record['rooms'] = attribute['value_name']
+    return record
+
+
+def _attribute(item, attribute_id):
+    for attribute in item.get('attributes') or []:
+        if isinstance(attribute, dict) and attribute.get('id') == attribute_id:
+            return attribute.get('value_name')
+    return None
+
+
+def _slug(name):
+    """A location name as the portal's URL slugs write it: "Vicente López" -> "vicente-lopez"."""
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return '-'.join(re.findall(r'[a-z0-9]+', ascii_name.lower()))
+
+
+def _item_in_query(item, query):
+    """
+    Whether an API search result passes a query's price, surface and zone
+    filters, which the API's text search does not apply exactly. Missing
+    details pass the filters on them.
+    """
+    price = item.get('price')
+    if isinstance(price, (int, float)) and item.get('currency_id') == query.currency:
+        if query.min_price is not None and price < query.min_price:
+            return False
+        if query.max_price is not None and price > query.max_price:
+            return False
+    surface = SURFACE_RE.search(_attribute(item, 'TOTAL_AREA') or '')
+    if surface and query.min_surface is not None and float(surface.group(1).replace(',', '.')) < query.min_surface:
+        return False
+    location = item.get('location') or {}
+    names = {_slug(location[level]['name']) for level in ('neighborhood', 'city', 'state')
+             if isinstance(location.get(level), dict) and location[level].get('name')}
+    if query.zones and names:
+        return any(zone.rsplit('/', 1)[-1] in names for zone in query.zones)
+    return True
+
+
+def _polycard_record(card):
+    url = card['metadata'].get('url')
+    if not isinstance(url, str) or 'MLA' not in url:
+        return None
+    if not url.startswith('http'):
+        url = 'https://' + url.lstrip('/')
+    record = empty_record(url.split('#')[0])
+    for component in card['components']:
+        if not isinstance(component, dict):
+            continue
+        if component.get('type') == 'price':
+            value = (component.get('price') or {}).get('current_price', {}).get('value')
+            if value is not None:
+                record['price'] = f"${value}"
+        elif component.get('type') == 'location':
+            record['neighbourhood'] = (component.get('location') or {}).get('text')
+        elif component.get('type') == 'attributes_list':
+            for feature in (component.get('attributes_list') or {}).get('texts') or []:
+                add_feature(record, feature)
+    return record
+
+
+def _labelled_value(page, label_re):
+    """Value next to the first table/definition list label matching label_re."""
+    for label in page.soup.find_all(['th', 'dt'], string=label_re):
+        value = label.find_next(['td', 'dd'])
+        if value:
+            return value.get_text(strip=True)
+    return None
+
+
+class MercadoLibreAdapter(SiteAdapter):
+    domain = 'mercadolibre.com.ar'
+    base_url = 'https://departamento.mercadolibre.com.ar'
+    rate_limit = (1.0, 2, 2)
+    search_strainer = card_strainer('ui-search-result', 'andes-card')
+
+    @property
+    def api_batch_size(self):
+        return API_BATCH_SIZE if API_URL else 0
+
+    def parse_search(self, url):
+        parsed = urlparse(url)
+        path = parsed.path.lower()
+        zone = price = min_surface = None
+        # Extract from query parameters
+        query = parsed.query
+        fragment = parsed.fragment
+        
+        # Try to extract price range from fragment or query
+        price_match = re.search(r'(\d+)ARS-(\d+)ARS', query + fragment)
+        if price_match:
+            price = f"${price_match.group(1)} - ${price_match.group(2)}"
+        
+        # Try to extract minimum surface
+        surface_match = re.search(r'AREA_(\d+)-', query + fragment)
+        if surface_match:
+            min_surface = surface_match.group(1)
+            
+        # Try to extract zone from path
+        zone_match = re.search(r'/([^/]+)/_', path)
+        if zone_match:
+            zone = zone_match.group(1).replace('-', ' ').title()
+        return zone, price, min_surface
+
+    def search_query(self, url):
+        parsed = urlparse(url)
+        if item_id(parsed.path):
+            return None
+        segments = [segment for segment in unquote(parsed.path).split('/') if segment]
+        filters = segments.pop() if segments and segments[-1].startswith('_') else ''
+        operation = next((segment for segment in segments if segment in OPERATIONS), None)
+        if operation is None:
+            return None
+        position = segments.index(operation)
+        min_price = max_price = currency = min_surface = None
+        filters = NOISE_FILTER_RE.sub('', filters)
+        match = PRICE_FILTER_RE.search(filters)
+        if match and match.group(2) == match.group(4):
+            filters = filters.replace(match.group(0), '')
+            min_price, max_price, currency = int(match.group(1)), int(match.group(3)), match.group(2)
+        match = SURFACE_FILTER_RE.search(filters)
+        if match:
+            filters = filters.replace(match.group(0), '')
+            min_surface = int(match.group(1))
+        # Locations nest: /bsas-gba-norte/vicente-lopez is inside /bsas-gba-norte
+        zone = '/'.join(segments[position + 1:])
+        extra = [filters] if filters else []
+        if parsed.query:
+            extra.append('?' + parsed.query)
+        return SearchQuery(parsed.hostname, operation, '/'.join(segments[:position]), [zone] if zone else [],
+                           min_price, max_price, currency, min_surface, extra)
+
+    def search_url(self, query):
+        # A search has a single location
+        if len(query.zones) > 1 or (query.min_price is None) != (query.max_price is None):
+            return None
+        segments = [segment for segment in [query.kinds, query.operation] + sorted(query.zones) if segment]
+        filters = ''
+        if query.min_price is not None:
+            filters += f"_PriceRange_{query.min_price}{query.currency}-{query.max_price}{query.currency}"
+        if query.min_surface is not None:
+            filters += f"_TOTAL*AREA_{query.min_surface}-*"
+        filters += ''.join(item for item in query.extra if not item.startswith('?'))
+        params = [item[1:] for item in query.extra if item.startswith('?')]
+        url = f"https://{query.host}/{'/'.join(segments)}/{filters}"
+        return url + (f"?{params[0]}" if params else '')
+
+    def page_url(self, url, page):
+        # Example: /alquiler/capital-federal/_Desde_49_PriceRange_40000ARS-1500000ARS
+        # (listings keep the portal's default order)
+        parsed = urlparse(url)._replace(fragment='')
+        base = re.sub(r'_Desde_\d+', '', parsed.path)
+        if page > 1:
+            offset = f"_Desde_{(page - 1) * PAGE_SIZE + 1}"
+            head, _, tail = base.rpartition('/')
+            base = f"{head}/{offset}{tail}" if tail.startswith('_') else f"{base.rstrip('/')}/{offset}"
+        return urlunparse(parsed._replace(path=base))
+
+    def extract_ads(self, url, page):
+        # Card data is completed with the page's preloaded JSON state
+        records = state_records(page.html)
+        ads = []
+        for ad in page.soup.select('.ui-search-result, .andes-card'):
+            link_tag = ad.select_one('a[href*="/MLA-"]')
+            if link_tag and link_tag.get('href'):
+                full_url = self.absolute_url(link_tag['href'])
+                record = card_record(
+                    full_url, ad,
+                    price='.andes-money-amount, .price-tag',
+                    location='.ui-search-item__location, .poly-component__location',
+                    features='.ui-search-card-attributes__attribute, .poly-attributes-list__item',
+                )
+                state_record = records.pop(item_id(full_url) or full_url, None)
+                if state_record:
+                    record = merge_details(state_record, record)
+                ads.append(record)
+        # Listings only present in the preloaded state
+        ads.extend(records.values())
+        return ads
+
+    def extract_details(self, url, page):
+        html = page.html
+        details = empty_record(url)
+        details.update(json_ld_details(page, with_expenses=False))
+        # Fallbacks
+        if not details['price']:
+            price_json = PRICE_JSON_RE.search(html)
+            if price_json:
+                details['price'] = f"${price_json.group(1)}"
+            else:
+                details['price'] = page.select_text('.price-tag-fraction, .ui-pdp-price__second-line, .price-tag-symbol, .price-tag, span[class*="price"]')
+        if not details['neighbourhood']:
+            neighbourhood_json = ADDRESS_LINE_JSON_RE.search(html)
+            if neighbourhood_json:
+                details['neighbourhood'] = neighbourhood_json.group(1)
+            else:
+                details['neighbourhood'] = page.select_text('.ui-vip-location__subtitle, .ui-pdp-media__title, .breadcrumb, [data-testid="address"]')
+        if not details['surface']:
+            # Try JSON, then table/definition list, then any text
+            surface_json = SURFACE_JSON_RE.search(html)
+            if surface_json:
+                details['surface'] = surface_json.group(1)
+            else:
+                details['surface'] = _labelled_value(page, SUPERFICIE_LABEL_RE)
+                if not details['surface']:
+                    surface_tag = page.find_string(SURFACE_TEXT_RE)
+                    details['surface'] = surface_tag.strip() if surface_tag else None
+        if not details['rooms']:
+            # Try JSON, then table/definition list, then table cells
+            rooms_json = ROOMS_JSON_RE.search(html)
+            if rooms_json:
+                details['rooms'] = rooms_json.group(1)
+            else:
+                details['rooms'] = _labelled_value(page, AMBIENTES_LABEL_RE)
+                if not details['rooms']:
+                    rooms_cell = page.soup.find('td', string=AMBIENTES_LABEL_RE)
+                    if rooms_cell and rooms_cell.find_next_sibling('td'):
+                        details['rooms'] = rooms_cell.find_next_sibling('td').get_text(strip=True)
+        # Expenses: look for 'expensas' in text
+        details['expenses'] = find_expenses(page)
+        return details
+
+    def api_search_url(self, url, page):
+        # Searches go to the Inmuebles category with the operation, kinds and zone
+        # as search text; filters with no known API equivalent keep the HTML backend
+        query = self.search_query(url)
+        if not API_URL or query is None or query.extra or len(query.zones) > 1:
+            return None
+        terms = [query.operation, query.kinds] + [zone.rsplit('/', 1)[-1] for zone in query.zones]
+        params = {
+            'category': API_CATEGORY,
+            'q': ' '.join(term.replace('/', ' ').replace('-', ' ') for term in terms if term),
+            'offset': (page - 1) * API_PAGE_SIZE,
+            'limit': API_PAGE_SIZE,
+        }
+        if query.currency == 'ARS' and query.min_price is not None and query.max_price is not None:
+            params['price'] = f"{query.min_price}-{query.max_price}"
+        return f"{API_URL}/sites/{API_SITE}/search?{urlencode(params)}"
+
+    def api_headers(self):
+        return {'Authorization': f"Bearer {API_TOKEN}"} if API_TOKEN else None
+
+    def extract_api_ads(self, url, text):
+        query = self.search_query(url)
+        results = json.loads(text).get('results') or []
+        return [_item_record(item) for item in results
+                if isinstance(item, dict) and isinstance(item.get('permalink'), str) and _item_in_query(item, query)]
+
+    def api_items_url(self, urls):
+        if not API_URL:
+            return None
+        ids = [f"{API_SITE}{item_id(url)}" for url in urls if item_id(url)]
+        return f"{API_URL}/items?{urlencode({'ids': ','.join(ids), 'attributes': API_ITEM_ATTRIBUTES}, safe=',')}"
+
+    def extract_api_items(self, urls, text):
+        # The multiget answers [{"code": 200, "body": {item}}, ...], with an error body for unknown ids
+        items = {}
+        for entry in json.loads(text):
+            if isinstance(entry, dict) and entry.get('code') == 200 and isinstance(entry.get('body'), dict):
+                items[entry['body'].get('id')] = entry['body']
+        records = {}
+        for url in urls:
+            item = items.get(f"{API_SITE}{item_id(url)}")
+            if item is not None:
+                records[url] = _item_record(dict(item, permalink=url))
+        return records
@@ -0,0 +1,125 @@
+"""
+Zonaprop adapter.
+"""
+import re
+from urllib.parse import urlparse, urlunparse
+
+from .base import SearchQuery, SiteAdapter, card_record, card_strainer, empty_record, json_ld_details, text_fallbacks
+
+# Parts of a search slug, e.g.
+# /casas-ph-alquiler-capital-federal-mas-50-m2-400000-1700000-pesos-orden-publicado-descendente-q-terraza.html
+SEARCH_SLUG_RE = re.compile(r'^/(?P<kinds>[a-z-]+?)-(?P<operation>alquiler-temporal|alquiler|venta)(?:-(?P<zone>.+))?$')
+PRICE_SLUG_RE = re.compile(r'-(\d+)-(\d+)-(pesos|dolar)')
+SURFACE_SLUG_RE = re.compile(r'-mas-(\d+)-m2')
+ORDER_SLUG_RE = re.compile(r'-(orden-[a-z]+-[a-z]+)')
+KEYWORD_SLUG_RE = re.compile(r'-(q-.+)$')
+# Order page_url crawls every search in
+DEFAULT_ORDER = 'orden-publicado-descendente'
+
+
+class ZonapropAdapter(SiteAdapter):
+    domain = 'zonaprop.com.ar'
+    base_url = 'https://www.zonaprop.com.ar'
+    rate_limit = (1.0, 2, 2)
+    streams_details = True
+    search_strainer = card_strainer('posting-card', 'aviso-row')
+
+    def parse_search(self, url):
+        path = urlparse(url).path.lower()
+        zone = price = min_surface = None
+        # Example: /departamentos-alquiler-capital-federal-mas-50-m2-35000-1000000-pesos-orden-antiguedad-ascendente-q-terraza.html
+        # Try to extract zone
+        zone_match = re.search(r'alquiler-([a-z\-]+)-mas', path)
+        if zone_match:
+            zone = zone_match.group(1).replace('-', ' ').title()
+        # Try to extract price range
+        price_match = re.search(r'(\d+)-(\d+)-pesos', path)
+        if price_match:
+            price = f"${price_match.group(1)} - ${price_match.group(2)}"
+        # Try to extract minimum surface
+        surface_match = re.search(r'mas-(\d+)-m2', path)
+        if surface_match:
+            min_surface = surface_match.group(1)
+        return zone, price, min_surface
+
+    def search_query(self, url):
+        parsed = urlparse(url)
+        path = parsed.path.lower()
+        if not path.endswith('.html') or path.startswith('/propiedades/'):
+            return None
+        stem = re.sub(r'-pagina-\d+$', '', path[:-len('.html')])
+        extra = []
+        for slug_re in (KEYWORD_SLUG_RE, ORDER_SLUG_RE):
+            match = slug_re.search(stem)
+            if match:
+                stem = stem[:match.start()] + stem[match.end():]
+                if match.group(1) != DEFAULT_ORDER:
+                    extra.insert(0, match.group(1))
+        min_price = max_price = currency = min_surface = None
+        match = PRICE_SLUG_RE.search(stem)
+        if match:
+            stem = stem[:match.start()] + stem[match.end():]
+            min_price, max_price = int(match.group(1)), int(match.group(2))
+            currency = 'ARS' if match.group(3) == 'pesos' else 'USD'
+        match = SURFACE_SLUG_RE.search(stem)
+        if match:
+            stem = stem[:match.start()] + stem[match.end():]
+            min_surface = int(match.group(1))
+        match = SEARCH_SLUG_RE.match(stem)
+        if not match:
+            return None
+        # Zone slugs of several zones are run together, so each is one opaque zone
+        zone = match.group('zone')
+        if parsed.query:
+            extra.append('?' + parsed.query)
+        return SearchQuery(parsed.hostname, match.group('operation'), match.group('kinds'), [zone] if zone else [],
+                           min_price, max_price, currency, min_surface, extra)
+
+    def search_url(self, query):
+        if len(query.zones) > 1 or (query.min_price is None) != (query.max_price is None):
+            return None
+        parts = [query.kinds, query.operation] + sorted(query.zones)
+        if query.min_surface is not None:
+            parts.append(f"mas-{query.min_surface}-m2")
+        if query.min_price is not None:
+            parts.append(f"{query.min_price}-{query.max_price}-{'pesos' if query.currency == 'ARS' else 'dolar'}")
+        params = [item[1:] for item in query.extra if item.startswith('?')]
+        parts += [item for item in query.extra if not item.startswith('?')]
+        return f"https://{query.host}/{'-'.join(parts)}.html" + (f"?{params[0]}" if params else '')
+
+    def page_url(self, url, page):
+        # Example: /departamentos-alquiler-orden-publicado-descendente-q-terraza-pagina-2.html
+        # Pages are crawled newest first, so the order replaces any other the search had
+        parsed = urlparse(url)._replace(fragment='')
+        # A search URL saved without its ".html" (or with a trailing slash) gets it back on its pages
+        path = parsed.path.rstrip('/')
+        stem = re.sub(r'-pagina-\d+$', '', path[:-len('.html')] if path.endswith('.html') else path)
+        match = KEYWORD_SLUG_RE.search(stem)
+        keyword = match.group(0) if match else ''
+        stem = ORDER_SLUG_RE.sub('', stem[:len(stem) - len(keyword)])
+        stem += f'-{DEFAULT_ORDER}{keyword}'
+        path = f'{stem}.html' if page == 1 else f'{stem}-pagina-{page}.html'
+        return urlunparse(parsed._replace(path=path))
+
+    def extract_ads(self, url, page):
+        ads = []
+        for ad in page.soup.select('.posting-card, .aviso-row'):
+            link_tag = ad.select_one('a[href*="/propiedades/"]')
+            if link_tag and link_tag.get('href'):
+                ads.append(card_record(
+                    self.absolute_url(link_tag['href']), ad,
+                    price='[data-qa="POSTING_CARD_PRICE"], .posting-price, .price',
+                    expenses='[data-qa="expensas"], .posting-expenses',
+                    location='[data-qa="POSTING_CARD_LOCATION"], .posting-location',
+                    features='[data-qa="POSTING_CARD_FEATURES"] span, .posting-features span',
+                ))
+        return ads
+
+    def extract_details(self, url, page):
+        details = empty_record(url)
+        details.update(json_ld_details(page))
+        return text_fallbacks(
+            page, details,
+            price_selector='.price-value, .price__fraction, .posting-price, .price, [data-qa="POSTING_CARD_PRICE"]',
+            location_selector='.title-location, .posting-location, .location, [data-qa="POSTING_CARD_LOCATION"]',
+        )
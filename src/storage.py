@@ -0,0 +1,480 @@
+"""
+Storage Module: SQLite-backed state for seen listings and their latest details.
+"""
+import argparse
+import csv
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+DETAIL_FIELDS = ['price', 'expenses', 'neighbourhood', 'surface', 'rooms']
+CSV_COLUMNS = ['url'] + DETAIL_FIELDS + ['scraped_at']
+# Listings with details: scraped ones, and those imported from the legacy CSV without a scraped_at
+HAS_DETAILS = f"(scraped_at IS NOT NULL OR {' OR '.join(f'{field} IS NOT NULL' for field in DETAIL_FIELDS)})"
+
+# SQLite's default limit on host parameters in a single statement
+MAX_VARIABLES = 900
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    url TEXT PRIMARY KEY,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    notified_at TEXT,
+    scraped_at TEXT,
+    price TEXT,
+    expenses TEXT,
+    neighbourhood TEXT,
+    surface TEXT,
+    rooms TEXT
+);
+CREATE INDEX IF NOT EXISTS listings_scraped_at ON listings (scraped_at);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    claimed_until REAL
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    url TEXT PRIMARY KEY,
+    cluster TEXT NOT NULL,
+    words TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    price REAL NOT NULL,
+    surface REAL,
+    rooms INTEGER
+);
+CREATE INDEX IF NOT EXISTS clusters_cluster ON clusters (cluster);
+CREATE INDEX IF NOT EXISTS clusters_price ON clusters (currency, price);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    bucket TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (bucket, url)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lsh_buckets_url ON lsh_buckets (url);
+CREATE TABLE IF NOT EXISTS prices (
+    url TEXT NOT NULL,
+    seen_at TEXT NOT NULL,
+    price REAL NOT NULL,
+    currency TEXT NOT NULL,
+    PRIMARY KEY (url, seen_at)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS http_cache (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    fingerprint TEXT,
+    checked_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS csv_rows (
+    filename TEXT NOT NULL,
+    url TEXT NOT NULL,
+    details TEXT,
+    PRIMARY KEY (filename, url)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checkpoints (
+    search_url TEXT PRIMARY KEY,
+    next_page INTEGER NOT NULL,
+    pending TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+def now() -> str:
+    """Current local time as an ISO timestamp, as stored in the database."""
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def details_digest(values: List[Optional[str]]) -> str:
+    """Digest of the detail values of a CSV row, to tell when a listing's details changed."""
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+
+def _chunks(items: List[str], size: int = MAX_VARIABLES) -> Iterable[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class DatabaseLock:
+    """
+    An exclusive lock shared by the threads of this process and by other
+    processes, on this host or on others using the same volume, held as a POSIX
+    record lock on the file at `path`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.thread_lock = threading.Lock()
+        self.file = None
+
+    def __enter__(self) -> 'DatabaseLock':
+        self.thread_lock.acquire()
+        try:
+            self.file = open(self.path, 'a')
+            fcntl.lockf(self.file, fcntl.LOCK_EX)
+        except Exception:
+            if self.file:
+                self.file.close()
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc) -> None:
+        try:
+            fcntl.lockf(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        finally:
+            self.file = None
+            self.thread_lock.release()
+
+
+class ListingStore:
+    """
+    Indexed store of every listing found: when it was first and last seen in a
+    search, when it was notified, and its latest scraped details. All writes are
+    batched into a single transaction per call.
+
+    A store's connection belongs to the thread that opened it, as SQLite
+    connections cannot be shared between threads: background threads open their
+    own store on the same path. Calls that read rows and then claim them, like
+    the outbox and search queue ones, take the write lock first (BEGIN
+    IMMEDIATE), so two processes cannot claim the same row.
+
+    New databases use WAL journaling; `journal_mode` switches an existing one,
+    e.g. to DELETE for a database on a volume shared between hosts, where WAL's
+    shared memory does not work.
+    """
+
+    def __init__(self, path: str, journal_mode: Optional[str] = None):
+        self.path = path
+        new = not os.path.exists(path)
+        # Wait for concurrent writers (daemon workers, other runs) instead of failing
+        self.conn = sqlite3.connect(path, timeout=30)
+        if journal_mode or new:
+            self.conn.execute(f"PRAGMA journal_mode={journal_mode or 'WAL'}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """Add the columns introduced after a database was created."""
+        for table, column, kind in [('outbox', 'claimed_until', 'REAL'), ('csv_rows', 'details', 'TEXT')]:
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                try:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    # Another process added it first
+                    pass
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM listings LIMIT 1").fetchone() is None
+
+    def _select_urls(self, query: str, urls: List[str], params: Tuple = ()) -> List[Tuple]:
+        """Run a query with an IN ({}) list of urls, in chunks; `params` come before the urls."""
+        rows = []
+        for chunk in _chunks(urls):
+            placeholders = ','.join('?' * len(chunk))
+            rows.extend(self.conn.execute(query.format(placeholders), list(params) + chunk))
+        return rows
+
+    def notified(self, urls: List[str]) -> Set[str]:
+        """The given listings that have already been notified."""
+        return {row[0] for row in self._select_urls(
+            "SELECT url FROM listings WHERE notified_at IS NOT NULL AND url IN ({})", urls)}
+
+    def split_seen_and_unseen(self, ads: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Split ads into already notified and new ones, recording them as seen now."""
+        urls = [ad['url'] for ad in ads]
+        notified = self.notified(urls)
+        self.touch(urls)
+        seen = [ad for ad in ads if ad['url'] in notified]
+        unseen = [ad for ad in ads if ad['url'] not in notified]
+        return seen, unseen
+
+    def touch(self, urls: List[str]) -> None:
+        """Insert new listings and bump last_seen on known ones."""
+        ts = now()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO listings (url, first_seen, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET last_seen = excluded.last_seen",
+                [(url, ts, ts) for url in urls],
+            )
+
+    def mark_notified(self, urls: List[str]) -> None:
+        """Record that the given listings have been notified."""
+        with self.conn:
+            self._set_notified(urls, now())
+
+    def _set_notified(self, urls: List[str], ts: str) -> None:
+        self.conn.executemany(
+            "INSERT INTO listings (url, first_seen, last_seen, notified_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET notified_at = COALESCE(notified_at, excluded.notified_at)",
+            [(url, ts, ts, ts) for url in urls],
+        )
+
+    def enqueue_messages(self, messages: List[Tuple[str, str]], urls: List[str],
+                         claimed_until: Optional[float] = None) -> List[int]:
+        """
+        Queue (chat_id, text) messages for delivery and mark the listings they
+        announce as notified, in one transaction. The messages are claimed by
+        the caller until `claimed_until` (epoch seconds). Returns their ids.
+        """
+        ts = now()
+        ids = []
+        with self.conn:
+            for chat_id, text in messages:
+                cursor = self.conn.execute(
+                    "INSERT INTO outbox (chat_id, text, created_at, claimed_until) VALUES (?, ?, ?, ?)",
+                    (chat_id, text, ts, claimed_until))
+                ids.append(cursor.lastrowid)
+            self._set_notified(urls, ts)
+        return ids
+
+    def claim_pending_messages(self, max_attempts: int, claimed_until: float) -> List[Tuple[int, str, str]]:
+        """
+        Claim the undelivered (id, chat_id, text) messages no other process is
+        sending until `claimed_until`, oldest first.
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                "SELECT id, chat_id, text FROM outbox WHERE attempts < ? "
+                "AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY id", (max_attempts, time.time())
+            ).fetchall()
+            self.conn.executemany("UPDATE outbox SET claimed_until = ? WHERE id = ?",
+                                  [(claimed_until, row[0]) for row in rows])
+        return rows
+
+    def release_messages(self, message_ids: List[int]) -> None:
+        """Give up the claim on undelivered messages, so the next run sends them."""
+        with self.conn:
+            self.conn.executemany("UPDATE outbox SET claimed_until = NULL WHERE id = ?",
+                                  [(message_id,) for message_id in message_ids])
+
+    def message_delivered(self, message_id: int) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+    def message_failed(self, message_id: int, error: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?, claimed_until = NULL WHERE id = ?",
+                (error, message_id))
+
+    def save_checkpoint(self, search_url: str, next_page: int, pending: List[Dict]) -> None:
+        """Record how far a search got: the next page to crawl (0 when done) and the ads awaiting details."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (search_url, next_page, pending, updated_at) VALUES (?, ?, ?, ?)",
+                (search_url, next_page, json.dumps(pending), now()),
+            )
+
+    def clear_checkpoint(self, search_url: str) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM checkpoints WHERE search_url = ?", (search_url,))
+
+    def load_checkpoints(self, urls: List[str], max_age_hours: float) -> Dict[str, Tuple[int, List[Dict]]]:
+        """The (next_page, pending ads) checkpoint of each given search, if recent enough to resume."""
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat(timespec='seconds')
+        rows = self._select_urls(
+            "SELECT search_url, next_page, pending, updated_at FROM checkpoints WHERE search_url IN ({})", urls)
+        return {url: (page, json.loads(pending)) for url, page, pending, updated in rows if updated >= cutoff}
+
+    def cluster_candidates(self, buckets: List[str], currency: str, min_price: float,
+                           max_price: float) -> List[Tuple]:
+        """(url, cluster, words, price, surface, rooms) of the listings in a price range sharing an LSH bucket."""
+        placeholders = ','.join('?' * len(buckets))
+        return self.conn.execute(
+            "SELECT url, cluster, words, price, surface, rooms FROM clusters "
+            "WHERE currency = ? AND price BETWEEN ? AND ? "
+            f"AND url IN (SELECT url FROM lsh_buckets WHERE bucket IN ({placeholders}))",
+            [currency, min_price, max_price] + buckets,
+        ).fetchall()
+
+    def clusters_of(self, urls: List[str]) -> Dict[str, str]:
+        """The cluster of each given listing already in the duplicate index."""
+        return dict(self._select_urls("SELECT url, cluster FROM clusters WHERE url IN ({})", urls))
+
+    def add_to_clusters(self, rows: List[Tuple], buckets: List[Tuple[str, str]]) -> None:
+        """
+        Store (url, cluster, words, currency, price, surface, rooms) rows and
+        their (bucket, url) entries, replacing the buckets of listings indexed before.
+        """
+        with self.conn:
+            self.conn.executemany("DELETE FROM lsh_buckets WHERE url = ?", [(row[0],) for row in rows])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO clusters (url, cluster, words, currency, price, surface, rooms) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany("INSERT OR IGNORE INTO lsh_buckets (bucket, url) VALUES (?, ?)", buckets)
+
+    def notified_clusters(self, clusters: List[str]) -> Set[str]:
+        """The given clusters with a listing that has already been notified."""
+        return {row[0] for row in self._select_urls(
+            "SELECT DISTINCT c.cluster FROM clusters c JOIN listings l ON l.url = c.url "
+            "WHERE l.notified_at IS NOT NULL AND c.cluster IN ({})", clusters)}
+
+    def detail_timestamps(self, urls: List[str]) -> Dict[str, datetime]:
+        """When the details of each of the given listings were last scraped."""
+        rows = self._select_urls(
+            "SELECT url, scraped_at FROM listings WHERE scraped_at IS NOT NULL AND url IN ({})", urls)
+        return {url: datetime.fromisoformat(ts) for url, ts in rows}
+
+    def details(self, urls: List[str]) -> Dict[str, Dict]:
+        """The stored record (details and scraped_at) of each given listing that has one."""
+        rows = self._select_urls(
+            f"SELECT {', '.join(CSV_COLUMNS)} FROM listings WHERE {HAS_DETAILS} AND url IN ({{}})", urls)
+        return {row[0]: dict(zip(CSV_COLUMNS, row)) for row in rows}
+
+    def upsert_details(self, properties: List[Dict], stamp: bool = True) -> None:
+        """
+        Store the latest scraped details of each property. Those without a
+        scraped_at are stamped with the current time, unless `stamp` is False,
+        which leaves it unknown so the details count as stale.
+        """
+        rows = []
+        ts = now()
+        for prop in properties:
+            values = [None if prop.get(field) is None else str(prop[field]) for field in DETAIL_FIELDS]
+            scraped_at = prop.get('scraped_at') or (ts if stamp else None)
+            rows.append([prop['url'], scraped_at or ts, scraped_at or ts, scraped_at] + values)
+        columns = ', '.join(DETAIL_FIELDS)
+        updates = ', '.join(f"{field} = excluded.{field}" for field in ['scraped_at'] + DETAIL_FIELDS)
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO listings (url, first_seen, last_seen, scraped_at, {columns}) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' * len(DETAIL_FIELDS))}) "
+                f"ON CONFLICT(url) DO UPDATE SET {updates}",
+                rows,
+            )
+
+    def cached_page(self, url: str) -> Optional[Tuple[Optional[str], Optional[str], int, Optional[str]]]:
+        """The (etag, last_modified, size, fingerprint) of a page as last processed, if any."""
+        return self.conn.execute(
+            "SELECT etag, last_modified, size, fingerprint FROM http_cache WHERE url = ?", (url,)).fetchone()
+
+    def remember_pages(self, rows: List[Tuple[str, Optional[str], Optional[str], int, Optional[str]]]) -> None:
+        """Store the (url, etag, last_modified, size, fingerprint) of processed pages."""
+        ts = now()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, size, fingerprint, checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", [row + (ts,) for row in rows])
+
+    def last_prices(self, urls: List[str]) -> List[Tuple[str, float, str]]:
+        """The latest recorded (url, price, currency) of each given listing."""
+        return self._select_urls(
+            "SELECT url, price, currency FROM prices p WHERE url IN ({}) "
+            "AND seen_at = (SELECT MAX(seen_at) FROM prices WHERE url = p.url)", urls)
+
+    def add_prices(self, rows: List[Tuple[str, str, float, str]]) -> None:
+        """Append (url, seen_at, price, currency) rows to the price history."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO prices (url, seen_at, price, currency) VALUES (?, ?, ?, ?)", rows)
+
+    def import_legacy(self, history_fp: str, csv_filename: str) -> Tuple[int, int]:
+        """One-time import of seen.txt and the scraped properties CSV."""
+        notified = []
+        if os.path.exists(history_fp):
+            with open(history_fp, "r") as f:
+                notified = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+            self.mark_notified(notified)
+        properties = []
+        if os.path.exists(csv_filename):
+            with open(csv_filename, newline='') as f:
+                for row in csv.DictReader(f):
+                    properties.append({key: (value or None) for key, value in row.items()})
+            # The CSV does not say when its details were scraped
+            self.upsert_details(properties, stamp=False)
+        return len(notified), len(properties)
+
+    def export_csv(self, filename: str) -> int:
+        """Write all listings with scraped details to a CSV file."""
+        rows = self.conn.execute(
+            f"SELECT {', '.join(CSV_COLUMNS)} FROM listings WHERE {HAS_DETAILS} ORDER BY first_seen"
+        ).fetchall()
+        with open(filename, "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            writer.writerows(rows)
+        # Later appends continue from the rows exported
+        with self.conn:
+            self.conn.execute("DELETE FROM csv_rows WHERE filename = ?", (filename,))
+            self.conn.executemany("INSERT INTO csv_rows (filename, url, details) VALUES (?, ?, ?)",
+                                  [(filename, row[0], details_digest(list(row[1:-1]))) for row in rows])
+        return len(rows)
+
+    def append_csv(self, filename: str, properties: List[Dict]) -> int:
+        """
+        Append the properties not in a CSV file yet, and a new row for those
+        whose details changed since their last row, starting the file with its
+        header if it does not exist. The URLs written to each file are indexed in
+        the database with a digest of their details, so the file is never read.
+        Returns the number of rows appended.
+        """
+        if not os.path.exists(filename):
+            # A file removed or rotated since starts over
+            with self.conn:
+                self.conn.execute("DELETE FROM csv_rows WHERE filename = ?", (filename,))
+        urls = list(dict.fromkeys(prop['url'] for prop in properties))
+        written = dict(self._select_urls(
+            "SELECT url, details FROM csv_rows WHERE filename = ? AND url IN ({})", urls, (filename,)))
+        rows, digests = {}, {}
+        for prop in properties:
+            row = [None if prop.get(column) is None else str(prop[column]) for column in CSV_COLUMNS]
+            digest = details_digest(row[1:-1])
+            if prop['url'] not in written or written[prop['url']] not in (None, digest):
+                rows[prop['url']] = row
+            # Rows indexed before digests were kept take the details they are seen with
+            digests[prop['url']] = digest
+        if rows:
+            new = not os.path.exists(filename)
+            with open(filename, "a", newline='') as f:
+                writer = csv.writer(f)
+                if new:
+                    writer.writerow(CSV_COLUMNS)
+                writer.writerows(rows.values())
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO csv_rows (filename, url, details) VALUES (?, ?, ?) "
+                "ON CONFLICT(filename, url) DO UPDATE SET details = excluded.details",
+                [(filename, url, digest) for url, digest in digests.items() if written.get(url) != digest])
+        return len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the listings database.")
+    parser.add_argument("command", choices=["import", "export"],
+                        help="import seen.txt and the CSV, or export the CSV")
+    parser.add_argument("--db", default="outputs/scraprop.db")
+    parser.add_argument("--history", default="outputs/seen.txt")
+    parser.add_argument("--csv", default="outputs/scraped_properties.csv")
+    args = parser.parse_args()
+
+    store = ListingStore(args.db)
+    if args.command == "import":
+        notified, properties = store.import_legacy(args.history, args.csv)
+        print(f"Imported {notified} seen URLs and {properties} properties into {args.db}")
+    else:
+        count = store.export_csv(args.csv)
+        print(f"Exported {count} properties to {args.csv}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
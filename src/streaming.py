@@ -0,0 +1,129 @@
+"""
+Streaming Module: Read detail pages while they download.
+
+Most of a portal's detail page is scripts, tracking code and footer markup that
+is never read. For adapters that take their details from JSON-LD, the response
+body is fed chunk by chunk to lxml's incremental HTML parser: each JSON-LD block
+is read as soon as its element closes, closed elements are dropped so the tree
+never holds the whole page, and the connection is closed as soon as every
+field is known. A page that ends before that is parsed as usual from the bytes
+read.
+"""
+import json
+from typing import Dict, Optional
+
+from lxml import etree
+
+from metrics import METRICS
+from sites import PROPERTY_FIELDS, ExpensesReader, empty_record, is_json_ld_script, json_ld_fields
+
+CHUNK_SIZE = 16 * 1024
+
+
+class DetailStream:
+    """
+    Incremental extraction of a detail page's JSON-LD fields, the first block
+    with a value for a field winning, and of its expenses as the adapters read
+    them (see ExpensesReader).
+
+    Strings are read in document order, as the adapters find them in the full
+    tree: each parser event completes the string before it (the text of the
+    element started last, or the tail of the one ended or the comment read
+    last). Script, style and comment strings count, as they do for BeautifulSoup.
+    """
+
+    def __init__(self, url: str, encoding: Optional[str] = None):
+        self.parser = etree.HTMLPullParser(events=('start', 'end', 'comment'), encoding=encoding)
+        self.json_ld: Dict = {}
+        self.url = url
+        self.expenses = ExpensesReader()
+        # Where the string being read goes: ('text', element started last) or
+        # ('tail', element ended or comment read last)
+        self.last = None
+
+    def feed(self, chunk: bytes) -> bool:
+        """Parse the next chunk of the page. Returns True once every field is known."""
+        self.parser.feed(chunk)
+        for event, element in self.parser.read_events():
+            # The string read since the previous event is complete
+            if self.last is not None:
+                part, previous = self.last
+                if part == 'text' and is_json_ld_script(previous.tag, previous.get('type')):
+                    self.read_json_ld(previous.text)
+                else:
+                    self.expenses.string(previous.text if part == 'text' else previous.tail)
+            if event == 'comment':
+                self.expenses.string(element.text)
+                self.last = ('tail', element)
+            elif event == 'start':
+                self.last = ('text', element)
+            else:
+                self.last = ('tail', element)
+                # Children have been read: only the element's tail is still needed
+                element.clear(keep_tail=True)
+        return self.complete()
+
+    def read_json_ld(self, text: Optional[str]) -> None:
+        try:
+            data = json.loads(text or '')
+        except ValueError:
+            return
+        json_ld_fields(data, self.json_ld, with_expenses=False)
+        self.expenses.json_ld(json_ld_fields(data, {}).get('expenses'))
+
+    def complete(self) -> bool:
+        """
+        Whether the rest of the page cannot change the details: the JSON-LD has
+        every field but expenses, and the expenses are known. As earlier blocks
+        win, later ones cannot change any of them.
+        """
+        return all(self.json_ld.get(field) for field in PROPERTY_FIELDS if field != 'expenses') \
+            and bool(self.expenses.value)
+
+    def record(self) -> Dict:
+        record = empty_record(self.url)
+        record.update(self.json_ld)
+        record['expenses'] = self.expenses.value
+        return record
+
+
+class StreamedResponse:
+    """
+    A response read by `read_details`: its status and headers, the bytes read,
+    and the record when the details were complete before the end of the page.
+    """
+
+    def __init__(self, response, content: bytes, record: Optional[Dict]):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.encoding = response.encoding
+        self.content = content
+        self.record = record
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+
+def read_details(url: str, domain: str, response) -> StreamedResponse:
+    """
+    Read a streamed detail page response until its details are complete. Only
+    successful responses are parsed on the way; others are read in full.
+    """
+    stream = DetailStream(url, response.encoding) if response.status_code == 200 else None
+    chunks = []
+    size = 0
+    record = None
+    for chunk in response.iter_content(CHUNK_SIZE):
+        chunks.append(chunk)
+        size += len(chunk)
+        if stream is not None and stream.feed(chunk):
+            record = stream.record()
+            break
+    METRICS.inc('http_bytes_total', size, domain=domain)
+    if record is not None:
+        METRICS.inc('streamed_early_stops_total', domain=domain)
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and 'Content-Encoding' not in response.headers:
+            METRICS.inc('streamed_bytes_skipped_total', max(0, int(length) - size), domain=domain)
+    return StreamedResponse(response, b''.join(chunks), record)
@@ -0,0 +1,176 @@
+"""
+Subscriptions Module: Route each listing to the subscribers whose filters it matches.
+
+Subscribers are read from a JSON file (SUBSCRIBERS, subscribers.json by default),
+each with a Telegram chat and optional filters:
+
+    [{"name": "ana", "chat_id": "123456", "zones": ["Palermo", "Villa Crespo"],
+      "min_price": 500000, "max_price": 900000, "currency": "ARS",
+      "min_surface": 40, "rooms": [2, 3]}]
+
+Without the file, every listing goes to TELEGRAM_ID. Filters are indexed, so a
+listing is matched against thousands of subscriptions without scanning them:
+zones in an inverted index of their words, rooms in an inverted index, and
+price and surface ranges in interval trees. As with the rules, a listing
+missing a value passes the filters on it.
+"""
+import json
+import math
+import os
+from bisect import bisect_right
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from records import missing, words
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class Subscription:
+    """One subscriber's chat and filters; None means no limit."""
+
+    def __init__(self, name: str, chat_id: str, zones: Optional[List[str]] = None,
+                 min_price: Optional[float] = None, max_price: Optional[float] = None, currency: str = 'ARS',
+                 min_surface: Optional[float] = None, max_surface: Optional[float] = None,
+                 rooms: Optional[List[int]] = None):
+        self.name = name
+        self.chat_id = str(chat_id)
+        self.zones = [' '.join(words(zone)) for zone in zones or []]
+        self.min_price = min_price
+        self.max_price = max_price
+        self.currency = currency.upper()
+        self.min_surface = min_surface
+        self.max_surface = max_surface
+        self.rooms = [int(count) for count in rooms or []]
+        # The interval trees need low <= high
+        for field, low, high in (('price', min_price, max_price), ('surface', min_surface, max_surface)):
+            if low is not None and high is not None and low > high:
+                raise ValueError(f"Subscription {name}: min_{field} {low} is above max_{field} {high}")
+
+
+class IntervalTree:
+    """
+    Static centered interval tree of (low, high, id) intervals, answering which
+    intervals contain a point in O(log n + matches).
+    """
+
+    def __init__(self, intervals: List[Tuple[float, float, int]]):
+        bounds = sorted(bound for low, high, _ in intervals for bound in (low, high) if math.isfinite(bound))
+        self.center = bounds[len(bounds) // 2] if bounds else 0.0
+        here = [i for i in intervals if i[0] <= self.center <= i[1]]
+        # Intervals around the center, by ascending low and by descending high
+        self.by_low = sorted(here)
+        self.lows = [low for low, _, _ in self.by_low]
+        self.by_high = sorted(here, key=lambda i: -i[1])
+        self.highs = [-high for _, high, _ in self.by_high]
+        left = [i for i in intervals if i[1] < self.center]
+        right = [i for i in intervals if i[0] > self.center]
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def query(self, point: float) -> Set[int]:
+        found: Set[int] = set()
+        node = self
+        while node is not None:
+            if point < node.center:
+                found.update(i for _, _, i in node.by_low[:bisect_right(node.lows, point)])
+                node = node.left
+            elif point > node.center:
+                found.update(i for _, _, i in node.by_high[:bisect_right(node.highs, -point)])
+                node = node.right
+            else:
+                found.update(i for _, _, i in node.by_low)
+                break
+        return found
+
+
+def _bound(value: Optional[float], default: float) -> float:
+    return default if value is None else float(value)
+
+
+class SubscriptionIndex:
+    """Subscriptions indexed by zone, rooms, price range (per currency) and surface range."""
+
+    def __init__(self, subscriptions: List[Subscription], usd_rate: Optional[float] = None):
+        self.subscriptions = subscriptions
+        self.usd_rate = usd_rate
+        self.all = set(range(len(subscriptions)))
+        self.by_zone: Dict[str, Set[int]] = {}
+        self.any_zone: Set[int] = set()
+        self.by_rooms: Dict[int, Set[int]] = {}
+        self.any_rooms: Set[int] = set()
+        prices: Dict[str, List[Tuple[float, float, int]]] = {}
+        surfaces = []
+        for i, sub in enumerate(subscriptions):
+            for zone in sub.zones:
+                self.by_zone.setdefault(zone, set()).add(i)
+            if not sub.zones:
+                self.any_zone.add(i)
+            for rooms in sub.rooms:
+                self.by_rooms.setdefault(rooms, set()).add(i)
+            if not sub.rooms:
+                self.any_rooms.add(i)
+            prices.setdefault(sub.currency, []).append(
+                (_bound(sub.min_price, -math.inf), _bound(sub.max_price, math.inf), i))
+            surfaces.append((_bound(sub.min_surface, -math.inf), _bound(sub.max_surface, math.inf), i))
+        # Longest zone name, in words, to look up in a listing's neighbourhood
+        self.max_zone_words = max((len(zone.split()) for zone in self.by_zone), default=0)
+        self.prices = {currency: (IntervalTree(intervals), {i for _, _, i in intervals})
+                       for currency, intervals in prices.items()}
+        self.surfaces = IntervalTree(surfaces)
+
+    def _convert(self, price: float, currency: str, to: str) -> Optional[float]:
+        if currency == to:
+            return price
+        if not self.usd_rate:
+            return None
+        return price * self.usd_rate if to == 'ARS' else price / self.usd_rate
+
+    def match(self, price: Optional[float], currency: str, surface: Optional[float], rooms: Optional[int],
+              neighbourhood: Optional[str]) -> Set[int]:
+        """The indexes of the subscriptions a listing matches."""
+        zone_words = words(neighbourhood)
+        if zone_words:
+            found = set(self.any_zone)
+            for n in range(1, self.max_zone_words + 1):
+                for start in range(len(zone_words) - n + 1):
+                    found |= self.by_zone.get(' '.join(zone_words[start:start + n]), set())
+        else:
+            found = set(self.all)
+        if found and rooms is not None:
+            found &= self.any_rooms | self.by_rooms.get(rooms, set())
+        if found and price is not None:
+            in_range: Set[int] = set()
+            for to, (tree, members) in self.prices.items():
+                converted = self._convert(price, currency, to)
+                in_range |= members if converted is None else tree.query(converted)
+            found &= in_range
+        if found and surface is not None:
+            found &= self.surfaces.query(surface)
+        return found
+
+    def route(self, frame: 'pd.DataFrame') -> Dict[str, List[str]]:
+        """The chats each normalized record should be sent to."""
+        routes = {}
+        for record in frame.itertuples(index=False):
+            matched = self.match(
+                None if missing(record.price) else float(record.price), str(record.currency),
+                None if missing(record.surface) else float(record.surface),
+                None if missing(record.rooms) else int(record.rooms), record.neighbourhood)
+            routes[record.url] = self.chats(matched)
+        return routes
+
+    def chats(self, matched: Optional[Set[int]] = None) -> List[str]:
+        """The distinct chats of the given subscriptions (all of them by default)."""
+        indexes = sorted(self.all if matched is None else matched)
+        return list(dict.fromkeys(self.subscriptions[i].chat_id for i in indexes))
+
+
+def load_subscriptions(env: Dict) -> SubscriptionIndex:
+    """The index of the subscribers file, or of a single TELEGRAM_ID subscriber without filters."""
+    path = env['subscribers']
+    if not os.path.exists(path):
+        return SubscriptionIndex([Subscription('default', env['telegram_id'])], env['usd_rate'])
+    with open(path) as f:
+        entries = json.load(f)
+    return SubscriptionIndex([Subscription(**entry) for entry in entries], env['usd_rate'])
@@ -2,18 +2,61 @@
 Utility functions for the property scraper.
 """
 import os
-from typing import List, Dict, Tuple
-import pandas as pd
-import requests
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
 from dotenv import load_dotenv
 
+from metrics import METRICS
+
+
+def _optional_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
 
 def load_environment():
     """Load environment variables from .env file."""
     load_dotenv()
     return {
         'telegram_bot_id': os.getenv("TELEGRAM_BOT_ID"),
-        'telegram_id': os.getenv("TELEGRAM_ID")
+        'telegram_id': os.getenv("TELEGRAM_ID"),
+        'rate_limits': os.getenv("RATE_LIMITS", ""),
+        'retries': int(os.getenv("RETRIES", "3")),
+        'breaker_threshold': int(os.getenv("BREAKER_THRESHOLD", "5")),
+        'breaker_cooldown_seconds': float(os.getenv("BREAKER_COOLDOWN_SECONDS", "300")),
+        'details_ttl_hours': float(os.getenv("DETAILS_TTL_HOURS", "24")),
+        'refresh_budget': int(os.getenv("REFRESH_BUDGET", "10")),
+        'max_pages': int(os.getenv("MAX_PAGES", "5")),
+        'parser_backend': os.getenv("PARSER_BACKEND", "fast"),
+        'parse_workers': int(os.getenv("PARSE_WORKERS") or os.cpu_count() or 1),
+        'metrics_json': os.getenv("METRICS_JSON", "outputs/run_summary.json"),
+        'metrics_prom': os.getenv("METRICS_PROM", "outputs/scraprop.prom"),
+        'session_cache': os.getenv("SESSION_CACHE", "outputs/session.json"),
+        'session_max_age_hours': float(os.getenv("SESSION_MAX_AGE_HOURS", "12")),
+        'poll_min_minutes': float(os.getenv("POLL_MIN_MINUTES", "5")),
+        'poll_max_minutes': float(os.getenv("POLL_MAX_MINUTES", "120")),
+        'poll_start_minutes': float(os.getenv("POLL_START_MINUTES", "30")),
+        'max_in_flight': int(os.getenv("MAX_IN_FLIGHT", "2")),
+        'digest_size': int(os.getenv("DIGEST_SIZE", "1")),
+        'notify_timeout_seconds': float(os.getenv("NOTIFY_TIMEOUT_SECONDS", "300")),
+        'batch_size': int(os.getenv("BATCH_SIZE", "20")),
+        'checkpoint_max_age_hours': float(os.getenv("CHECKPOINT_MAX_AGE_HOURS", "6")),
+        'archive_dir': os.getenv("ARCHIVE_DIR", ""),
+        'csv_file': os.getenv("CSV_FILE", ""),
+        'dedupe': os.getenv("DEDUPE", "1") != "0",
+        'max_total_cost': _optional_float("MAX_TOTAL_COST"),
+        'min_surface': _optional_float("MIN_SURFACE"),
+        'max_price_per_m2': _optional_float("MAX_PRICE_PER_M2"),
+        'rules_currency': os.getenv("RULES_CURRENCY", "ARS").upper(),
+        'usd_rate': _optional_float("USD_RATE"),
+        'min_price_drop': _optional_float("MIN_PRICE_DROP"),
+        'subscribers': os.getenv("SUBSCRIBERS", "subscribers.json"),
+        'http_cache': os.getenv("HTTP_CACHE", "1") != "0",
+        'stream_details': os.getenv("STREAM_DETAILS", "1") != "0",
+        'mercadolibre_api_url': os.getenv("MERCADOLIBRE_API_URL", ""),
+        'mercadolibre_token': os.getenv("MERCADOLIBRE_TOKEN", ""),
+        'journal_mode': os.getenv("SQLITE_JOURNAL_MODE") or None,
+        'lease_seconds': float(os.getenv("LEASE_SECONDS", "600"))
     }
 
 
@@ -23,51 +66,29 @@ def load_urls(file_path: str) -> List[str]:
         return [line.strip() for line in inp if line.strip()]
 
 
-def get_history(history_fp: str) -> List[str]:
-    """Load seen URLs from history file."""
-    try:
-        with open(history_fp, "r") as f:
-            return [line.strip() for line in f if line.strip()]
-    except FileNotFoundError:
-        return []
-
-
-def update_history(history_fp: str, new_urls: List[str]) -> None:
-    """Append new URLs to history file."""
-    with open(history_fp, "a") as f:
-        for url in new_urls:
-            f.write(url + "\n")
-
-
-def split_seen_and_unseen(ads: List[Dict], history_fp: str) -> Tuple[List[Dict], List[Dict]]:
-    """Split ads into seen and unseen based on history."""
-    history = get_history(history_fp)
-    seen = []
-    unseen = []
-    
-    for ad in ads:
-        if ad['url'] in history:
-            seen.append(ad)
-        else:
-            unseen.append(ad)
-    
-    return seen, unseen
-
-
-def notify_telegram(bot_id: str, user_id: str, message: str) -> bool:
-    """Send a message via Telegram bot."""
-    try:
-        url = f"https://api.telegram.org/bot{bot_id}/sendMessage"
-        data = {
-            "chat_id": user_id,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-        response = requests.post(url, data=data)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"Error sending Telegram message: {e}")
-        return False
+def select_stale_ads(ads: List[Dict], timestamps: Dict[str, datetime], ttl_hours: float,
+                     budget: Optional[int] = None, used: Optional[Dict[str, int]] = None) -> List[Dict]:
+    """
+    Select the seen ads whose stored details are missing or older than the TTL,
+    stalest first, taking at most `budget` ads per site (None means no limit).
+    `used` counts the ads already taken per site, across calls.
+    """
+    cutoff = datetime.now() - timedelta(hours=ttl_hours)
+    stale = [ad for ad in ads if timestamps.get(ad['url'], datetime.min) < cutoff]
+    stale.sort(key=lambda ad: timestamps.get(ad['url'], datetime.min))
+    if budget is None:
+        return stale
+    # Imported here: the site adapters behind it load the HTML parsers, which
+    # the scripts importing this module do not otherwise need at start-up
+    from fetcher import DEFAULT_RATE_LIMITS, get_domain
+    selected = []
+    per_site: Dict[str, int] = used if used is not None else {}
+    for ad in stale:
+        site = get_domain(ad['url'], DEFAULT_RATE_LIMITS)
+        if per_site.get(site, 0) < budget:
+            per_site[site] = per_site.get(site, 0) + 1
+            selected.append(ad)
+    return selected
 
 
 def format_property_details(details: dict) -> str:
@@ -86,6 +107,15 @@ def format_property_details(details: dict) -> str:
     return '\n'.join(lines)
 
 
+def format_price_drop(ad_url: str, previous_price: float, price: float, currency: str,
+                      property_details: dict) -> str:
+    """Format a Telegram message announcing a listing's lower price."""
+    symbol = 'USD' if currency == 'USD' else '$'
+    drop = (previous_price - price) / previous_price
+    header = f"Bajó de precio: {symbol} {previous_price:,.0f} → {symbol} {price:,.0f} (-{drop:.0%})"
+    return f"{header.replace(',', '.')}\n{format_property_details(property_details)}\n\n{ad_url}"
+
+
 def format_telegram_message(ad_url: str, search_details: tuple, property_details: dict = None) -> str:
     """Format a Telegram message with property and search details."""
     message = ""
@@ -103,27 +133,3 @@ def format_telegram_message(ad_url: str, search_details: tuple, property_details
             message += "\n"
     message += ad_url
     return message
-
-
-def save_properties_to_csv(properties: list, filename: str = "scraped_properties.csv") -> None:
-    """Save scraped properties to CSV file, ensuring all fields are present."""
-    if not properties:
-        print("No properties to save.")
-        return
-    # Ensure all expected columns are present
-    columns = ['url', 'price', 'expenses', 'neighbourhood', 'surface', 'rooms']
-    df = pd.DataFrame(properties)
-    for col in columns:
-        if col not in df:
-            df[col] = None
-    df = df[columns]
-    # Check if file exists to append or create new
-    if os.path.exists(filename):
-        existing_df = pd.read_csv(filename)
-        combined_df = pd.concat([existing_df, df], ignore_index=True)
-        combined_df = combined_df.drop_duplicates(subset=['url'], keep='last')
-        combined_df.to_csv(filename, index=False)
-        print(f"Appended {len(df)} properties to {filename}")
-    else:
-        df.to_csv(filename, index=False)
-        print(f"Saved {len(df)} properties to {filename}") 
\ No newline at end of file
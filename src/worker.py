@@ -0,0 +1,175 @@
+"""
+Worker Module: Scale the scraper out to several processes, on one host or on
+several sharing the outputs directory over a volume.
+
+    python src/worker.py --enqueue --processes 4   # start a round and work on it
+    python src/worker.py --processes 4             # join the round, e.g. on another host
+
+The searches of urls_to_scrap.txt are planned and queued in the listings
+database (see workqueue.py), and each worker leases one search at a time until
+none is left. Notifications are made under a lock on the database shared by all
+workers, so a listing found by several of them is still notified once.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import uuid
+from typing import Dict
+
+from metrics import METRICS
+from scraprop import (
+    DB_FILENAME, LOCK_FILENAME, URLS_FP, open_archive, open_fetcher, open_notifier, open_parse_pool, open_store, scrape
+)
+from storage import DatabaseLock, ListingStore
+from utils import load_environment, load_urls
+from workqueue import SearchQueue
+
+
+def enqueue(env: Dict) -> int:
+    """Plan the searches of the URLs file and queue them as a new round. Returns the number queued."""
+    from planner import plan_searches
+
+    urls = load_urls(URLS_FP)
+    store = open_store(DB_FILENAME, env['journal_mode'])
+    try:
+        jobs = [(search.url, list(search.originals)) for search in plan_searches(urls)]
+        return SearchQueue(store, env['lease_seconds']).enqueue(jobs)
+    finally:
+        store.close()
+
+
+class LeaseKeeper:
+    """Renew a job's lease from a background thread until stopped."""
+
+    def __init__(self, env: Dict, url: str, worker: str):
+        self.env = env
+        self.url = url
+        self.worker = worker
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="lease", daemon=True)
+
+    def __enter__(self) -> 'LeaseKeeper':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stopping.set()
+        self.thread.join()
+
+    def _run(self) -> None:
+        store = ListingStore(DB_FILENAME)
+        try:
+            queue = SearchQueue(store, self.env['lease_seconds'])
+            while not self.stopping.wait(self.env['lease_seconds'] / 3):
+                if not queue.renew(self.url, self.worker):
+                    METRICS.inc('leases_lost_total')
+                    print(f"Lost the lease on {self.url}; another worker may crawl it too")
+                    return
+        finally:
+            store.close()
+
+
+def work(env: Dict, worker: str) -> int:
+    """Lease and scrape searches until the queue is empty. Returns the number of searches scraped."""
+    METRICS.reset()
+    with METRICS.stage('setup'):
+        store = open_store(DB_FILENAME, env['journal_mode'])
+        queue = SearchQueue(store, env['lease_seconds'])
+        scraper, session_cache, fetcher = open_fetcher(env)
+        notifier = open_notifier(env, store)
+        archive = open_archive(env)
+        parser = open_parse_pool(env['parse_workers'], env['parser_backend'])
+    notify_lock = DatabaseLock(LOCK_FILENAME)
+    done = 0
+    try:
+        while True:
+            job = queue.lease(worker)
+            if job is None:
+                break
+            url, originals, taken_over = job
+            METRICS.inc('searches_leased_total')
+            if taken_over:
+                METRICS.inc('leases_expired_total')
+                print(f"[{worker}] Taking over {url} from a worker whose lease expired")
+            try:
+                with LeaseKeeper(env, url, worker):
+                    scrape(fetcher, store, notifier, env, originals, notify_lock, archive, parser)
+            except Exception as e:
+                METRICS.inc('failed_searches_total')
+                print(f"[{worker}] Error scraping {url}: {e}")
+                queue.release(url, worker)
+                continue
+            except BaseException:
+                queue.release(url, worker)
+                raise
+            queue.finish(url, worker)
+            done += 1
+            print(f"[{worker}] Finished {url} ({done} searches)")
+    finally:
+        fetcher.close()
+        if parser:
+            parser.shutdown()
+        if archive:
+            archive.close()
+        store.close()
+        undelivered = notifier.close(env['notify_timeout_seconds'])
+        if undelivered:
+            print(f"[{worker}] {undelivered} notifications not delivered yet, will retry on the next run")
+        # Each worker keeps its own metrics files
+        session_cache.save(scraper)
+        METRICS.write_json(per_worker(env['metrics_json'], worker))
+        METRICS.write_prometheus(per_worker(env['metrics_prom'], worker))
+    return done
+
+
+def per_worker(path: str, worker: str) -> str:
+    """A worker's own copy of an output file, e.g. outputs/scraprop.<worker>.prom."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{worker}{ext}"
+
+
+def run_worker(index: int) -> None:
+    env = load_environment()
+    worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    print(f"Worker {index} started as {worker}")
+    work(env, worker)
+
+
+def main():
+    """Run worker processes on the shared search queue."""
+    os.makedirs('outputs', exist_ok=True)
+    env = load_environment()
+    parser = argparse.ArgumentParser(description="Scrape the queued searches with several worker processes.")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="queue the searches of the URLs file as a new round first")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to run on this host")
+    args = parser.parse_args()
+
+    if not env['telegram_bot_id'] or not (env['telegram_id'] or os.path.exists(env['subscribers'])):
+        print("Error: Telegram bot credentials not found in .env file")
+        return
+    if args.enqueue:
+        try:
+            print(f"Queued {enqueue(env)} searches from {URLS_FP}")
+        except FileNotFoundError:
+            print(f"Error: {URLS_FP} not found")
+            return
+
+    # Workers are separate processes, each with its own fetcher, parse pool and notifier
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_worker, args=(i,), name=f"worker-{i}")
+               for i in range(max(1, args.processes))]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    store = open_store(DB_FILENAME, env['journal_mode'])
+    queued, leased, finished = SearchQueue(store, env['lease_seconds']).counts()
+    store.close()
+    print(f"Workers done: {finished} searches finished, {leased} leased elsewhere, {queued} left")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Work Queue Module: Searches shared out between worker processes through the
+listings database.
+
+Each job is a planned search and the original URLs it covers. Workers lease one
+job at a time for `lease_seconds` and renew the lease while they crawl it; the
+job of a worker that dies is leased again once its lease expires, and resumes
+from the search's checkpoint. As the queue is a table in the same SQLite file,
+workers on several hosts can share it over a common volume.
+"""
+import json
+import time
+from typing import List, Optional, Tuple
+
+from storage import ListingStore
+
+# Leases of a job before it is left alone, e.g. a search that crashes every worker
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_queue (
+    url TEXT PRIMARY KEY,
+    originals TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    leased_by TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS search_queue_pending ON search_queue (finished_at, queued_at);
+"""
+
+
+class SearchQueue:
+    """Leased queue of planned searches, in the listings database."""
+
+    def __init__(self, store: ListingStore, lease_seconds: float):
+        self.conn = store.conn
+        self.lease_seconds = lease_seconds
+        self.conn.executescript(SCHEMA)
+
+    def enqueue(self, jobs: List[Tuple[str, List[str]]]) -> int:
+        """
+        Start a round of (search url, original urls) jobs: new ones are added,
+        finished ones queued again, and those no longer listed dropped. Jobs
+        leased right now keep their lease. Returns the number of jobs queued.
+        """
+        ts = time.time()
+        urls = [url for url, _ in jobs]
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT INTO search_queue (url, originals, queued_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET originals = excluded.originals, queued_at = excluded.queued_at, "
+                "attempts = 0, finished_at = NULL",
+                [(url, json.dumps(originals), ts) for url, originals in jobs])
+            placeholders = ','.join('?' * len(urls))
+            self.conn.execute(
+                f"DELETE FROM search_queue WHERE url NOT IN ({placeholders}) "
+                "AND (lease_expires IS NULL OR lease_expires < ? OR finished_at IS NOT NULL)", urls + [ts])
+        return len(jobs)
+
+    def lease(self, worker: str) -> Optional[Tuple[str, List[str], bool]]:
+        """
+        Lease the oldest job that is neither finished nor leased, to `worker`.
+        Returns its (search url, original urls, whether an expired lease was
+        taken over), or None when there is nothing to do.
+        """
+        ts = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute(
+                "SELECT url, originals, lease_expires FROM search_queue "
+                "WHERE finished_at IS NULL AND attempts < ? AND (lease_expires IS NULL OR lease_expires < ?) "
+                "ORDER BY queued_at, url LIMIT 1", (MAX_ATTEMPTS, ts)).fetchone()
+            if row is None:
+                return None
+            # Finished and released jobs have no lease left, so one still set has expired
+            url, originals, expired = row
+            self.conn.execute(
+                "UPDATE search_queue SET leased_by = ?, lease_expires = ?, attempts = attempts + 1 WHERE url = ?",
+                (worker, ts + self.lease_seconds, url))
+        return url, json.loads(originals), expired is not None
+
+    def renew(self, url: str, worker: str) -> bool:
+        """Extend a lease still held by `worker`. Returns False if it was lost."""
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE search_queue SET lease_expires = ? WHERE url = ? AND leased_by = ? AND finished_at IS NULL",
+                (time.time() + self.lease_seconds, url, worker))
+        return cursor.rowcount == 1
+
+    def finish(self, url: str, worker: str) -> None:
+        """Mark a job leased by `worker` as done for this round."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE search_queue SET finished_at = ?, lease_expires = NULL WHERE url = ? AND leased_by = ?",
+                (time.time(), url, worker))
+
+    def release(self, url: str, worker: str) -> None:
+        """Give a job back unfinished so it can be leased again now. It still counts as an attempt."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE search_queue SET leased_by = NULL, lease_expires = NULL "
+                "WHERE url = ? AND leased_by = ? AND finished_at IS NULL", (url, worker))
+
+    def counts(self) -> Tuple[int, int, int]:
+        """The number of (queued, leased, finished) jobs."""
+        ts = time.time()
+        row = self.conn.execute(
+            "SELECT SUM(finished_at IS NULL AND (lease_expires IS NULL OR lease_expires < ?)), "
+            "SUM(finished_at IS NULL AND lease_expires >= ?), SUM(finished_at IS NOT NULL) FROM search_queue",
+            (ts, ts)).fetchone()
+        return tuple(count or 0 for count in row)
@@ -0,0 +1,220 @@
+"""
+Shared test setup: the modules under src/ are imported script-style, as the
+entry points do, and the tests run on the benchmark fixture pages, read
+directly or served by a stand-in for the portals.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+FIXTURES_DIR = os.path.join(ROOT, 'benchmarks', 'fixtures')
+
+
+@pytest.fixture(scope='session')
+def fixtures():
+    """The benchmark fixture index, with each site's search and detail HTML, and API responses, loaded."""
+    with open(os.path.join(FIXTURES_DIR, 'index.json')) as f:
+        index = json.load(f)
+    for entry in index.values():
+        for name in ('search', 'detail'):
+            with open(os.path.join(FIXTURES_DIR, entry[name]), encoding='utf-8') as f:
+                entry[name + '_html'] = f.read()
+        for name in ('api_search', 'api_items'):
+            if name in entry:
+                with open(os.path.join(FIXTURES_DIR, entry[name]), encoding='utf-8') as f:
+                    entry[name + '_json'] = json.load(f)
+    return index
+
+
+@pytest.fixture
+def parser_backend():
+    """Switch the parsing backend within a test, restoring the default afterwards."""
+    from sites import set_parser_backend
+    yield set_parser_backend
+    set_parser_backend('fast')
+
+
+class Portal(ThreadingHTTPServer):
+    """
+    Stands in for the portals and their APIs at http://127.0.0.1:<port>/<host>/<path>.
+    `pages` maps a URL, or a URL without its query, to its body or to a function
+    of the URL and request headers returning (status, headers, body); other URLs
+    get a 404. The URLs requested are logged in `requested`.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), PortalHandler)
+        self.pages = {}
+        self.requested = []
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def respond(self, url, headers):
+        self.requested.append(url)
+        page = self.pages.get(url, self.pages.get(url.split('?')[0]))
+        if page is None:
+            return 404, {}, b''
+        if callable(page):
+            return page(url, headers)
+        return 200, {}, page
+
+
+class PortalHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, headers, body = self.server.respond('https://' + unquote(self.path.lstrip('/')), self.headers)
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        headers = dict({'Content-Type': 'text/html; charset=utf-8'}, **headers)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalSession(requests.Session):
+    """Session that sends every request to the portal stand-in."""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        local = f"{self.base_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+        return super().request(method, local, *args, **kwargs)
+
+
+class StandInSite:
+    """
+    A Zonaprop search on the portal stand-in: results pages listing ads by
+    number, whose cards lack the details only their detail pages have. Pages are
+    served with an ETag, and answer 304 to a request revalidating it.
+    """
+    SEARCH_URL = 'https://www.zonaprop.com.ar/departamentos-alquiler-palermo.html'
+
+    def __init__(self, portal):
+        self.portal = portal
+        # URLs answered with a 304
+        self.not_modified = []
+
+    @staticmethod
+    def ad_url(number):
+        return f'https://www.zonaprop.com.ar/propiedades/departamento-{number}.html'
+
+    @staticmethod
+    def page_url(page):
+        from scraper import page_url
+        return page_url(StandInSite.SEARCH_URL, page)
+
+    def list_ads(self, page, numbers, price=None):
+        """
+        Serve results page `page` (1-based) listing the ads `numbers`, and their
+        detail pages, with `price` if given.
+        """
+        cards = ''.join(f'<div class="posting-card"><a href="/propiedades/departamento-{number}.html">'
+                        f'Departamento {number}</a></div>' for number in numbers)
+        self.serve(self.page_url(page), f'<html><body>{cards}</body></html>')
+        for number in numbers:
+            details = {'@type': 'Apartment', 'offers': {'price': str(price or 100000 + number)},
+                       'address': {'streetAddress': f'Gorriti {number}, Palermo'},
+                       'numberOfRooms': 2, 'floorSize': {'value': 40 + number}}
+            self.serve(self.ad_url(number), f'<html><head><script type="application/ld+json">{json.dumps(details)}'
+                                            '</script></head><body><p>Expensas $ 20000</p></body></html>')
+
+    def serve(self, url, body):
+        etag = '"' + hashlib.sha1(body.encode('utf-8')).hexdigest() + '"'
+
+        def respond(url, headers):
+            if headers.get('If-None-Match') == etag:
+                self.not_modified.append(url)
+                return 304, {'ETag': etag}, b''
+            return 200, {'ETag': etag}, body
+        self.portal.pages[url] = respond
+
+
+@pytest.fixture
+def site(portal):
+    """A StandInSite with no ads listed yet."""
+    return StandInSite(portal)
+
+
+@pytest.fixture
+def portal():
+    """A running portal stand-in, with no pages yet."""
+    portal = Portal()
+    thread = threading.Thread(target=portal.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield portal
+    portal.shutdown()
+    portal.server_close()
+
+
+class PortalRun:
+    """
+    Runs the pipeline on search URLs against the portal stand-in, without rate
+    limits, retries or parse workers, on one database kept across runs.
+    Notifications are left in its outbox.
+    """
+
+    def __init__(self, portal, db_path):
+        from fetcher import DEFAULT_RATE_LIMITS
+        from storage import ListingStore
+
+        self.portal = portal
+        self.db_path = db_path
+        self.store = ListingStore(db_path)
+        self.rate_limits = {domain: (1000.0, 10, 4) for domain in list(DEFAULT_RATE_LIMITS) + ['api.test']}
+        self.env = {
+            'telegram_id': '1', 'subscribers': os.path.join(os.path.dirname(db_path), 'subscribers.json'),
+            'batch_size': 20, 'max_pages': 5, 'details_ttl_hours': 24, 'refresh_budget': 10,
+            'checkpoint_max_age_hours': 6, 'parse_workers': 1, 'http_cache': True, 'stream_details': True,
+            'dedupe': False, 'csv_file': '', 'min_price_drop': None, 'usd_rate': None,
+            'max_total_cost': None, 'min_surface': None, 'max_price_per_m2': None, 'rules_currency': 'ARS',
+        }
+
+    def __call__(self, urls, archive=None, **env):
+        """
+        Scrape the searches of `urls`, saving pages to `archive` if given, with
+        `env` overriding the defaults. Returns the pipeline.
+        """
+        from fetcher import Fetcher
+        from notifier import TelegramNotifier
+        from pipeline import Pipeline
+        from planner import plan_searches
+
+        fetcher = Fetcher(LocalSession(self.portal.base_url), self.rate_limits, retries=0)
+        pipeline = Pipeline(fetcher, self.store, TelegramNotifier('test', self.db_path), dict(self.env, **env),
+                            archive=archive)
+        try:
+            pipeline.run(plan_searches(urls))
+        finally:
+            fetcher.close()
+        return pipeline
+
+    def notified(self):
+        """The texts of the messages queued so far, oldest first."""
+        return [row[0] for row in self.store.conn.execute("SELECT text FROM outbox ORDER BY id")]
+
+
+@pytest.fixture
+def portal_run(portal, tmp_path):
+    """A PortalRun on a scratch database."""
+    run = PortalRun(portal, str(tmp_path / 'listings.db'))
+    yield run
+    run.store.close()
@@ -0,0 +1,41 @@
+"""
+Fetched pages are kept in the raw page archive as they arrive.
+"""
+import threading
+
+import pytest
+
+from archive import PageArchive
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = PageArchive(str(tmp_path / 'archive'))
+    yield archive
+    archive.close()
+
+
+def test_pages_are_archived_off_the_pipeline_thread(site, portal_run, archive, monkeypatch):
+    site.list_ads(1, [1, 2, 3])
+    threads = []
+    put = archive.put
+
+    def recording_put(*args):
+        threads.append(threading.current_thread())
+        return put(*args)
+    monkeypatch.setattr(archive, 'put', recording_put)
+    portal_run([site.SEARCH_URL], archive=archive)
+    archived = {url: kind for url, kind, _, _ in archive.latest()}
+    assert archived[site.page_url(1)] == 'search'
+    assert all(archived[site.ad_url(number)] == 'detail' for number in (1, 2, 3))
+    assert threads and threading.main_thread() not in threads
+    assert len(portal_run.notified()) == 3
+
+
+def test_unchanged_pages_are_not_archived_again(site, portal_run, archive):
+    site.list_ads(1, [1, 2])
+    portal_run([site.SEARCH_URL], archive=archive)
+    fetches = archive.stats()['fetches']
+    portal_run([site.SEARCH_URL], archive=archive)
+    assert site.not_modified == [site.page_url(1)]
+    assert archive.stats()['fetches'] == fetches
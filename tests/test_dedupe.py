@@ -0,0 +1,83 @@
+"""
+Listings of the same property on several portals are grouped into one cluster.
+"""
+import pytest
+
+from dedupe import BANDS, DuplicateIndex, address_words, band_buckets, minhash, shingles
+from records import normalize
+from storage import ListingStore
+
+ZONAPROP = 'https://www.zonaprop.com.ar/propiedades/departamento-1.html'
+ARGENPROP = 'https://www.argenprop.com/departamento-en-alquiler-en-palermo-3-ambientes--1'
+MERCADOLIBRE = 'https://departamento.mercadolibre.com.ar/MLA-1-departamento-_JM'
+
+
+def listing(url, price='$ 500000', neighbourhood='Av. Santa Fe 3200, Palermo', surface='60 m²', rooms='3'):
+    return {'url': url, 'price': price, 'neighbourhood': neighbourhood, 'surface': surface, 'rooms': rooms}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ListingStore(str(tmp_path / 'listings.db'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def index(store):
+    return DuplicateIndex(store)
+
+
+def buckets(store, url):
+    return {row[0] for row in store.conn.execute("SELECT bucket FROM lsh_buckets WHERE url = ?", (url,))}
+
+
+def test_same_property_on_another_portal_joins_its_cluster(index):
+    assert index.assign(normalize([listing(ZONAPROP)])) == {ZONAPROP: ZONAPROP}
+    # Written differently and a little cheaper, in a later run
+    other = listing(ARGENPROP, price='$ 490.000', neighbourhood='Santa Fe 3200, Palermo, Capital Federal',
+                    surface='62 m²')
+    assert index.assign(normalize([other])) == {ARGENPROP: ZONAPROP}
+
+
+def test_duplicates_within_a_batch_are_matched(index):
+    clusters = index.assign(normalize([listing(ZONAPROP), listing(MERCADOLIBRE, price='$ 505000')]))
+    assert clusters == {ZONAPROP: ZONAPROP, MERCADOLIBRE: ZONAPROP}
+
+
+@pytest.mark.parametrize('changes', [
+    # Just over the price tolerance
+    {'price': '$ 530000'},
+    {'surface': '80 m²'},
+    {'rooms': '2'},
+    {'neighbourhood': 'Av. Santa Fe 3400, Palermo'},
+    {'neighbourhood': 'Thames 1200, Villa Crespo'},
+    {'price': 'USD 500000'},
+])
+def test_near_misses_get_their_own_cluster(index, changes):
+    index.assign(normalize([listing(ZONAPROP)]))
+    assert index.assign(normalize([listing(ARGENPROP, **changes)])) == {ARGENPROP: ARGENPROP}
+
+
+def test_listings_without_price_or_address_are_not_clustered(index):
+    assert index.assign(normalize([listing(ZONAPROP, price=None), listing(ARGENPROP, neighbourhood=None)])) == {}
+
+
+def test_reassigned_listing_keeps_its_cluster_and_only_its_new_buckets(index, store):
+    index.assign(normalize([listing(ZONAPROP)]))
+    index.assign(normalize([listing(ARGENPROP)]))
+    # Its price changed since: the cluster stays, the buckets follow the new details
+    assert index.assign(normalize([listing(ARGENPROP, price='$ 650000')])) == {ARGENPROP: ZONAPROP}
+    words = address_words('Av. Santa Fe 3200, Palermo')
+    expected = band_buckets(minhash(shingles(650000.0, 'ARS', 60.0, 3, words)))
+    assert buckets(store, ARGENPROP) == set(expected)
+    assert store.conn.execute("SELECT COUNT(*) FROM lsh_buckets WHERE url = ?", (ARGENPROP,)).fetchone()[0] == BANDS
+    assert len(buckets(store, ZONAPROP)) == BANDS
+
+
+def test_listing_matches_on_its_latest_details_only(index):
+    index.assign(normalize([listing(ZONAPROP)]))
+    index.assign(normalize([listing(ZONAPROP, price='$ 800000')]))
+    # A listing like its old details no longer shares its buckets or price range
+    assert index.assign(normalize([listing(ARGENPROP)])) == {ARGENPROP: ARGENPROP}
+    assert index.assign(normalize([listing(MERCADOLIBRE, price='$ 800000')])) == {MERCADOLIBRE: ZONAPROP}
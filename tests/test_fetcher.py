@@ -0,0 +1,181 @@
+"""
+Retries and per-domain circuit breakers of the fetcher, against a stub session.
+"""
+import pytest
+import requests
+
+import fetcher
+from fetcher import CircuitOpenError, Fetcher
+
+URL = 'https://www.zonaprop.com.ar/departamentos-alquiler.html'
+DOMAIN = 'zonaprop.com.ar'
+
+
+class Clock:
+    """Monotonic time that only moves when the fetcher sleeps or a test advances it."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = b''
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+    def close(self):
+        pass
+
+
+class Session:
+    """Answers each request with the next of `responses` (an exception is raised), then with 200."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def get(self, url, **options):
+        self.requests += 1
+        response = self.responses.pop(0) if self.responses else Response(200)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fetcher.time, 'monotonic', clock)
+    monkeypatch.setattr(fetcher.time, 'sleep', clock.sleep)
+    return clock
+
+
+def make_fetcher(session, retries=3, breaker_threshold=5, breaker_cooldown=300.0):
+    return Fetcher(session, {DOMAIN: (1000.0, 10, 1)}, retries=retries, max_backoff=60.0,
+                   breaker_threshold=breaker_threshold, breaker_cooldown=breaker_cooldown)
+
+
+@pytest.mark.parametrize('status', [429, 500, 502, 503, 504])
+def test_retryable_statuses_are_retried(clock, status):
+    session = Session(Response(status), Response(status))
+    assert make_fetcher(session).get(URL).status_code == 200
+    assert session.requests == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_connection_errors_are_retried(clock):
+    session = Session(requests.ConnectionError('reset'))
+    assert make_fetcher(session).get(URL).status_code == 200
+    assert session.requests == 2
+
+
+def test_retry_after_is_waited_for(clock):
+    session = Session(Response(429, {'Retry-After': '7'}))
+    assert make_fetcher(session).get(URL).status_code == 200
+    assert clock.sleeps == [7.0]
+
+
+def test_last_error_is_raised_once_retries_are_exhausted(clock):
+    session = Session(*[Response(503)] * 10)
+    with pytest.raises(requests.HTTPError):
+        make_fetcher(session, retries=2).get(URL)
+    assert session.requests == 3
+
+
+def test_other_statuses_are_not_retried(clock):
+    session = Session(Response(404))
+    assert make_fetcher(session).get(URL).status_code == 404
+    assert session.requests == 1
+
+
+@pytest.mark.parametrize('headers', [{'cf-mitigated': 'challenge'}, {'server': 'cloudflare'}])
+def test_challenges_are_not_retried(clock, headers):
+    session = Session(Response(503, headers))
+    assert make_fetcher(session).get(URL).status_code == 503
+    assert session.requests == 1
+    assert clock.sleeps == []
+
+
+def test_long_retry_after_opens_the_circuit(clock):
+    session = Session(Response(429, {'Retry-After': '600'}))
+    fetch = make_fetcher(session)
+    with pytest.raises(requests.HTTPError):
+        fetch.get(URL)
+    # The worker is not blocked for the wait; the domain's circuit is open instead
+    assert clock.sleeps == []
+    with pytest.raises(CircuitOpenError) as raised:
+        fetch.get(URL)
+    assert raised.value.seconds == 600
+    assert session.requests == 1
+    clock.now += 600
+    assert fetch.get(URL).status_code == 200
+
+
+def test_consecutive_failures_open_the_circuit_until_the_cooldown(clock):
+    session = Session(*[Response(500)] * 10)
+    fetch = make_fetcher(session, retries=10, breaker_threshold=3, breaker_cooldown=300.0)
+    with pytest.raises(requests.HTTPError):
+        fetch.get(URL)
+    assert session.requests == 3
+    opened_at = clock.now
+    with pytest.raises(CircuitOpenError):
+        fetch.get(URL)
+    clock.now = opened_at + 299
+    with pytest.raises(CircuitOpenError):
+        fetch.get(URL)
+    assert session.requests == 3
+    clock.now = opened_at + 300
+    session.responses = []
+    assert fetch.get(URL).status_code == 200
+    # The successful probe closed the circuit
+    assert fetch.get(URL).status_code == 200
+    assert session.requests == 5
+
+
+def test_failed_probe_opens_the_circuit_again(clock):
+    session = Session(*[Response(500)] * 4)
+    fetch = make_fetcher(session, retries=0, breaker_threshold=3)
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            fetch.get(URL)
+    clock.now += 300
+    with pytest.raises(requests.HTTPError):
+        fetch.get(URL)
+    assert session.requests == 4
+    with pytest.raises(CircuitOpenError):
+        fetch.get(URL)
+
+
+def test_a_single_probe_is_let_through_once_the_cooldown_is_over(clock):
+    breaker = fetcher.CircuitBreaker(threshold=2, cooldown=60)
+    breaker.failure()
+    assert breaker.failure()
+    clock.now += 60
+    breaker.allow(DOMAIN)
+    # Other requests wait for the probe's outcome
+    with pytest.raises(CircuitOpenError):
+        breaker.allow(DOMAIN)
+    breaker.success()
+    breaker.allow(DOMAIN)
+    breaker.allow(DOMAIN)
+
+
+def test_domains_have_separate_circuits(clock):
+    session = Session(Response(429, {'Retry-After': '600'}))
+    fetch = make_fetcher(session)
+    with pytest.raises(requests.HTTPError):
+        fetch.get(URL)
+    assert fetch.get('https://www.argenprop.com/departamentos').status_code == 200
@@ -0,0 +1,66 @@
+"""
+Pages are revalidated with the validators of their last processed copy, and a
+304 skips what the copy already gave.
+"""
+import pytest
+
+
+def details(store, numbers, site):
+    found = store.details([site.ad_url(number) for number in numbers])
+    return {url: (record['price'], record['neighbourhood'], record['surface']) for url, record in found.items()}
+
+
+def test_unchanged_search_page_ends_its_crawl(site, portal, portal_run):
+    site.list_ads(1, [1, 2, 3])
+    portal_run([site.SEARCH_URL])
+    assert len(portal_run.notified()) == 3
+    portal.requested.clear()
+    portal_run([site.SEARCH_URL])
+    # Neither the next page nor the ads' detail pages are requested
+    assert portal.requested == [site.page_url(1)]
+    assert site.not_modified == [site.page_url(1)]
+    assert len(portal_run.notified()) == 3
+
+
+def test_unchanged_detail_page_reuses_the_stored_details(site, portal, portal_run):
+    site.list_ads(1, [1, 2])
+    portal_run([site.SEARCH_URL])
+    before = details(portal_run.store, [1, 2], site)
+    assert len(before) == 2
+    # A new ad changes the search page, and the details of the others are due for a refresh
+    site.list_ads(1, [3, 1, 2])
+    portal_run([site.SEARCH_URL], details_ttl_hours=0)
+    assert sorted(site.not_modified) == [site.ad_url(1), site.ad_url(2)]
+    assert details(portal_run.store, [1, 2], site) == before
+    assert len(portal_run.notified()) == 3
+
+
+def test_changed_detail_page_is_read_again(site, portal_run):
+    site.list_ads(1, [1])
+    portal_run([site.SEARCH_URL])
+    site.list_ads(1, [2, 1], price=90000)
+    portal_run([site.SEARCH_URL], details_ttl_hours=0)
+    assert site.not_modified == []
+    assert portal_run.store.details([site.ad_url(1)])[site.ad_url(1)]['price'] == '90000'
+
+
+def test_validators_are_stored_once_the_batch_is_committed(site, portal, portal_run, monkeypatch):
+    site.list_ads(1, [1, 2, 3])
+
+    def interrupted(properties, stamp=True):
+        raise RuntimeError('interrupted')
+    with monkeypatch.context() as patch:
+        patch.setattr(portal_run.store, 'upsert_details', interrupted)
+        with pytest.raises(RuntimeError):
+            portal_run([site.SEARCH_URL])
+    # Nothing was committed, so the pages fetched are not taken as processed
+    assert portal_run.store.cached_page(site.page_url(1)) is None
+    assert portal_run.store.cached_page(site.ad_url(1)) is None
+
+    portal.requested.clear()
+    portal_run([site.SEARCH_URL])
+    assert site.not_modified == []
+    assert site.page_url(1) in portal.requested
+    assert len(portal_run.notified()) == 3
+    etag = portal_run.store.cached_page(site.page_url(1))[0]
+    assert etag and etag.startswith('"')
@@ -0,0 +1,120 @@
+"""
+MercadoLibre read through its JSON API, against a stand-in serving the fixture
+search and items responses.
+"""
+import copy
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from scraper import extract_ads, extract_api_ads, extract_api_items, needs_details
+from sites import set_mercadolibre_api
+from sites.mercadolibre import API_BATCH_SIZE, item_id
+
+API_URL = 'https://api.test'
+NO_RESULTS = {'paging': {'total': 0}, 'results': []}
+
+
+class StandInAPI:
+    """The fixture search response for the first results page of any search, and the fixture items by id."""
+
+    def __init__(self, search, items):
+        self.search = search
+        self.items = {item['body']['id']: item for item in items}
+        # The ids asked for by each items request
+        self.batches = []
+
+    def search_response(self, url, headers):
+        offset = parse_qs(urlsplit(url).query)['offset'][0]
+        return 200, {'Content-Type': 'application/json'}, json.dumps(self.search if offset == '0' else NO_RESULTS)
+
+    def items_response(self, url, headers):
+        ids = parse_qs(urlsplit(url).query)['ids'][0].split(',')
+        self.batches.append(ids)
+        body = [self.items.get(id_, {'code': 404, 'body': {'message': f"Item {id_} not found"}}) for id_ in ids]
+        return 200, {'Content-Type': 'application/json'}, json.dumps(body)
+
+
+@pytest.fixture
+def entry(fixtures):
+    return fixtures['mercadolibre']
+
+
+@pytest.fixture
+def api(portal, entry):
+    api = StandInAPI(copy.deepcopy(entry['api_search_json']), entry['api_items_json'])
+    portal.pages[API_URL + '/sites/MLA/search'] = api.search_response
+    portal.pages[API_URL + '/items'] = api.items_response
+    set_mercadolibre_api(API_URL)
+    yield api
+    set_mercadolibre_api(None)
+
+
+def api_id(url):
+    return 'MLA' + item_id(url)
+
+
+def stored(store):
+    return {row[0]: row[1:] for row in store.conn.execute(
+        "SELECT url, price, neighbourhood, surface, rooms FROM listings")}
+
+
+def test_search_results_are_filtered_locally(api, entry):
+    # The fixture search is for Capital Federal, 40000 to 1500000 ARS and at least 60 m²
+    item = copy.deepcopy(entry['api_search_json']['results'][0])
+    assert extract_api_ads(entry['search_url'], json.dumps({'results': [item]}))
+
+    def passes(**changes):
+        result = dict(copy.deepcopy(item), **changes)
+        return bool(extract_api_ads(entry['search_url'], json.dumps({'results': [result]})))
+
+    assert not passes(price=2000000)
+    assert not passes(price=30000)
+    # Prices in another currency are not compared
+    assert passes(price=500, currency_id='USD')
+    assert not passes(attributes=[{'id': 'TOTAL_AREA', 'value_name': '45 m²'}])
+    assert passes(attributes=[])
+    assert not passes(location={'city': {'name': 'La Plata'}, 'state': {'name': 'Buenos Aires'}})
+    assert passes(location={})
+
+
+def test_api_records_match_the_html_backend(api, entry):
+    api_records = {record['url']: record for record in extract_api_ads(entry['search_url'],
+                                                                       json.dumps(entry['api_search_json']))}
+    html_records = {record['url']: record for record in extract_ads(entry['search_url'], entry['search_html'])}
+    # The HTML search lists the listings the API filters out locally as well
+    assert api_records and set(api_records) < set(html_records)
+    for url, record in api_records.items():
+        assert record == html_records[url]
+    items = extract_api_items(list(api_records), json.dumps(entry['api_items_json']))
+    assert set(items) == set(api_records)
+    for url, record in items.items():
+        assert {key: value for key, value in api_records[url].items() if value is not None}.items() <= record.items()
+
+
+def test_pipeline_searches_through_the_api(api, entry, portal, portal_run):
+    pipeline = portal_run([entry['search_url']])
+    records = extract_api_ads(entry['search_url'], json.dumps(entry['api_search_json']))
+    incomplete = [record['url'] for record in records if needs_details(record)]
+    # Only the API is requested: the first results page, the empty second one, and the missing details
+    assert all(url.startswith(API_URL + '/') for url in portal.requested)
+    assert sorted(sum(api.batches, [])) == sorted(api_id(url) for url in incomplete)
+    assert pipeline.scraped == len(records)
+    listings = stored(portal_run.store)
+    assert set(listings) == {record['url'] for record in records}
+    assert all(listings[url][3] is not None for url in incomplete)
+    assert len(portal_run.notified()) == len(records)
+
+
+def test_items_are_requested_in_batches_of_20(api, entry, portal_run):
+    # Search results without rooms all need their details from the items endpoint
+    for result in api.search['results']:
+        result['attributes'] = [attribute for attribute in result['attributes'] if attribute['id'] != 'ROOMS']
+    records = extract_api_ads(entry['search_url'], json.dumps(api.search))
+    assert len(records) > API_BATCH_SIZE == 20
+    portal_run([entry['search_url']])
+    assert sorted(len(batch) for batch in api.batches) == [len(records) - 20, 20]
+    assert sorted(sum(api.batches, [])) == sorted(api_id(record['url']) for record in records)
+    listings = stored(portal_run.store)
+    assert all(listings[record['url']][3] is not None for record in records)
@@ -0,0 +1,70 @@
+"""
+Delivery of queued Telegram messages.
+"""
+import pytest
+
+import notifier
+from notifier import TelegramNotifier
+from storage import ListingStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ListingStore(str(tmp_path / 'listings.db'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def telegram(store, monkeypatch):
+    """A notifier whose posts answer with the statuses queued in `telegram.responses`, without pacing."""
+    monkeypatch.setattr(notifier, 'CHAT_RATE', 1000.0)
+    telegram = TelegramNotifier('bot', store.path)
+    telegram.responses = []
+    telegram.posts = 0
+    waits = []
+    telegram.abort.wait = lambda seconds: waits.append(seconds)
+    telegram.waits = waits
+
+    def post(chat_id, text):
+        telegram.posts += 1
+        return telegram.responses.pop(0) if telegram.responses else (200, None, None)
+    telegram.post = post
+    return telegram
+
+
+def outbox(store):
+    return store.conn.execute("SELECT id, attempts, last_error FROM outbox").fetchall()
+
+
+def test_message_is_delivered_after_a_rate_limit(store, telegram):
+    [message_id] = store.enqueue_messages([('1', 'hola')], [])
+    telegram.responses = [(429, 5.0, 'Too Many Requests')]
+    telegram._deliver(store, message_id, '1', 'hola')
+    assert telegram.waits == [5.0]
+    assert outbox(store) == []
+
+
+def test_endless_rate_limits_leave_the_message_in_the_outbox(store, telegram):
+    [message_id] = store.enqueue_messages([('1', 'hola')], [])
+    telegram.responses = [(429, 30.0, 'Too Many Requests')] * 100
+    telegram._deliver(store, message_id, '1', 'hola')
+    assert sum(telegram.waits) <= notifier.MAX_RETRY_AFTER_SECONDS
+    assert telegram.posts == notifier.MAX_RETRY_AFTER_SECONDS // 30 + 1
+    assert outbox(store) == [(message_id, 1, 'Too Many Requests')]
+
+
+def test_server_errors_are_retried_then_left_in_the_outbox(store, telegram):
+    [message_id] = store.enqueue_messages([('1', 'hola')], [])
+    telegram.responses = [(500, None, 'HTTP 500')] * 10
+    telegram._deliver(store, message_id, '1', 'hola')
+    assert telegram.posts == telegram.retries + 1
+    assert outbox(store) == [(message_id, 1, 'HTTP 500')]
+
+
+def test_client_errors_are_not_retried(store, telegram):
+    [message_id] = store.enqueue_messages([('1', 'hola')], [])
+    telegram.responses = [(403, None, 'Forbidden: bot was blocked by the user')]
+    telegram._deliver(store, message_id, '1', 'hola')
+    assert telegram.posts == 1
+    assert outbox(store) == [(message_id, 1, 'Forbidden: bot was blocked by the user')]
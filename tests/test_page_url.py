@@ -0,0 +1,33 @@
+"""
+Search pages are crawled newest first, whatever order the search was saved with.
+"""
+import pytest
+
+from scraper import page_url
+
+ZONAPROP = 'https://www.zonaprop.com.ar/'
+ARGENPROP = 'https://www.argenprop.com/'
+
+
+@pytest.mark.parametrize('url, page, expected', [
+    (ZONAPROP + 'departamentos-alquiler-palermo.html', 1,
+     ZONAPROP + 'departamentos-alquiler-palermo-orden-publicado-descendente.html'),
+    (ZONAPROP + 'departamentos-alquiler-palermo.html', 2,
+     ZONAPROP + 'departamentos-alquiler-palermo-orden-publicado-descendente-pagina-2.html'),
+    (ZONAPROP + 'departamentos-alquiler-palermo-q-terraza.html', 2,
+     ZONAPROP + 'departamentos-alquiler-palermo-orden-publicado-descendente-q-terraza-pagina-2.html'),
+    (ZONAPROP + 'departamentos-alquiler-palermo-orden-antiguedad-ascendente-q-terraza-pagina-3.html', 2,
+     ZONAPROP + 'departamentos-alquiler-palermo-orden-publicado-descendente-q-terraza-pagina-2.html'),
+    (ZONAPROP + 'departamentos-alquiler-palermo-orden-antiguedad-ascendente.html#top', 1,
+     ZONAPROP + 'departamentos-alquiler-palermo-orden-publicado-descendente.html'),
+    (ZONAPROP + 'departamentos-alquiler-palermo', 1,
+     ZONAPROP + 'departamentos-alquiler-palermo-orden-publicado-descendente.html'),
+    (ZONAPROP + 'departamentos-alquiler-palermo-q-terraza-pagina-3/', 2,
+     ZONAPROP + 'departamentos-alquiler-palermo-orden-publicado-descendente-q-terraza-pagina-2.html'),
+    (ARGENPROP + 'departamentos/alquiler/palermo', 2,
+     ARGENPROP + 'departamentos/alquiler/palermo?orden-masnuevos&pagina-2'),
+    (ARGENPROP + 'departamentos/alquiler/palermo?orden-menorprecio&pagina-4', 1,
+     ARGENPROP + 'departamentos/alquiler/palermo?orden-masnuevos'),
+])
+def test_page_url_orders_newest_first(url, page, expected):
+    assert page_url(url, page) == expected
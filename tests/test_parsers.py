@@ -0,0 +1,77 @@
+"""
+The fast parsing backend must find the same records as the full one, on search
+and detail pages.
+"""
+import re
+
+import pytest
+
+from scraper import extract_ads, extract_property_details
+
+PRELOADED_STATE_RE = re.compile(r'<script[^>]*__PRELOADED_STATE__.*?</script>', re.DOTALL)
+
+# Search pages whose result cards carry more classes than the one the strainer looks for
+MULTI_CLASS_VARIANTS = {
+    'zonaprop': [('class="posting-card"', 'class="posting-card is-featured"')],
+    'argenprop': [('class="listing__item"', 'class="listing__item listing__item--featured"'),
+                  ('class="card"', 'class="card card--highlighted"')],
+    'mercadolibre': [('class="andes-card poly-card"', 'class="ui-search-result ui-search-result--core"')],
+}
+
+
+def search_ads(backend, set_backend, url, html):
+    set_backend(backend)
+    return sorted(extract_ads(url, html), key=lambda ad: ad['url'])
+
+
+@pytest.mark.parametrize('site', ['zonaprop', 'argenprop', 'mercadolibre'])
+def test_fast_backend_matches_full_on_fixture_pages(fixtures, parser_backend, site):
+    entry = fixtures[site]
+    full = search_ads('full', parser_backend, entry['search_url'], entry['search_html'])
+    assert full
+    assert search_ads('fast', parser_backend, entry['search_url'], entry['search_html']) == full
+
+
+@pytest.mark.parametrize('site', ['zonaprop', 'argenprop', 'mercadolibre'])
+def test_fast_backend_matches_full_on_detail_pages(fixtures, parser_backend, site):
+    entry = fixtures[site]
+    parser_backend('full')
+    full = extract_property_details(entry['detail_url'], entry['detail_html'])
+    assert full['price']
+    parser_backend('fast')
+    assert extract_property_details(entry['detail_url'], entry['detail_html']) == full
+
+
+@pytest.mark.parametrize('site', sorted(MULTI_CLASS_VARIANTS))
+def test_fast_backend_keeps_cards_with_several_classes(fixtures, parser_backend, site):
+    entry = fixtures[site]
+    # Without MercadoLibre's preloaded state, its cards are the only source of ads
+    html = PRELOADED_STATE_RE.sub('', entry['search_html'])
+    for old, new in MULTI_CLASS_VARIANTS[site]:
+        assert old in html
+        html = html.replace(old, new)
+    full = search_ads('full', parser_backend, entry['search_url'], html)
+    assert full
+    assert search_ads('fast', parser_backend, entry['search_url'], html) == full
+
+
+DETAIL_URL = 'https://www.argenprop.com/departamento-en-alquiler-en-palermo--1'
+# Detail pages without JSON-LD, whose details all come from the text fallbacks
+FALLBACK_PAGES = [
+    '<!-- expensas $3 --><html><body><p class="price">$ 100</p></body></html>',
+    '<html><body><div class="card price featured"> USD <b>900</b><!-- x --><script>var a = 1;</script></div>'
+    '<span data-qa="location">Palermo, <i>CABA</i></span><p>60 m² totales</p><p>3 ambientes</p>'
+    '<p>Expensas $ 12.000</p></body></html>',
+    '<html><head><script>var s = "45 m2"; var e = "expensas $7";</script></head>'
+    '<body><div class="listing__location"> </div><div class="location">Belgrano</div></body></html>',
+    '<html><body><p>Sin datos</p></body></html>',
+    '',
+]
+
+
+@pytest.mark.parametrize('html', FALLBACK_PAGES)
+def test_fast_backend_matches_full_on_text_fallbacks(parser_backend, html):
+    parser_backend('full')
+    full = extract_property_details(DETAIL_URL, html)
+    parser_backend('fast')
+    assert extract_property_details(DETAIL_URL, html) == full
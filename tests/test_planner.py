@@ -0,0 +1,124 @@
+"""
+Searches of a run planned into fewer crawls, and their listings attributed back
+to the searches they match.
+"""
+from collections import namedtuple
+
+import pytest
+
+from planner import plan_searches
+from scraper import get_adapter
+
+ZONAPROP = 'https://www.zonaprop.com.ar/'
+ARGENPROP = 'https://www.argenprop.com/'
+MERCADOLIBRE = 'https://inmuebles.mercadolibre.com.ar/'
+
+Record = namedtuple('Record', 'price currency surface neighbourhood')
+
+
+@pytest.mark.parametrize('url', [
+    ZONAPROP + 'departamentos-alquiler-palermo.html',
+    ZONAPROP + 'casas-ph-alquiler-capital-federal-mas-50-m2-400000-1700000-pesos.html',
+    ZONAPROP + 'departamentos-venta-belgrano-mas-40-m2-100000-200000-dolar-q-terraza.html',
+    ARGENPROP + 'departamentos/alquiler/palermo',
+    ARGENPROP + 'casas-o-departamentos-o-ph/alquiler/belgrano-o-palermo/pesos-300000-1700000',
+    ARGENPROP + 'departamentos/venta/palermo/dolares-100000-200000?1-dormitorio',
+    MERCADOLIBRE + 'alquiler/capital-federal/',
+    MERCADOLIBRE + 'alquiler/bsas-gba-norte/vicente-lopez/_PriceRange_40000ARS-1500000ARS_TOTAL*AREA_60-*',
+    MERCADOLIBRE + 'departamentos/venta/capital-federal/palermo/_PriceRange_100000USD-200000USD',
+])
+def test_search_urls_round_trip(url):
+    adapter = get_adapter(url)
+    query = adapter.search_query(url)
+    assert query is not None
+    rebuilt = adapter.search_url(query)
+    assert adapter.search_query(rebuilt) == query
+    assert adapter.search_url(adapter.search_query(rebuilt)) == rebuilt
+
+
+def test_search_query_ignores_what_does_not_change_the_results():
+    adapter = get_adapter(ARGENPROP)
+    assert (adapter.search_query(ARGENPROP + 'departamentos/alquiler/palermo?orden-masnuevos&pagina-3')
+            == adapter.search_query(ARGENPROP + 'departamentos/alquiler/palermo'))
+    adapter = get_adapter(ZONAPROP)
+    assert (adapter.search_query(ZONAPROP + 'departamentos-alquiler-palermo-orden-publicado-descendente-pagina-2.html')
+            == adapter.search_query(ZONAPROP + 'departamentos-alquiler-palermo.html'))
+
+
+def test_identical_searches_are_crawled_once():
+    urls = [ZONAPROP + 'departamentos-alquiler-palermo.html',
+            ZONAPROP + 'departamentos-alquiler-palermo-pagina-2.html#top']
+    [search] = plan_searches(urls)
+    assert search.url == urls[0]
+    assert list(search.originals) == urls
+
+
+def test_nested_mercadolibre_location_is_served_by_the_wider_one():
+    wider = MERCADOLIBRE + 'alquiler/bsas-gba-norte/_PriceRange_40000ARS-1500000ARS'
+    nested = MERCADOLIBRE + 'alquiler/bsas-gba-norte/vicente-lopez/_PriceRange_50000ARS-1000000ARS_TOTAL*AREA_60-*'
+    [search] = plan_searches([nested, wider])
+    assert search.url == wider
+    assert set(search.originals) == {wider, nested}
+
+
+@pytest.mark.parametrize('other', [
+    # A sibling location, a wider price range and another operation are not contained
+    MERCADOLIBRE + 'alquiler/bsas-gba-norte-2/_PriceRange_40000ARS-1500000ARS',
+    MERCADOLIBRE + 'alquiler/bsas-gba-norte/vicente-lopez/_PriceRange_30000ARS-1000000ARS',
+    MERCADOLIBRE + 'venta/bsas-gba-norte/vicente-lopez/_PriceRange_50000ARS-1000000ARS',
+])
+def test_searches_not_contained_are_crawled_on_their_own(other):
+    wider = MERCADOLIBRE + 'alquiler/bsas-gba-norte/_PriceRange_40000ARS-1500000ARS'
+    assert [search.url for search in plan_searches([wider, other])] == [wider, other]
+
+
+def test_argenprop_zones_are_merged_into_one_search():
+    palermo = ARGENPROP + 'departamentos/alquiler/palermo/pesos-300000-1700000'
+    belgrano = ARGENPROP + 'departamentos/alquiler/belgrano-o-colegiales/pesos-300000-1700000'
+    other_price = ARGENPROP + 'departamentos/alquiler/saavedra/pesos-100000-500000'
+    merged, alone = plan_searches([palermo, belgrano, other_price])
+    assert merged.url == ARGENPROP + 'departamentos/alquiler/belgrano-o-colegiales-o-palermo/pesos-300000-1700000'
+    assert list(merged.originals) == [palermo, belgrano]
+    assert alone.url == other_price
+
+
+def test_zonaprop_zones_are_not_merged():
+    urls = [ZONAPROP + 'departamentos-alquiler-palermo.html', ZONAPROP + 'departamentos-alquiler-belgrano.html']
+    assert [search.url for search in plan_searches(urls)] == urls
+
+
+def test_urls_without_a_query_are_kept():
+    url = 'https://www.facebook.com/marketplace/buenosaires/propertyrentals'
+    [search] = plan_searches([url + '#top'])
+    assert search.url == url and search.query is None
+
+
+@pytest.fixture
+def merged():
+    palermo = ARGENPROP + 'departamentos/alquiler/palermo/pesos-300000-1700000'
+    narrow = ARGENPROP + 'departamentos/alquiler/palermo/pesos-500000-1000000'
+    belgrano = ARGENPROP + 'departamentos/alquiler/belgrano/pesos-300000-1700000'
+    [search] = plan_searches([palermo, narrow, belgrano])
+    assert list(search.originals) == [palermo, narrow, belgrano]
+    return search, palermo, narrow, belgrano
+
+
+def test_listings_are_attributed_to_the_searches_they_match(merged):
+    search, palermo, narrow, belgrano = merged
+    assert search.originals_for(Record(700000, 'ARS', 60, 'Palermo Soho, Capital Federal')) == [palermo, narrow]
+    assert search.originals_for(Record(400000, 'ARS', 60, 'Palermo')) == [palermo]
+    assert search.originals_for(Record(700000, 'ARS', 60, 'Belgrano')) == [belgrano]
+
+
+def test_missing_details_do_not_rule_searches_out(merged):
+    search, palermo, narrow, belgrano = merged
+    assert search.originals_for(Record(None, 'ARS', None, None)) == [palermo, narrow, belgrano]
+    assert search.originals_for(Record(400000, 'ARS', None, None)) == [palermo, belgrano]
+    # Prices in another currency are not compared
+    assert search.originals_for(Record(200, 'USD', None, 'Palermo')) == [palermo, narrow]
+    assert search.originals_for(None) == [palermo, narrow, belgrano]
+
+
+def test_listings_matching_no_search_are_attributed_to_all(merged):
+    search, palermo, narrow, belgrano = merged
+    assert search.originals_for(Record(9000000, 'ARS', 60, 'Saavedra')) == [palermo, narrow, belgrano]
@@ -0,0 +1,30 @@
+"""
+Normalized property records.
+"""
+import math
+
+import pandas as pd
+import pytest
+
+from records import missing, normalize
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, True), (math.nan, True), (pd.NA, True), (0, False), (0.0, False), ('', False), ('Palermo', False),
+])
+def test_missing(value, expected):
+    assert missing(value) is expected
+
+
+def test_missing_matches_frame_values():
+    frame = normalize([{'url': 'a', 'price': '$ 100', 'rooms': 2, 'neighbourhood': 'Palermo'},
+                       {'url': 'b'}])
+    for record in frame.itertuples(index=False):
+        for name in ('price', 'expenses', 'surface', 'rooms', 'neighbourhood'):
+            assert missing(getattr(record, name)) == pd.isna(getattr(record, name))
+
+
+def test_impossible_rooms_are_missing():
+    frame = normalize([{'url': url, 'rooms': rooms}
+                       for url, rooms in [('a', 3), ('b', '1200'), ('c', 1e6), ('d', '2 amb.'), ('e', None)]])
+    assert frame['rooms'].fillna(-1).tolist() == [3, -1, -1, 2, -1]
@@ -0,0 +1,62 @@
+"""
+A run interrupted partway through a search is resumed from its checkpoint by
+the next run, without fetching or notifying anything twice.
+"""
+from collections import Counter
+
+import pytest
+
+from pipeline import Pipeline
+
+
+@pytest.fixture
+def two_pages(site):
+    site.list_ads(1, [1, 2, 3])
+    site.list_ads(2, [4, 5, 6])
+    return site
+
+
+def interrupt(monkeypatch, committed):
+    """
+    Interrupt runs as they are about to request a second results page: once
+    the first page's ads are `committed` (fetched, stored and notified), or
+    right after the page itself was read.
+    """
+    submit_search, flush = Pipeline.submit_search, Pipeline.flush
+
+    def stop_before_next_page(self, url):
+        if self.next_page[url] == 1:
+            submit_search(self, url)
+        elif not committed:
+            raise KeyboardInterrupt
+
+    def flush_then_stop(self):
+        flush(self)
+        if not any(self.pending.values()):
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(Pipeline, 'submit_search', stop_before_next_page)
+    if committed:
+        monkeypatch.setattr(Pipeline, 'flush', flush_then_stop)
+
+
+@pytest.mark.parametrize('committed', [True, False])
+def test_interrupted_run_is_resumed(two_pages, portal, portal_run, monkeypatch, committed):
+    site = two_pages
+    with monkeypatch.context() as patch:
+        interrupt(patch, committed)
+        with pytest.raises(KeyboardInterrupt):
+            portal_run([site.SEARCH_URL], batch_size=1)
+    next_page, pending = portal_run.store.load_checkpoints([site.SEARCH_URL], 6)[site.SEARCH_URL]
+    assert next_page == 2
+    assert len(pending) == (0 if committed else 3)
+    assert len(portal_run.notified()) == (3 if committed else 0)
+
+    pipeline = portal_run([site.SEARCH_URL], batch_size=1)
+    # Every page is fetched once across both runs, and the first results page is not crawled again
+    assert Counter(portal.requested).most_common(1)[0][1] == 1
+    assert set(portal.requested) >= {site.page_url(1), site.page_url(2)} | {site.ad_url(n) for n in range(1, 7)}
+    notified = portal_run.notified()
+    assert len(notified) == len(set(notified)) == 6
+    assert pipeline.new_listings == {site.SEARCH_URL: 3 if committed else 6}
+    assert portal_run.store.load_checkpoints([site.SEARCH_URL], 6) == {}
@@ -0,0 +1,25 @@
+"""
+Checks of cached Cloudflare clearances.
+"""
+import requests
+
+from session import CLEARANCE_COOKIE, SessionCache
+
+
+def test_each_run_checks_its_first_response_again(tmp_path):
+    cache = SessionCache(str(tmp_path / 'session.json'))
+    scraper = requests.Session()
+    # First run: no cached clearance, then one is solved
+    assert not cache.check('zonaprop.com.ar', challenged=True)
+    assert cache.results == {'zonaprop.com.ar': 'miss'}
+    scraper.cookies.set(CLEARANCE_COOKIE, 'solved', domain='.zonaprop.com.ar')
+
+    # Without a new run, a later rejection goes unnoticed
+    assert not cache.check('zonaprop.com.ar', challenged=True)
+    cache.reset(scraper)
+    assert cache.check('zonaprop.com.ar', challenged=True)
+    assert cache.results == {'zonaprop.com.ar': 'rejected'}
+
+    cache.reset(scraper)
+    assert not cache.check('zonaprop.com.ar', challenged=False)
+    assert cache.results == {'zonaprop.com.ar': 'hit'}
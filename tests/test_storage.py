@@ -0,0 +1,84 @@
+"""
+The listings database.
+"""
+import csv
+import time
+
+import pytest
+
+from storage import ListingStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ListingStore(str(tmp_path / 'listings.db'))
+    yield store
+    store.close()
+
+
+def test_legacy_details_are_kept_but_stale(tmp_path, store):
+    history = tmp_path / 'seen.txt'
+    history.write_text('https://a.test/1\n')
+    legacy_csv = tmp_path / 'scraped_properties.csv'
+    with open(legacy_csv, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['url', 'price', 'expenses', 'neighbourhood', 'surface', 'rooms'])
+        writer.writerow(['https://a.test/1', '$ 100', '', 'Palermo', '40', '2'])
+    assert store.import_legacy(str(history), str(legacy_csv)) == (1, 1)
+
+    assert store.detail_timestamps(['https://a.test/1']) == {}
+    assert store.details(['https://a.test/1'])['https://a.test/1']['price'] == '$ 100'
+    exported = tmp_path / 'export.csv'
+    assert store.export_csv(str(exported)) == 1
+
+    store.upsert_details([{'url': 'https://a.test/1', 'price': '$ 90'}])
+    assert list(store.detail_timestamps(['https://a.test/1'])) == ['https://a.test/1']
+
+
+def outbox(store):
+    return store.conn.execute("SELECT id, attempts, claimed_until FROM outbox ORDER BY id").fetchall()
+
+
+def test_queued_messages_are_claimed_by_their_sender(store):
+    ids = store.enqueue_messages([('1', 'a'), ('2', 'b')], ['https://a.test/1'], time.time() + 60)
+    assert store.notified(['https://a.test/1', 'https://a.test/2']) == {'https://a.test/1'}
+    # Claimed by the run that queued them, so no other run sends them meanwhile
+    assert store.claim_pending_messages(3, time.time() + 60) == []
+    store.message_delivered(ids[0])
+    store.release_messages([ids[1]])
+    assert store.claim_pending_messages(3, time.time() + 60) == [(ids[1], '2', 'b')]
+    assert store.claim_pending_messages(3, time.time() + 60) == []
+
+
+def test_expired_claims_are_sent_by_the_next_run(store):
+    [message_id] = store.enqueue_messages([('1', 'a')], [], time.time() - 1)
+    assert store.claim_pending_messages(3, time.time() + 60) == [(message_id, '1', 'a')]
+
+
+def test_failed_messages_are_retried_until_max_attempts(store):
+    [message_id] = store.enqueue_messages([('1', 'a')], [])
+    for attempt in range(1, 3):
+        assert store.claim_pending_messages(2, time.time() + 60) == [(message_id, '1', 'a')]
+        store.message_failed(message_id, 'HTTP 500')
+        assert outbox(store) == [(message_id, attempt, None)]
+    assert store.claim_pending_messages(2, time.time() + 60) == []
+
+
+def test_csv_gets_a_new_row_when_details_change(store, tmp_path):
+    filename = str(tmp_path / 'stream.csv')
+    listing = {'url': 'https://a.test/1', 'price': '$ 100', 'rooms': 2, 'scraped_at': '2024-01-01T00:00:00'}
+    assert store.append_csv(filename, [listing]) == 1
+    # Scraped again with the same details: nothing to add
+    assert store.append_csv(filename, [dict(listing, scraped_at='2024-01-02T00:00:00')]) == 0
+    assert store.append_csv(filename, [dict(listing, price='$ 90', scraped_at='2024-01-03T00:00:00')]) == 1
+    assert store.append_csv(filename, [dict(listing, price='$ 90', scraped_at='2024-01-04T00:00:00')]) == 0
+    with open(filename, newline='') as f:
+        assert [row['price'] for row in csv.DictReader(f)] == ['$ 100', '$ 90']
+
+
+def test_csv_appends_continue_from_an_export(store, tmp_path):
+    store.upsert_details([{'url': 'https://a.test/1', 'price': '$ 100', 'rooms': 2}])
+    filename = str(tmp_path / 'export.csv')
+    assert store.export_csv(filename) == 1
+    assert store.append_csv(filename, [{'url': 'https://a.test/1', 'price': '$ 100', 'rooms': 2}]) == 0
+    assert store.append_csv(filename, [{'url': 'https://a.test/1', 'price': '$ 100', 'rooms': 3}]) == 1
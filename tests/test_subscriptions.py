@@ -0,0 +1,28 @@
+"""
+Routing listings to subscribers.
+"""
+import pytest
+
+from subscriptions import IntervalTree, Subscription, SubscriptionIndex
+
+
+def test_interval_tree_finds_the_intervals_containing_a_point():
+    intervals = [(0, 10, 0), (5, 15, 1), (20, 30, 2), (float('-inf'), 3, 3), (25, float('inf'), 4)]
+    tree = IntervalTree(intervals)
+    for point in (-5, 0, 4, 7, 10, 12, 17, 25, 40):
+        assert tree.query(point) == {i for low, high, i in intervals if low <= point <= high}
+
+
+def test_subscriptions_match_their_ranges():
+    index = SubscriptionIndex([
+        Subscription('ana', '1', zones=['Palermo'], min_price=500000, max_price=900000),
+        Subscription('bob', '2', min_surface=40, max_surface=40, rooms=[2]),
+    ])
+    assert index.chats(index.match(600000, 'ARS', 40, 2, 'Palermo Soho')) == ['1', '2']
+    assert index.chats(index.match(1000000, 'ARS', 50, 2, 'Palermo')) == []
+
+
+@pytest.mark.parametrize('bounds', [{'min_price': 900000, 'max_price': 500000}, {'min_surface': 80, 'max_surface': 40}])
+def test_inverted_ranges_are_rejected(bounds):
+    with pytest.raises(ValueError):
+        Subscription('ana', '1', **bounds)
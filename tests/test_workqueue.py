@@ -0,0 +1,86 @@
+"""
+The leased search queue shared by worker processes.
+"""
+import pytest
+
+import workqueue
+from storage import ListingStore
+from workqueue import MAX_ATTEMPTS, SearchQueue
+
+JOBS = [('https://a.test/search', ['https://a.test/search']),
+        ('https://b.test/search', ['https://b.test/search', 'https://b.test/other'])]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(workqueue.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    store = ListingStore(str(tmp_path / 'listings.db'))
+    yield SearchQueue(store, lease_seconds=60)
+    store.close()
+
+
+def test_jobs_are_leased_once_in_order(queue):
+    assert queue.enqueue(JOBS) == 2
+    assert queue.lease('w1') == (JOBS[0][0], JOBS[0][1], False)
+    assert queue.lease('w2') == (JOBS[1][0], JOBS[1][1], False)
+    assert queue.lease('w3') is None
+    assert queue.counts() == (0, 2, 0)
+
+
+def test_expired_lease_is_taken_over(queue, clock):
+    queue.enqueue(JOBS[:1])
+    queue.lease('w1')
+    clock.now += 30
+    assert queue.renew(JOBS[0][0], 'w1')
+    clock.now += 61
+    assert queue.lease('w2') == (JOBS[0][0], JOBS[0][1], True)
+    assert not queue.renew(JOBS[0][0], 'w1')
+    # The first worker's finish does not count once its lease is lost
+    queue.finish(JOBS[0][0], 'w1')
+    assert queue.counts() == (0, 1, 0)
+
+
+def test_later_rounds_are_not_takeovers(queue, clock):
+    for _ in range(3):
+        queue.enqueue(JOBS[:1])
+        url, _, takeover = queue.lease('w1')
+        assert not takeover
+        queue.finish(url, 'w1')
+        assert queue.lease('w1') is None
+        clock.now += 3600
+
+
+def test_released_job_is_leased_again_until_max_attempts(queue):
+    queue.enqueue(JOBS[:1])
+    for _ in range(MAX_ATTEMPTS):
+        url, _, takeover = queue.lease('w1')
+        assert not takeover
+        queue.release(url, 'w1')
+    assert queue.lease('w1') is None
+    # A new round gives the job its attempts back
+    queue.enqueue(JOBS[:1])
+    assert queue.lease('w1') is not None
+
+
+def test_enqueue_drops_unlisted_jobs_but_not_live_leases(queue, clock):
+    queue.enqueue(JOBS)
+    queue.lease('w1')
+    queue.enqueue([])
+    assert queue.counts() == (0, 1, 0)
+    clock.now += 61
+    queue.enqueue([])
+    assert queue.counts() == (0, 0, 0)